@@ -1,4 +1,5 @@
-from flask import Flask, jsonify, request, send_from_directory
+import click
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from functools import wraps
@@ -6,10 +7,14 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 import os
-import random
 import hashlib
 import secrets
+import socket
+import tempfile
+import threading
+import time
 import uuid
 
 app = Flask(__name__)
@@ -109,6 +114,14 @@ class CustomerOrder(db.Model):
 
 class JobOrder(db.Model):
     __tablename__ = 'job_orders'
+    __table_args__ = (
+        # Branch-scoped lists ordered by created_at, optionally filtered by status
+        db.Index('ix_job_orders_branch_created', 'branch_id', 'created_at'),
+        db.Index('ix_job_orders_branch_status_created', 'branch_id', 'status', 'created_at'),
+        # Admin lists / date-range reports across all branches
+        db.Index('ix_job_orders_status_created', 'status', 'created_at'),
+        db.Index('ix_job_orders_created_at', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     job_order_id = db.Column(db.String(50), unique=True, nullable=False)
     customer_id = db.Column(db.Integer, nullable=True)
@@ -121,6 +134,10 @@ class JobOrder(db.Model):
     items = db.Column(db.JSON, nullable=False)
     estimated_cost = db.Column(db.Float, default=0)
     actual_cost = db.Column(db.Float, default=0)
+    # Cost components stored when items change; NULL = not yet costed (backfilled on startup)
+    material_cost = db.Column(db.Float, nullable=True)
+    labor_cost = db.Column(db.Float, nullable=True)
+    overhead_cost = db.Column(db.Float, nullable=True)
     total_price = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), default='pending')  # pending, in_progress, completed, voided, cancelled
     payment_status = db.Column(db.String(50), default='unpaid')  # unpaid, partial, paid
@@ -138,6 +155,10 @@ class JobOrder(db.Model):
 
 class Worker(db.Model):
     __tablename__ = 'workers'
+    __table_args__ = (
+        db.Index('ix_workers_user_id', 'user_id'),
+        db.Index('ix_workers_branch_id', 'branch_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     worker_type = db.Column(db.String(50), nullable=False)  # seat_maker, sewer, etc.
@@ -151,6 +172,10 @@ class Worker(db.Model):
 
 class WorkTask(db.Model):
     __tablename__ = 'work_tasks'
+    __table_args__ = (
+        db.Index('ix_work_tasks_worker_status', 'worker_id', 'status'),
+        db.Index('ix_work_tasks_job_order_id', 'job_order_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     task_number = db.Column(db.String(50), unique=True, nullable=False)
     job_order_id = db.Column(db.String(50), nullable=False)  # Reference to job order
@@ -172,6 +197,12 @@ class WorkTask(db.Model):
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Branch schedule lookups and the double-booking check (branch + date + slot)
+        db.Index('ix_appointments_branch_date', 'branch_id', 'preferred_date'),
+        db.Index('ix_appointments_preferred_date', 'preferred_date'),
+        db.Index('ix_appointments_user_created', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     appointment_number = db.Column(db.String(50), unique=True, nullable=False)
     customer_name = db.Column(db.String(255), nullable=False)
@@ -197,6 +228,11 @@ class Appointment(db.Model):
 
 class ProductOrder(db.Model):
     __tablename__ = 'product_orders'
+    __table_args__ = (
+        db.Index('ix_product_orders_branch_created', 'branch_id', 'created_at'),
+        db.Index('ix_product_orders_pickup_branch', 'pickup_branch_id'),
+        db.Index('ix_product_orders_user_created', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
     customer_name = db.Column(db.String(255), nullable=False)
@@ -225,6 +261,10 @@ class ProductOrderTransfer(db.Model):
     """Tracks items that need to be physically transferred from a source branch
     to the pickup branch for a multi-branch premade order."""
     __tablename__ = 'product_order_transfers'
+    __table_args__ = (
+        db.Index('ix_product_order_transfers_source_created', 'source_branch_id', 'created_at'),
+        db.Index('ix_product_order_transfers_order_id', 'product_order_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_order_id = db.Column(db.Integer, db.ForeignKey('product_orders.id'), nullable=False)
     source_branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
@@ -256,6 +296,19 @@ class InventoryMaterial(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Branch inventory lists: is_archived = false ORDER BY material_type
+        db.Index('ix_inventory_materials_branch_archived_type', 'branch_id', 'is_archived', 'material_type'),
+        db.Index('ix_inventory_materials_archived_type', 'is_archived', 'material_type'),
+        # Low-stock scan only ever looks at active rows
+        db.Index(
+            'ix_inventory_materials_active_stock', 'stock_quantity',
+            sqlite_where=is_archived.is_(False), postgresql_where=is_archived.is_(False)
+        ),
+        # Case-insensitive name match when completing job orders
+        db.Index('ix_inventory_materials_lower_type', db.func.lower(material_type)),
+    )
+
     branch = db.relationship('Branch')
     supplier = db.relationship('Supplier', foreign_keys=[supplier_id])
 
@@ -274,10 +327,21 @@ class PremadeProduct(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Lookups by SKU at a specific branch (transfers, order completion)
+        db.Index('ix_premade_products_sku_branch', 'sku', 'branch_id'),
+        db.Index('ix_premade_products_branch_archived_name', 'branch_id', 'is_archived', 'name'),
+    )
+
     branch = db.relationship('Branch')
 
 class MaterialUsageLog(db.Model):
     __tablename__ = 'material_usage_logs'
+    __table_args__ = (
+        db.Index('ix_material_usage_logs_material_created', 'material_id', 'created_at'),
+        db.Index('ix_material_usage_logs_branch_created', 'branch_id', 'created_at'),
+        db.Index('ix_material_usage_logs_created_at', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     material_id = db.Column(db.Integer, db.ForeignKey('inventory_materials.id'), nullable=False)
     premade_product_id = db.Column(db.Integer, db.ForeignKey('premade_products.id'), nullable=True)
@@ -313,6 +377,12 @@ class SystemSetting(db.Model):
     value = db.Column(db.Text, default='')
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class IdSequence(db.Model):
+    """Named counters for generated identifiers (see next_sequence_value)."""
+    __tablename__ = 'id_sequences'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
     id = db.Column(db.Integer, primary_key=True)
@@ -329,6 +399,10 @@ class Supplier(db.Model):
 
 class MaterialWasteLog(db.Model):
     __tablename__ = 'material_waste_logs'
+    __table_args__ = (
+        db.Index('ix_material_waste_logs_branch_created', 'branch_id', 'created_at'),
+        db.Index('ix_material_waste_logs_material_created', 'material_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     material_id = db.Column(db.Integer, db.ForeignKey('inventory_materials.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
@@ -342,6 +416,41 @@ class MaterialWasteLog(db.Model):
     branch = db.relationship('Branch')
     logged_by_user = db.relationship('User', foreign_keys=[logged_by])
 
+class StockMovement(db.Model):
+    """Append-only ledger: one row per stock change of a material or premade product."""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        # Item history and "stock on date" range scans
+        db.Index('ix_stock_movements_item_created', 'item_type', 'item_id', 'created_at'),
+        db.Index('ix_stock_movements_branch_created', 'branch_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    item_type = db.Column(db.String(20), nullable=False)  # material, product
+    item_id = db.Column(db.Integer, nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
+    delta = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(30), nullable=False)  # one of STOCK_MOVEMENT_REASONS
+    reference = db.Column(db.String(255), nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StockSnapshot(db.Model):
+    """Per-branch stock levels as of the ledger position ledger_id."""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_branch_date', 'branch_id', 'snapshot_date'),
+        db.Index('ix_stock_snapshots_item_date', 'item_type', 'item_id', 'snapshot_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    # Last StockMovement id included in quantity (0 when the ledger was empty)
+    ledger_id = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class HistoricalInventoryData(db.Model):
     __tablename__ = 'historical_inventory_data'
     id = db.Column(db.Integer, primary_key=True)
@@ -359,7 +468,6 @@ class AIPredictionCache(db.Model):
     __tablename__ = 'ai_prediction_cache'
     id = db.Column(db.Integer, primary_key=True)
     status = db.Column(db.String(20), default='idle')  # idle, computing, done, error
-    predictions_json = db.Column(db.Text, default='[]')
     total_items = db.Column(db.Integer, default=0)
     processed_items = db.Column(db.Integer, default=0)
     error_message = db.Column(db.Text, nullable=True)
@@ -368,8 +476,89 @@ class AIPredictionCache(db.Model):
     upload_items = db.Column(db.Integer, default=0)
     last_uploaded_at = db.Column(db.DateTime, nullable=True)
 
+class MaterialPrediction(db.Model):
+    """Latest AI stock prediction for one historical item (one row per item_id)."""
+    __tablename__ = 'material_predictions'
+    __table_args__ = (
+        db.Index('ix_material_predictions_days_until_stockout', 'days_until_stockout'),
+        db.Index('ix_material_predictions_restock_by_date', 'restock_by_date'),
+        db.Index('ix_material_predictions_branch_days', 'branch_id', 'days_until_stockout'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.String(50), nullable=False, unique=True)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    material_type = db.Column(db.String(255), default='')
+    color = db.Column(db.String(100), default='')
+    pattern = db.Column(db.String(100), default='')
+    current_stock = db.Column(db.Float, default=0)
+    avg_daily_usage = db.Column(db.Float, default=0)
+    usage_rate = db.Column(db.Float, default=0)  # unrounded fitted rate
+    days_until_stockout = db.Column(db.Integer, default=9999)
+    stockout_date = db.Column(db.Date, nullable=True)
+    restock_by_date = db.Column(db.Date, nullable=True)
+    suggested_restock_qty = db.Column(db.Integer, default=0)
+    avg_lead_time_days = db.Column(db.Integer, default=7)
+    confidence = db.Column(db.String(20), default='low')
+    data_source = db.Column(db.String(20), default='xlsx')
+    data_points = db.Column(db.Integer, default=0)
+    engine = db.Column(db.String(30), default='mean')
+    has_current_inventory = db.Column(db.Boolean, default=False)
+    fingerprint = db.Column(db.String(64), nullable=True)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DemandForecast(db.Model):
+    """Stored job-order demand forecast for one future period of one series.
+    branch_id NULL is the all-branches series."""
+    __tablename__ = 'demand_forecasts'
+    __table_args__ = (
+        db.Index('ix_demand_forecasts_granularity_branch_period', 'granularity', 'branch_id', 'period_start'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # week, month
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    period_start = db.Column(db.Date, nullable=False)
+    forecasted_orders = db.Column(db.Float, default=0)
+    orders_lower = db.Column(db.Float, default=0)
+    orders_upper = db.Column(db.Float, default=0)
+    forecasted_revenue = db.Column(db.Float, default=0)
+    revenue_lower = db.Column(db.Float, default=0)
+    revenue_upper = db.Column(db.Float, default=0)
+    history_periods = db.Column(db.Integer, default=0)
+    engine = db.Column(db.String(20), default='holt')
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PredictionJob(db.Model):
+    """A queued or finished background forecasting run, claimed by a worker under
+    a lease. kind is 'predictions' (AI inventory predictions) or 'demand'
+    (job-order demand forecast)."""
+    __tablename__ = 'prediction_jobs'
+    __table_args__ = (
+        db.Index('ix_prediction_jobs_status_created', 'status', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), default='predictions')
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, error, cancelled
+    # Equal to kind while queued or running, NULL once finished: the unique
+    # constraint allows at most one active job of each kind.
+    active_key = db.Column(db.String(20), unique=True, nullable=True)
+    full_refit = db.Column(db.Boolean, default=False)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    total_items = db.Column(db.Integer, default=0)
+    processed_items = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
 class PaymentRecord(db.Model):
     __tablename__ = 'payment_records'
+    __table_args__ = (
+        db.Index('ix_payment_records_job_order_id', 'job_order_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     job_order_id = db.Column(db.Integer, db.ForeignKey('job_orders.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
@@ -814,6 +1003,10 @@ def run_migrations():
         "ALTER TABLE users ADD COLUMN lockout_until TIMESTAMP",
         # Expand password column for salted hashes (SQLite ignores length; PostgreSQL enforces it)
         "ALTER TABLE users ALTER COLUMN password TYPE VARCHAR(255)",
+        "ALTER TABLE prediction_jobs ADD COLUMN kind VARCHAR(20) DEFAULT 'predictions'",
+        "ALTER TABLE job_orders ADD COLUMN material_cost REAL",
+        "ALTER TABLE job_orders ADD COLUMN labor_cost REAL",
+        "ALTER TABLE job_orders ADD COLUMN overhead_cost REAL",
     ]
     for sql in migrations:
         try:
@@ -823,6 +1016,16 @@ def run_migrations():
         except Exception:
             pass  # Column already exists or statement not supported on this DB
 
+    # create_all() only builds indexes for brand-new tables; add any index
+    # declared on a model that an existing table is still missing.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db.engine.begin() as conn:
+                    index.create(bind=conn)
+            except Exception:
+                pass  # Index already exists
+
 def init_db():
     db.create_all()
     run_migrations()
@@ -834,12 +1037,10 @@ def init_db():
             db.session.add(Role(key=role['key'], name=role['name']))
 
     # Seed default system settings
-    default_settings = [
-        ('inventory_low_stock_threshold', '0'),
-    ]
-    for key, value in default_settings:
-        if not SystemSetting.query.filter_by(key=key).first():
-            db.session.add(SystemSetting(key=key, value=value))
+    existing_keys = {row[0] for row in db.session.query(SystemSetting.key).all()}
+    for key, (_, default) in SETTINGS_REGISTRY.items():
+        if key not in existing_keys:
+            db.session.add(SystemSetting(key=key, value=default))
 
     db.session.commit()
 
@@ -868,6 +1069,7 @@ def init_db():
     seed_default_users()
     seed_inventory_items()
     normalize_premade_units()
+    backfill_job_order_costs()
 
     # Seed default catalog items
     if CatalogItem.query.count() == 0:
@@ -980,6 +1182,31 @@ def ensure_db_initialized():
         # Ensure default users exist (safe no-op when already seeded)
         seed_default_users()
 
+def next_sequence_value(name, seed=None):
+    """Atomically increment and return the named counter. The increment is a
+    relative UPDATE, so the row lock it takes serializes concurrent callers
+    until their transactions end. A missing counter is created from seed()
+    (the last value already in use). Caller commits."""
+    table = IdSequence.__table__
+    increment = table.update().where(table.c.name == name).values(value=table.c.value + 1)
+    for _ in range(2):
+        if db.session.execute(increment).rowcount:
+            return db.session.execute(db.select(table.c.value).where(table.c.name == name)).scalar()
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(name=name, value=int(seed() if seed else 0) + 1))
+            return db.session.execute(db.select(table.c.value).where(table.c.name == name)).scalar()
+        except IntegrityError:
+            continue  # Another transaction created it first; increment that row
+    raise RuntimeError(f'Could not allocate a value from sequence {name}')
+
+def generate_finished_good_sku():
+    """Next free FG-### SKU from the 'finished_good_sku' sequence."""
+    while True:
+        sku = f"FG-{next_sequence_value('finished_good_sku', seed=lambda: db.session.query(db.func.max(PremadeProduct.id)).scalar() or 0):03d}"
+        if not db.session.query(PremadeProduct.id).filter_by(sku=sku).first():
+            return sku
+
 def generate_job_order_id(branch_code):
     """Generate unique job order ID"""
     year = datetime.now().year
@@ -1026,6 +1253,505 @@ def generate_delivery_number():
     count = len([d for d in deliveries if d['deliveryNumber'].startswith(f'DL-{year}')]) + 1
     return f'DL-{year}-{count:04d}'
 
+# ============================================
+# SYSTEM SETTINGS CACHE
+# ============================================
+
+# Known settings: key -> (type, default text). Values are stored as text in
+# system_settings and coerced to these types on read.
+SETTINGS_REGISTRY = {
+    'inventory_low_stock_threshold': (float, '0'),
+    # AI usage-rate engine: 'auto', or one of AI_PREDICTION_ENGINES to force it
+    'ai_forecast_engine': (str, 'auto'),
+    'ai_prophet_min_points': (int, '60'),
+    'ai_intermittent_zero_share': (float, '0.5'),
+    # Job-order overhead = rate x basis + fixed amount per order, where basis is one
+    # of COSTING_OVERHEAD_BASES ('prime' = material + labor, 'price' = total price)
+    'costing_overhead_basis': (str, 'material'),
+    'costing_overhead_rate': (float, '0.1'),
+    'costing_overhead_fixed': (float, '0'),
+}
+
+# How often (seconds) a worker re-checks the settings version stamp. Writes made
+# by this worker invalidate immediately; other workers pick them up within this window.
+SETTINGS_VERSION_CHECK_SECONDS = 5
+
+_settings_lock = threading.Lock()
+_settings_cache = {'values': None, 'stamp': None, 'checked_at': 0.0}
+
+def _settings_version_stamp():
+    """Cheap version stamp for system_settings: (row count, latest updated_at)."""
+    count, latest = db.session.query(
+        db.func.count(SystemSetting.id), db.func.max(SystemSetting.updated_at)
+    ).one()
+    return (count, latest.isoformat() if latest else None)
+
+def _coerce_setting(key, raw):
+    cast, default = SETTINGS_REGISTRY.get(key, (str, ''))
+    for candidate in (raw, default):
+        if candidate is None or candidate == '':
+            continue
+        try:
+            if cast is bool:
+                return str(candidate).strip().lower() in ('1', 'true', 'yes', 'on')
+            return cast(candidate)
+        except (TypeError, ValueError):
+            continue
+    return cast()
+
+def invalidate_settings_cache():
+    """Drop this worker's cached settings so the next read reloads them."""
+    with _settings_lock:
+        _settings_cache['values'] = None
+        _settings_cache['stamp'] = None
+        _settings_cache['checked_at'] = 0.0
+
+def get_all_settings():
+    """Return all system settings as raw strings, loaded once and served from memory.
+    The cache is reloaded when the version stamp in the database changes."""
+    now = time.monotonic()
+    with _settings_lock:
+        values = _settings_cache['values']
+        if values is not None and now - _settings_cache['checked_at'] < SETTINGS_VERSION_CHECK_SECONDS:
+            return values
+
+        stamp = _settings_version_stamp()
+        if values is None or stamp != _settings_cache['stamp']:
+            values = {s.key: s.value for s in SystemSetting.query.all()}
+            _settings_cache['values'] = values
+            _settings_cache['stamp'] = stamp
+        _settings_cache['checked_at'] = now
+        return values
+
+def get_setting(key, default=None):
+    """Typed read of a single system setting from the in-process cache."""
+    values = get_all_settings()
+    if key not in values and key not in SETTINGS_REGISTRY:
+        return default
+    return _coerce_setting(key, values.get(key))
+
+# The warehouse branch id, cached per process. Branch edits in this worker drop it
+# immediately; other workers re-read it after WAREHOUSE_CACHE_SECONDS.
+WAREHOUSE_CACHE_SECONDS = 60
+
+_warehouse_lock = threading.Lock()
+_warehouse_cache = {'id': None, 'loaded_at': None}
+
+def get_warehouse_branch_id():
+    """Id of the warehouse branch, or None when no branch is flagged as one."""
+    now = time.monotonic()
+    with _warehouse_lock:
+        loaded_at = _warehouse_cache['loaded_at']
+        if loaded_at is not None and now - loaded_at < WAREHOUSE_CACHE_SECONDS:
+            return _warehouse_cache['id']
+    warehouse_id = db.session.query(Branch.id).filter_by(is_warehouse=True).order_by(Branch.id).limit(1).scalar()
+    with _warehouse_lock:
+        _warehouse_cache['id'] = warehouse_id
+        _warehouse_cache['loaded_at'] = now
+    return warehouse_id
+
+def invalidate_warehouse_cache():
+    with _warehouse_lock:
+        _warehouse_cache['loaded_at'] = None
+
+# ============================================
+# STOCK MUTATIONS
+# ============================================
+
+# Stock column and ledger item type per stocked table
+STOCK_COLUMNS = {'inventory_materials': 'stock_quantity', 'premade_products': 'quantity'}
+STOCK_ITEM_TYPES = {'inventory_materials': 'material', 'premade_products': 'product'}
+STOCK_MOVEMENT_REASONS = (
+    'opening', 'adjustment', 'job_order', 'finished_good', 'waste', 'po_receipt',
+    'product_order', 'transfer_out', 'transfer_in', 'stock_take',
+)
+
+class InsufficientStock(Exception):
+    """A conditional decrement found less stock than requested. The caller must
+    roll back, since other rows of the same batch may already be updated."""
+
+    def __init__(self, row_id, name, available, required):
+        self.row_id = row_id
+        self.name = name
+        self.available = available
+        self.required = required
+        super().__init__(f"Insufficient stock for {name}. Available: {available:g}, required: {required:g}")
+
+def record_stock_movements(model, movements, reason, reference=None, user_id=None):
+    """Append [(row id, branch id, delta)] to the stock ledger. Zero deltas are
+    skipped. Use directly only for absolute stock writes (create / manual edit);
+    relative changes go through apply_stock_deltas(). Caller commits."""
+    rows = [{
+        'item_type': STOCK_ITEM_TYPES[model.__table__.name],
+        'item_id': pk,
+        'branch_id': branch_id,
+        'delta': float(delta),
+        'reason': reason,
+        'reference': (reference or '')[:255] or None,
+        'created_by': user_id,
+        'created_at': datetime.utcnow(),
+    } for pk, branch_id, delta in movements if delta]
+    if rows:
+        db.session.execute(StockMovement.__table__.insert(), rows)
+
+def _record_manual_stock_change(model, row, previous_branch_id, quantity=None):
+    """Set stock outright from an edit form (quantity None leaves it as is) and
+    append the matching ledger entries; a branch move is recorded as leaving the
+    old branch and arriving at the new one.
+
+    Deltas are computed in SQL from the stored stock as the statements run, not
+    from the value the form loaded, so a concurrent apply_stock_deltas() is
+    never overwritten without showing in the ledger. Callers load the row
+    FOR UPDATE (PostgreSQL); on SQLite the first INSERT takes the write lock
+    before anything else can commit. Caller commits."""
+    from sqlalchemy import literal, select
+    table = model.__table__
+    column = STOCK_COLUMNS[table.name]
+    stock = db.func.coalesce(table.c[column], 0)
+    now = datetime.utcnow()
+    reference = 'Manual edit'
+    user_id = request.current_user['id']
+
+    def record(branch_id, delta):
+        db.session.execute(StockMovement.__table__.insert().from_select(
+            ['item_type', 'item_id', 'branch_id', 'delta', 'reason', 'reference', 'created_by', 'created_at'],
+            select(
+                literal(STOCK_ITEM_TYPES[table.name]), table.c.id, literal(branch_id), delta,
+                literal('adjustment'), literal(reference), literal(user_id), literal(now),
+            ).where(table.c.id == row.id, delta != 0)
+        ))
+
+    new_stock = stock if quantity is None else literal(float(quantity))
+    if previous_branch_id != row.branch_id:
+        record(previous_branch_id, -stock)
+        record(row.branch_id, new_stock)
+    elif quantity is not None:
+        record(row.branch_id, new_stock - stock)
+    if quantity is not None:
+        db.session.execute(table.update().where(table.c.id == row.id).values(
+            {column: float(quantity), 'updated_at': now}
+        ))
+        db.session.expire(row, [column, 'updated_at'])
+
+def apply_stock_deltas(model, deltas, reason, reference=None, user_id=None, **values):
+    """Atomically add {row id: delta} to the model's stock column and record each
+    change in the stock ledger under the given reason / reference.
+
+    Every change is a relative UPDATE (stock = stock + :delta), so concurrent
+    writers never lose each other's updates. Decrements also carry
+    WHERE stock >= :needed and raise InsufficientStock when that matches no row;
+    PostgreSQL re-checks the condition after waiting on the row lock, SQLite
+    serializes writers, so stock cannot be driven negative. Extra column
+    values (e.g. status) are set on every touched row. Caller commits.
+    """
+    from sqlalchemy import bindparam
+    from sqlalchemy.orm.util import identity_key
+    table = model.__table__
+    stock = table.c[STOCK_COLUMNS[table.name]]
+    update = table.update().where(table.c.id == bindparam('row_pk')).values(
+        {stock: stock + bindparam('delta'), **values}
+    )
+
+    increments = [{'row_pk': pk, 'delta': float(d)} for pk, d in deltas.items() if d > 0]
+    if increments:
+        db.session.execute(update, increments)
+
+    # One statement per decremented row so a shortage is attributable to its row
+    decrement = update.where(stock >= bindparam('needed'))
+    for pk, delta in deltas.items():
+        if delta >= 0:
+            continue
+        if db.session.execute(decrement, {'row_pk': pk, 'delta': float(delta), 'needed': -float(delta)}).rowcount != 1:
+            row = db.session.get(model, pk)
+            if row is not None:
+                db.session.refresh(row)
+            raise InsufficientStock(
+                pk, getattr(row, 'material_type', None) or getattr(row, 'name', f'#{pk}'),
+                float(getattr(row, stock.name) or 0) if row is not None else 0.0, -float(delta)
+            )
+
+    touched = [pk for pk, delta in deltas.items() if delta]
+    if touched:
+        branches = dict(db.session.query(table.c.id, table.c.branch_id).filter(table.c.id.in_(touched)).all())
+        record_stock_movements(
+            model, [(pk, branches[pk], deltas[pk]) for pk in touched if pk in branches],
+            reason, reference, user_id
+        )
+
+    # Instances already loaded in this session still hold the old quantity
+    for pk in deltas:
+        instance = db.session.identity_map.get(identity_key(model, pk))
+        if instance is not None:
+            db.session.expire(instance, [stock.name, *values])
+
+def take_stock_snapshot(snapshot_date=None, branch_id=None):
+    """Snapshot every material and premade product stock level at the end of
+    snapshot_date (default today), replacing an existing snapshot for that date.
+
+    Each level is current stock less the ledger movements recorded after that
+    day, stored with the last ledger id before the day ended, so a backdated
+    snapshot agrees with the ledger (levels predating the ledger itself cannot
+    be reconstructed). One INSERT ... SELECT, so all rows share the same ledger
+    position even on PostgreSQL. Raises ValueError for a future date. Returns
+    the number of rows written. Commits."""
+    from sqlalchemy import func, literal, select, union_all
+    today = datetime.utcnow().date()
+    snapshot_date = snapshot_date or today
+    if snapshot_date > today:
+        raise ValueError('Cannot snapshot a future date')
+    now = datetime.utcnow()
+    day_end = datetime.combine(snapshot_date + timedelta(days=1), datetime.min.time())
+
+    existing = StockSnapshot.query.filter(StockSnapshot.snapshot_date == snapshot_date)
+    if branch_id:
+        existing = existing.filter(StockSnapshot.branch_id == branch_id)
+    existing.delete(synchronize_session=False)
+
+    movements = StockMovement.__table__
+    sources = []
+    for model in (InventoryMaterial, PremadeProduct):
+        table = model.__table__
+        sources.append(select(
+            table.c.branch_id.label('branch_id'), literal(STOCK_ITEM_TYPES[table.name]).label('item_type'),
+            table.c.id.label('item_id'), func.coalesce(table.c[STOCK_COLUMNS[table.name]], 0).label('quantity'),
+        ))
+    # Undo everything recorded after the day ended
+    sources.append(select(
+        movements.c.branch_id, movements.c.item_type, movements.c.item_id, -movements.c.delta,
+    ).where(movements.c.created_at >= day_end))
+    levels = union_all(*sources).subquery()
+
+    ledger_id = select(func.coalesce(func.max(movements.c.id), 0)).where(
+        movements.c.created_at < day_end
+    ).scalar_subquery()
+    source = select(
+        literal(snapshot_date), levels.c.branch_id, levels.c.item_type, levels.c.item_id,
+        func.sum(levels.c.quantity), ledger_id, literal(now)
+    ).group_by(levels.c.branch_id, levels.c.item_type, levels.c.item_id)
+    if branch_id:
+        source = source.where(levels.c.branch_id == branch_id)
+    result = db.session.execute(StockSnapshot.__table__.insert().from_select(
+        ['snapshot_date', 'branch_id', 'item_type', 'item_id', 'quantity', 'ledger_id', 'created_at'],
+        source
+    ))
+    db.session.commit()
+    return result.rowcount
+
+def stock_on_date(day, branch_id, item_type=None):
+    """{(item_type, item_id): quantity} for one branch at the end of `day`:
+    the latest snapshot on or before `day` plus the ledger after it. Without such
+    a snapshot, current stock minus the ledger after `day`."""
+    from sqlalchemy import func
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time())
+    snapshot_day = db.session.query(func.max(StockSnapshot.snapshot_date)).filter(
+        StockSnapshot.branch_id == branch_id, StockSnapshot.snapshot_date <= day
+    ).scalar()
+
+    moves = db.session.query(
+        StockMovement.item_type, StockMovement.item_id, func.sum(StockMovement.delta)
+    ).filter(StockMovement.branch_id == branch_id)
+    if item_type:
+        moves = moves.filter(StockMovement.item_type == item_type)
+
+    levels = {}
+    if snapshot_day:
+        snapshot = StockSnapshot.query.filter(
+            StockSnapshot.branch_id == branch_id, StockSnapshot.snapshot_date == snapshot_day
+        )
+        ledger_id = snapshot.with_entities(func.max(StockSnapshot.ledger_id)).scalar() or 0
+        if item_type:
+            snapshot = snapshot.filter(StockSnapshot.item_type == item_type)
+        for kind, item_id, quantity in snapshot.with_entities(
+            StockSnapshot.item_type, StockSnapshot.item_id, StockSnapshot.quantity
+        ).all():
+            levels[(kind, item_id)] = float(quantity or 0)
+        moves = moves.filter(StockMovement.id > ledger_id, StockMovement.created_at < end)
+        sign = 1
+    else:
+        for model in (InventoryMaterial, PremadeProduct):
+            table = model.__table__
+            kind = STOCK_ITEM_TYPES[table.name]
+            if item_type and item_type != kind:
+                continue
+            for item_id, quantity in db.session.query(table.c.id, table.c[STOCK_COLUMNS[table.name]]).filter(
+                table.c.branch_id == branch_id
+            ).all():
+                levels[(kind, item_id)] = float(quantity or 0)
+        moves = moves.filter(StockMovement.created_at >= end)
+        sign = -1
+
+    for kind, item_id, total in moves.group_by(StockMovement.item_type, StockMovement.item_id).all():
+        levels[(kind, item_id)] = levels.get((kind, item_id), 0.0) + sign * float(total or 0)
+    return levels
+
+@app.cli.command('stock-snapshot')
+@click.option('--date', 'snapshot_date', default=None, help='Snapshot date (YYYY-MM-DD); defaults to today.')
+@click.option('--branch-id', type=int, default=None, help='Only snapshot this branch.')
+def stock_snapshot_command(snapshot_date, branch_id):
+    """Record per-branch stock levels; schedule daily (e.g. from cron)."""
+    day = datetime.strptime(snapshot_date, '%Y-%m-%d').date() if snapshot_date else None
+    try:
+        rows = take_stock_snapshot(day, branch_id)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--date')
+    click.echo(f"Snapshot rows written: {rows}")
+
+# ============================================
+# LIST QUERIES
+# ============================================
+
+# Filtered list queries the endpoints run, each shaped to an index declared on
+# its model. tests/test_query_plans.py runs EXPLAIN QUERY PLAN on these same
+# functions, so a change here that loses the index fails the test.
+
+def job_orders_query(branch_id=None, status=None):
+    """Job orders, newest first, optionally for one branch and/or status."""
+    query = JobOrder.query
+    if branch_id is not None:
+        query = query.filter_by(branch_id=branch_id)
+    if status:
+        query = query.filter_by(status=status)
+    return query.order_by(JobOrder.created_at.desc())
+
+def job_orders_created_between(start, end, branch_id=None):
+    """Job orders created in [start, end], optionally for one branch."""
+    query = JobOrder.query.filter(JobOrder.created_at >= start, JobOrder.created_at <= end)
+    if branch_id is not None:
+        query = query.filter(JobOrder.branch_id == branch_id)
+    return query
+
+def job_order_payments_query(job_order_id):
+    return PaymentRecord.query.filter_by(job_order_id=job_order_id)
+
+def worker_for_user_query(user_id):
+    return Worker.query.filter_by(user_id=user_id)
+
+def branch_workers_query(branch_id):
+    return Worker.query.filter_by(branch_id=branch_id)
+
+def worker_tasks_query(worker_id, status=None):
+    """A worker's tasks, soonest due first, optionally with one status."""
+    query = WorkTask.query.filter_by(worker_id=worker_id)
+    if status:
+        query = query.filter_by(status=status)
+    return query.order_by(WorkTask.due_date.asc(), WorkTask.priority.desc())
+
+def job_order_tasks_query(job_order_code):
+    """Tasks for a job order, by its JO-... code (work_tasks.job_order_id)."""
+    return WorkTask.query.filter_by(job_order_id=job_order_code)
+
+def branch_appointments_query(branch_id=None, status=None):
+    """Appointments, latest preferred date first, optionally for one branch and/or status."""
+    query = Appointment.query
+    if status:
+        query = query.filter_by(status=status)
+    if branch_id is not None:
+        query = query.filter(Appointment.branch_id == branch_id)
+    return query.order_by(Appointment.preferred_date.desc())
+
+def user_appointments_query(user_id):
+    return Appointment.query.filter_by(user_id=user_id).order_by(Appointment.created_at.desc())
+
+def branch_product_orders_query(branch_id=None, status=None):
+    """Product orders, newest first, optionally for one branch and/or status."""
+    query = ProductOrder.query
+    if status:
+        query = query.filter_by(status=status)
+    if branch_id is not None:
+        query = query.filter_by(branch_id=branch_id)
+    return query.order_by(ProductOrder.created_at.desc())
+
+def pickup_queue_query(branch_id=None):
+    """Product orders with items transferred in from another branch, newest
+    first; with branch_id, only orders picked up at that branch."""
+    query = ProductOrder.query
+    if branch_id is not None:
+        query = query.filter(ProductOrder.pickup_branch_id == branch_id)
+    query = query.join(ProductOrderTransfer, ProductOrderTransfer.product_order_id == ProductOrder.id)
+    if branch_id is not None:
+        query = query.filter(ProductOrderTransfer.source_branch_id != branch_id)
+    return query.distinct().order_by(ProductOrder.created_at.desc())
+
+def outgoing_transfers_query(source_branch_id=None):
+    """Transfer requests, newest first, optionally from one source branch."""
+    query = ProductOrderTransfer.query
+    if source_branch_id is not None:
+        query = query.filter_by(source_branch_id=source_branch_id)
+    return query.order_by(ProductOrderTransfer.created_at.desc())
+
+def raw_materials_query(branch_ids=None, include_archived=False, category=None):
+    """Raw materials ordered by material type. branch_ids is a list of branch
+    ids; None means every branch."""
+    query = InventoryMaterial.query
+    if not include_archived:
+        query = query.filter_by(is_archived=False)
+    if branch_ids is not None:
+        if len(branch_ids) == 1:
+            query = query.filter_by(branch_id=branch_ids[0])
+        else:
+            query = query.filter(InventoryMaterial.branch_id.in_(branch_ids))
+    if category:
+        query = query.filter_by(category=category)
+    return query.order_by(InventoryMaterial.material_type.asc())
+
+def low_stock_query(threshold=0):
+    """Active materials at or below threshold (and always those at or below 0), lowest first."""
+    query = InventoryMaterial.query.filter(
+        InventoryMaterial.is_archived.is_(False),
+        InventoryMaterial.stock_quantity <= max(threshold, 0),
+    )
+    return query.order_by(InventoryMaterial.stock_quantity.asc())
+
+def materials_by_name_query(names, branch_ids):
+    """Active materials whose lowercased material type is in names, at the
+    given branches, with branch_ids[0] first."""
+    return InventoryMaterial.query.filter(
+        db.func.lower(InventoryMaterial.material_type).in_(names),
+        InventoryMaterial.branch_id.in_(branch_ids),
+        InventoryMaterial.is_archived.is_(False)
+    ).order_by(
+        db.case((InventoryMaterial.branch_id == branch_ids[0], 0), else_=1),
+        InventoryMaterial.id
+    )
+
+def finished_good_by_sku_query(sku, branch_id):
+    return PremadeProduct.query.filter_by(sku=sku, branch_id=branch_id)
+
+def finished_goods_query(branch_id=None, include_archived=False):
+    """Finished goods ordered by name, optionally for one branch."""
+    query = PremadeProduct.query
+    if not include_archived:
+        query = query.filter_by(is_archived=False)
+    if branch_id is not None:
+        query = query.filter_by(branch_id=branch_id)
+    return query.order_by(PremadeProduct.name.asc())
+
+def material_usage_filters(branch_id=None, material_id=None, start=None, end=None):
+    """Filter clauses for usage logs: optional branch, material and a
+    [start, end) created_at range."""
+    filters = []
+    if branch_id is not None:
+        filters.append(MaterialUsageLog.branch_id == branch_id)
+    if material_id is not None:
+        filters.append(MaterialUsageLog.material_id == material_id)
+    if start is not None:
+        filters.append(MaterialUsageLog.created_at >= start)
+    if end is not None:
+        filters.append(MaterialUsageLog.created_at < end)
+    return filters
+
+def material_usage_logs_query(filters):
+    """Usage logs matching filters, newest first on the (created_at, id) keyset."""
+    return MaterialUsageLog.query.filter(*filters).order_by(
+        MaterialUsageLog.created_at.desc(), MaterialUsageLog.id.desc()
+    )
+
+def waste_logs_query(branch_id=None):
+    query = MaterialWasteLog.query
+    if branch_id is not None:
+        query = query.filter_by(branch_id=branch_id)
+    return query.order_by(MaterialWasteLog.created_at.desc())
+
 # ============================================
 # AUTHENTICATION ROUTES
 # ============================================
@@ -1358,24 +2084,15 @@ def get_raw_materials():
     include_warehouse = request.args.get('includeWarehouse', 'false').lower() == 'true'
     category = request.args.get('category')
 
-    query = InventoryMaterial.query
-    if not include_archived:
-        query = query.filter_by(is_archived=False)
+    branch_ids = None
     if branch_id:
-        branch_id_int = int(branch_id)
+        branch_ids = [int(branch_id)]
         if include_warehouse:
-            warehouse = Branch.query.filter_by(is_warehouse=True).first()
-            warehouse_id = warehouse.id if warehouse else 1
-            if branch_id_int != warehouse_id:
-                query = query.filter(InventoryMaterial.branch_id.in_([branch_id_int, warehouse_id]))
-            else:
-                query = query.filter_by(branch_id=branch_id_int)
-        else:
-            query = query.filter_by(branch_id=branch_id_int)
-    if category:
-        query = query.filter_by(category=category)
+            warehouse_id = get_warehouse_branch_id() or 1
+            if branch_ids[0] != warehouse_id:
+                branch_ids.append(warehouse_id)
 
-    items = query.order_by(InventoryMaterial.material_type.asc()).all()
+    items = raw_materials_query(branch_ids, include_archived, category).all()
     return jsonify({'status': 'success', 'data': [material_to_dict(m) for m in items]})
 
 @app.route('/api/inventory/raw-materials/summary', methods=['GET'])
@@ -1386,15 +2103,8 @@ def get_raw_materials_summary():
     branch_id = request.args.get('branchId')
     category = request.args.get('category')
 
-    query = InventoryMaterial.query
-    if not include_archived:
-        query = query.filter_by(is_archived=False)
-    if branch_id:
-        query = query.filter_by(branch_id=int(branch_id))
-    if category:
-        query = query.filter_by(category=category)
-
-    items = query.order_by(InventoryMaterial.material_type.asc(), InventoryMaterial.created_at.asc()).all()
+    query = raw_materials_query([int(branch_id)] if branch_id else None, include_archived, category)
+    items = query.order_by(InventoryMaterial.created_at.asc()).all()
 
     grouped = {}
     for material in items:
@@ -1415,13 +2125,8 @@ def get_raw_material_group_detail():
     if not group_key:
         return jsonify({'status': 'error', 'message': 'Group key is required'}), 400
 
-    query = InventoryMaterial.query
-    if not include_archived:
-        query = query.filter_by(is_archived=False)
-    if branch_id:
-        query = query.filter_by(branch_id=int(branch_id))
-
-    items = query.order_by(InventoryMaterial.material_type.asc(), InventoryMaterial.created_at.asc()).all()
+    query = raw_materials_query([int(branch_id)] if branch_id else None, include_archived)
+    items = query.order_by(InventoryMaterial.created_at.asc()).all()
     group_items = [m for m in items if build_raw_material_group_key(m) == group_key]
 
     if not group_items:
@@ -1479,6 +2184,11 @@ def create_raw_material():
     )
 
     db.session.add(material)
+    db.session.flush()
+    record_stock_movements(
+        InventoryMaterial, [(material.id, material.branch_id, material.stock_quantity)],
+        'opening', material.item_id or material.material_type, request.current_user['id']
+    )
     db.session.commit()
 
     log_action(request.current_user['id'], request.current_user['fullName'], 'CREATE', 'Inventory',
@@ -1487,11 +2197,186 @@ def create_raw_material():
 
     return jsonify({'status': 'success', 'data': material_to_dict(material)}), 201
 
+# Bulk import: a sheet is validated column-wise with pandas and inserted in one
+# transaction; nothing is written if any row fails.
+MATERIAL_IMPORT_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+MATERIAL_IMPORT_MAX_ROWS = 20000
+MATERIAL_IMPORT_MAX_ERRORS = 200
+
+def _material_import_column_map(columns):
+    """Map InventoryMaterial fields to the (normalized) sheet columns."""
+    return {
+        'item_id': next((c for c in columns if 'item' in c and 'id' in c), None),
+        'material_type': next((c for c in columns if 'material' in c or c in ('type', 'name')), None),
+        'color': next((c for c in columns if 'colo' in c), None),
+        'pattern': next((c for c in columns if 'pattern' in c), None),
+        'unit_price': next((c for c in columns if 'price' in c or 'cost' in c), None),
+        'stock_quantity': next((c for c in columns if ('stock' in c and 'threshold' not in c) or c in ('qty', 'quantity')), None),
+        'low_stock_threshold': next((c for c in columns if 'threshold' in c or 'reorder' in c), None),
+        'branch_id': next((c for c in columns if c == 'branch_id'), None),
+        'branch': next((c for c in columns if c in ('branch', 'branch_name')), None),
+        'supplier_id': next((c for c in columns if c == 'supplier_id'), None),
+        'supplier': next((c for c in columns if c in ('supplier', 'supplier_name')), None),
+        'status': next((c for c in columns if c == 'status'), None),
+    }
+
+@app.route('/api/inventory/raw-materials/import', methods=['POST'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def import_raw_materials():
+    """Create many materials from a CSV/XLSX sheet. Columns: materialType,
+    stockQuantity, unitPrice (required), itemId, color, pattern,
+    lowStockThreshold, status, supplierId or supplier name and branchId or
+    branch name; rows without a branch use the branchId form field."""
+    try:
+        import pandas as pd
+    except ImportError:
+        return jsonify({'status': 'error', 'message': 'pandas not installed. Run: pip install pandas openpyxl'}), 503
+    from sqlalchemy import insert
+
+    if 'file' not in request.files:
+        return jsonify({'status': 'error', 'message': 'No file provided'}), 400
+    file = request.files['file']
+    ext = os.path.splitext(file.filename.lower())[1] if file.filename else ''
+    if ext not in MATERIAL_IMPORT_EXTENSIONS:
+        return jsonify({'status': 'error', 'message': 'Please upload a CSV or Excel (.xlsx or .xls) file'}), 400
+
+    try:
+        if ext == '.csv':
+            frame = pd.read_csv(file, dtype=str, keep_default_na=False)
+        else:
+            frame = pd.read_excel(file, dtype=str).fillna('')
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Could not read file: {str(e)}'}), 400
+    if frame.empty:
+        return jsonify({'status': 'error', 'message': 'The uploaded file has no rows'}), 400
+    if len(frame) > MATERIAL_IMPORT_MAX_ROWS:
+        return jsonify({'status': 'error', 'message': f'Import at most {MATERIAL_IMPORT_MAX_ROWS} rows at a time'}), 400
+
+    frame.columns = [str(c).strip().lower().replace(' ', '_') for c in frame.columns]
+    col_map = _material_import_column_map(list(frame.columns))
+    missing = [k for k in ('material_type', 'stock_quantity', 'unit_price') if not col_map[k]]
+    if missing:
+        return jsonify({'status': 'error', 'message': f'Missing required columns: {", ".join(missing)}. Found columns: {list(frame.columns)}'}), 400
+
+    frame = frame.reset_index(drop=True)
+    text = lambda field: frame[col_map[field]].astype(str).str.strip() if col_map[field] else pd.Series('', index=frame.index)
+    errors = {}
+
+    def flag(mask, message):
+        for idx in frame.index[mask.to_numpy()]:
+            errors.setdefault(int(idx), []).append(message)
+
+    material_type = text('material_type')
+    flag(material_type == '', 'Material type is required')
+
+    numbers = {}
+    for field, label, required in (('stock_quantity', 'Stock quantity', True),
+                                   ('unit_price', 'Unit price', True),
+                                   ('low_stock_threshold', 'Low stock threshold', False)):
+        raw = text(field)
+        values = pd.to_numeric(raw.str.replace(',', '', regex=False), errors='coerce')
+        blank = raw == ''
+        if required:
+            flag(blank, f'{label} is required')
+        else:
+            values = values.where(~blank, 0)
+        flag(~blank & values.isna(), f'{label} must be a number')
+        flag(values < 0, f'{label} cannot be negative')
+        numbers[field] = values
+
+    # Branch: explicit id column, then branch name, then the form default
+    branches = Branch.query.filter_by(is_active=True).all()
+    branch_ids = {b.id for b in branches}
+    branch_by_name = {b.name.strip().lower(): b.id for b in branches}
+    branch_id = pd.to_numeric(text('branch_id'), errors='coerce')
+    by_name = text('branch').str.lower().map(branch_by_name)
+    branch_id = branch_id.fillna(by_name)
+    default_branch = request.form.get('branchId', type=int)
+    if default_branch is not None:
+        branch_id = branch_id.where(text('branch_id').ne('') | text('branch').ne(''), default_branch)
+    flag(~branch_id.isin(branch_ids), 'Invalid or inactive branch')
+
+    # Supplier: explicit id column, then supplier name, each resolved in one query
+    supplier_raw = text('supplier_id')
+    supplier_id = pd.to_numeric(supplier_raw, errors='coerce')
+    if supplier_raw.ne('').any():
+        known = {row[0] for row in db.session.query(Supplier.id).filter(
+            Supplier.id.in_([int(v) for v in supplier_id.dropna().unique()])).all()}
+        flag(supplier_raw.ne('') & ~supplier_id.isin(known), 'Unknown supplier')
+    supplier_name = text('supplier').str.lower()
+    by_supplier_name = supplier_raw.eq('') & supplier_name.ne('')
+    if by_supplier_name.any():
+        supplier_by_name = {name.strip().lower(): sid for sid, name in db.session.query(Supplier.id, Supplier.name).filter(
+            db.func.lower(db.func.trim(Supplier.name)).in_(supplier_name[by_supplier_name].unique().tolist())).all()}
+        supplier_id = supplier_id.where(~by_supplier_name, supplier_name.map(supplier_by_name))
+        flag(by_supplier_name & supplier_id.isna(), 'Unknown supplier')
+
+    # Item ids: duplicates inside the sheet, then collisions with one IN query
+    item_id = text('item_id')
+    has_item_id = item_id != ''
+    flag(has_item_id & item_id.duplicated(keep=False), 'Item ID is repeated in the file')
+    wanted = item_id[has_item_id].unique().tolist()
+    if wanted:
+        existing = {row[0] for row in db.session.query(InventoryMaterial.item_id).filter(
+            InventoryMaterial.item_id.in_(wanted)).all()}
+        flag(item_id.isin(existing), 'Item ID already exists')
+
+    if errors:
+        rows = [{'row': idx + 2, 'errors': messages} for idx, messages in sorted(errors.items())]
+        return jsonify({
+            'status': 'error',
+            'message': f'{len(rows)} row(s) failed validation; nothing was imported',
+            'errors': rows[:MATERIAL_IMPORT_MAX_ERRORS],
+            'errorCount': len(rows),
+        }), 400
+
+    status = text('status').str.lower()
+    now = datetime.utcnow()
+    records = pd.DataFrame({
+        'item_id': item_id.where(has_item_id, None),
+        'material_type': material_type,
+        'color': text('color'),
+        'pattern': text('pattern'),
+        'unit_price': numbers['unit_price'].astype(float),
+        'stock_quantity': numbers['stock_quantity'].astype(float),
+        'low_stock_threshold': numbers['low_stock_threshold'].astype(float),
+        'branch_id': branch_id.astype(int),
+        'supplier_id': supplier_id.astype(object).where(supplier_id.notna(), None),
+        'status': status.where(status.isin(['available', 'needed']), 'available'),
+        'is_archived': False,
+        'created_at': now,
+        'updated_at': now,
+    }).astype(object).to_dict('records')
+    for record in records:
+        if record['supplier_id'] is not None:
+            record['supplier_id'] = int(record['supplier_id'])
+
+    user = request.current_user
+    try:
+        created = db.session.execute(
+            insert(InventoryMaterial).returning(
+                InventoryMaterial.id, InventoryMaterial.branch_id, InventoryMaterial.stock_quantity),
+            records,
+        ).all()
+        record_stock_movements(InventoryMaterial, [tuple(row) for row in created],
+                               'opening', f'Import {file.filename}', user['id'])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Import failed: {str(e)}'}), 400
+
+    log_action(user['id'], user['fullName'], 'CREATE', 'Inventory',
+               f"Imported {len(created)} inventory items from {file.filename}",
+               request.remote_addr or '0.0.0.0')
+
+    return jsonify({'status': 'success', 'data': {'imported': len(created), 'ids': [row[0] for row in created]}}), 201
+
 @app.route('/api/inventory/raw-materials/<int:material_id>', methods=['PUT'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def update_raw_material(material_id):
-    material = InventoryMaterial.query.get(material_id)
+    material = db.session.get(InventoryMaterial, material_id, with_for_update=True)
     if not material:
         return jsonify({'status': 'error', 'message': 'Material not found'}), 404
 
@@ -1505,8 +2390,8 @@ def update_raw_material(material_id):
         material.pattern = data['pattern'].strip()
     if 'unitPrice' in data:
         material.unit_price = float(data['unitPrice'])
-    if 'stockQuantity' in data:
-        material.stock_quantity = float(data['stockQuantity'])
+    previous_branch_id = material.branch_id
+    quantity = float(data['stockQuantity']) if 'stockQuantity' in data else None
     if 'lowStockThreshold' in data:
         material.low_stock_threshold = float(data['lowStockThreshold'] or 0)
     if 'supplierId' in data:
@@ -1517,6 +2402,7 @@ def update_raw_material(material_id):
             return jsonify({'status': 'error', 'message': 'Invalid or inactive branch'}), 400
         material.branch_id = int(data['branchId'])
 
+    _record_manual_stock_change(InventoryMaterial, material, previous_branch_id, quantity)
     db.session.commit()
 
     log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Inventory', f"Updated inventory item: {material.material_type}", request.remote_addr or '0.0.0.0')
@@ -1563,13 +2449,7 @@ def get_finished_goods():
     include_archived = request.args.get('includeArchived', 'false').lower() == 'true'
     branch_id = request.args.get('branchId')
 
-    query = PremadeProduct.query
-    if not include_archived:
-        query = query.filter_by(is_archived=False)
-    if branch_id:
-        query = query.filter_by(branch_id=int(branch_id))
-
-    items = query.order_by(PremadeProduct.name.asc()).all()
+    items = finished_goods_query(int(branch_id) if branch_id else None, include_archived).all()
 
     return jsonify({'status': 'success', 'data': [premade_product_to_dict(i) for i in items]})
 
@@ -1590,49 +2470,58 @@ def create_finished_good():
     if not branch or not branch.is_active:
         return jsonify({'status': 'error', 'message': 'Invalid or inactive branch'}), 400
 
-    usage_entries = []
-    computed_cost = 0
+    branch_id = int(data['branchId'])
+    rows = []
     for idx, used in enumerate(data.get('materialsUsed', [])):
-        material_id = used.get('materialId')
-        quantity_used = used.get('quantityUsed')
-
         try:
-            quantity_used = float(quantity_used)
+            quantity_used = float(used.get('quantityUsed'))
         except (TypeError, ValueError):
             return jsonify({'status': 'error', 'message': f'Invalid quantity used for material at row {idx + 1}'}), 400
 
         if quantity_used <= 0:
             return jsonify({'status': 'error', 'message': f'Quantity used must be greater than zero at row {idx + 1}'}), 400
+        try:
+            material_id = int(used.get('materialId'))
+        except (TypeError, ValueError):
+            material_id = None
+        rows.append((material_id, quantity_used))
+
+    # All referenced materials in one query: the product's branch or the warehouse
+    warehouse_id = get_warehouse_branch_id()
+    allowed_branch_ids = [branch_id]
+    if warehouse_id and warehouse_id != branch_id:
+        allowed_branch_ids.append(warehouse_id)
+    material_ids = {material_id for material_id, _ in rows if material_id is not None}
+    materials = {m.id: m for m in InventoryMaterial.query.filter(
+        InventoryMaterial.id.in_(material_ids),
+        InventoryMaterial.branch_id.in_(allowed_branch_ids),
+        InventoryMaterial.is_archived.is_(False)
+    ).all()} if material_ids else {}
 
-        warehouse = Branch.query.filter_by(is_warehouse=True).first()
-        warehouse_id = warehouse.id if warehouse else None
-        allowed_branch_ids = [int(data['branchId'])]
-        if warehouse_id and warehouse_id != int(data['branchId']):
-            allowed_branch_ids.append(warehouse_id)
-        material = InventoryMaterial.query.filter(
-            InventoryMaterial.id == material_id,
-            InventoryMaterial.branch_id.in_(allowed_branch_ids),
-            InventoryMaterial.is_archived.is_(False)
-        ).first()
+    usage_entries = []
+    deductions = defaultdict(float)
+    computed_cost = 0
+    for idx, (material_id, quantity_used) in enumerate(rows):
+        material = materials.get(material_id)
         if not material:
             return jsonify({'status': 'error', 'message': f'Material not found or unavailable at row {idx + 1}'}), 400
 
-        if float(material.stock_quantity) < quantity_used:
+        deductions[material.id] -= quantity_used
+        if float(material.stock_quantity) < -deductions[material.id]:
             return jsonify({'status': 'error', 'message': f'Insufficient stock for {material.material_type}. Available: {float(material.stock_quantity)}'}), 400
 
-        usage_entries.append({'material': material, 'quantityUsed': quantity_used})
+        usage_entries.append((material, quantity_used))
         computed_cost += float(material.unit_price) * quantity_used
 
-    next_id = (db.session.query(db.func.max(PremadeProduct.id)).scalar() or 0) + 1
     product = PremadeProduct(
         name=data['name'].strip(),
-        sku=data.get('sku') or f"FG-{next_id:03d}",
+        sku=data.get('sku') or generate_finished_good_sku(),
         quantity=float(data['quantity']),
         unit='pcs',
         category=data['category'],
         price=float(data['price']),
         cost=float(data.get('cost', computed_cost)),
-        branch_id=int(data['branchId']),
+        branch_id=branch_id,
         is_archived=False
     )
 
@@ -1641,21 +2530,28 @@ def create_finished_good():
     # Flush so product.id is available for usage logs before commit.
     db.session.flush()
 
-    for entry in usage_entries:
-        material = entry['material']
-        quantity_used = entry['quantityUsed']
-        material.stock_quantity = float(material.stock_quantity) - quantity_used
-
-        db.session.add(MaterialUsageLog(
-            material_id=material.id,
-            premade_product_id=product.id,
-            quantity_used=quantity_used,
-            used_in_type='premade_product',
-            used_in_reference=f"{product.sku} - {product.name}",
-            branch_id=product.branch_id,
-            used_by=request.current_user['id'],
-            notes=f"Used to add premade product stock (qty: {product.quantity})"
-        ))
+    reference = f"{product.sku} - {product.name}"
+    try:
+        apply_stock_deltas(InventoryMaterial, deductions, 'finished_good', reference, request.current_user['id'])
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Insufficient stock for {e.name}. Available: {e.available}'}), 400
+    record_stock_movements(
+        PremadeProduct, [(product.id, product.branch_id, product.quantity)],
+        'finished_good', reference, request.current_user['id']
+    )
+
+    db.session.execute(MaterialUsageLog.__table__.insert(), [{
+        'material_id': material.id,
+        'premade_product_id': product.id,
+        'quantity_used': quantity_used,
+        'used_in_type': 'premade_product',
+        'used_in_reference': reference,
+        'branch_id': product.branch_id,
+        'used_by': request.current_user['id'],
+        'notes': f"Used to add premade product stock (qty: {product.quantity})",
+        'created_at': datetime.utcnow(),
+    } for material, quantity_used in usage_entries])
 
     db.session.commit()
 
@@ -1667,18 +2563,18 @@ def create_finished_good():
 @require_auth
 @require_roles('administrator', 'supervisor')
 def update_finished_good(item_id):
-    product = PremadeProduct.query.get(item_id)
+    product = db.session.get(PremadeProduct, item_id, with_for_update=True)
     if not product:
         return jsonify({'status': 'error', 'message': 'Premade product not found'}), 404
 
     data = request.get_json()
+    previous_branch_id = product.branch_id
 
     if 'name' in data:
         product.name = data['name'].strip()
     if 'sku' in data:
         product.sku = data['sku']
-    if 'quantity' in data:
-        product.quantity = float(data['quantity'])
+    quantity = float(data['quantity']) if 'quantity' in data else None
     product.unit = 'pcs'
     if 'category' in data:
         product.category = data['category']
@@ -1692,26 +2588,114 @@ def update_finished_good(item_id):
             return jsonify({'status': 'error', 'message': 'Invalid or inactive branch'}), 400
         product.branch_id = int(data['branchId'])
 
+    _record_manual_stock_change(PremadeProduct, product, previous_branch_id, quantity)
     db.session.commit()
 
     log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Inventory', f"Updated finished good: {product.name}", request.remote_addr or '0.0.0.0')
 
     return jsonify({'status': 'success', 'data': premade_product_to_dict(product)})
 
+# History pages are keyset-paginated on (created_at, id), newest first, using
+# the (branch|material, created_at) indexes; aggregate mode groups in SQL.
+USAGE_LOG_PAGE_SIZE = 300
+USAGE_LOG_MAX_PAGE_SIZE = 1000
+USAGE_AGGREGATE_GROUPS = ('material', 'day', 'branch')
+USAGE_AGGREGATE_MAX_ROWS = 5000
+
+def _usage_log_cursor(log):
+    return f"{log.created_at.isoformat()}_{log.id}"
+
+def _material_usage_totals(filters, groups):
+    """Total quantity and log count per requested group (material, day, branch)."""
+    day = db.func.date(MaterialUsageLog.created_at)
+    columns, group_by, order_by = [], [], []
+    if 'day' in groups:
+        columns.append(day.label('day'))
+        group_by.append(day)
+        order_by.append(day.desc())
+    if 'branch' in groups:
+        columns += [MaterialUsageLog.branch_id, Branch.name.label('branch_name')]
+        group_by += [MaterialUsageLog.branch_id, Branch.name]
+    if 'material' in groups:
+        columns += [MaterialUsageLog.material_id, InventoryMaterial.material_type]
+        group_by += [MaterialUsageLog.material_id, InventoryMaterial.material_type]
+    total = db.func.sum(MaterialUsageLog.quantity_used)
+    query = db.session.query(*columns, total.label('total'), db.func.count(MaterialUsageLog.id).label('logs'))
+    if 'branch' in groups:
+        query = query.outerjoin(Branch, Branch.id == MaterialUsageLog.branch_id)
+    if 'material' in groups:
+        query = query.outerjoin(InventoryMaterial, InventoryMaterial.id == MaterialUsageLog.material_id)
+    rows = query.filter(*filters).group_by(*group_by).order_by(*order_by, total.desc()) \
+        .limit(USAGE_AGGREGATE_MAX_ROWS + 1).all()
+
+    data = []
+    for row in rows[:USAGE_AGGREGATE_MAX_ROWS]:
+        entry = {'totalQuantity': round(float(row.total or 0), 4), 'logCount': row.logs}
+        if 'day' in groups:
+            entry['day'] = str(row.day)
+        if 'branch' in groups:
+            entry['branchId'] = row.branch_id
+            entry['branchName'] = row.branch_name
+        if 'material' in groups:
+            entry['materialId'] = row.material_id
+            entry['materialName'] = row.material_type
+        data.append(entry)
+    return data, len(rows) > USAGE_AGGREGATE_MAX_ROWS
+
 @app.route('/api/inventory/material-usage', methods=['GET'])
 @require_auth
 def get_material_usage_logs():
-    branch_id = request.args.get('branchId')
-    material_id = request.args.get('materialId')
+    """Usage history, newest first. Query args: branchId, materialId,
+    startDate, endDate (YYYY-MM-DD), limit and cursor (nextCursor of the
+    previous page). With groupBy=material,day,branch (any subset) returns
+    SQL totals per group instead of rows."""
+    from sqlalchemy import and_, or_
+    from sqlalchemy.orm import joinedload
 
-    query = MaterialUsageLog.query
-    if branch_id:
-        query = query.filter_by(branch_id=int(branch_id))
-    if material_id:
-        query = query.filter_by(material_id=int(material_id))
+    try:
+        start = datetime.strptime(request.args['startDate'], '%Y-%m-%d') if request.args.get('startDate') else None
+        end = datetime.strptime(request.args['endDate'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('endDate') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date format'}), 400
+    filters = material_usage_filters(
+        branch_id=request.args.get('branchId', type=int) if request.args.get('branchId') else None,
+        material_id=request.args.get('materialId', type=int) if request.args.get('materialId') else None,
+        start=start,
+        end=end,
+    )
 
-    logs = query.order_by(MaterialUsageLog.created_at.desc()).limit(300).all()
-    return jsonify({'status': 'success', 'data': [material_usage_to_dict(log) for log in logs]})
+    if request.args.get('groupBy'):
+        groups = {g.strip() for g in request.args['groupBy'].split(',') if g.strip()}
+        if not groups or not groups <= set(USAGE_AGGREGATE_GROUPS):
+            return jsonify({'status': 'error', 'message': f'groupBy must be a combination of {", ".join(USAGE_AGGREGATE_GROUPS)}'}), 400
+        data, truncated = _material_usage_totals(filters, groups)
+        return jsonify({'status': 'success', 'data': data, 'truncated': truncated})
+
+    if request.args.get('cursor'):
+        try:
+            cursor_at, cursor_id = request.args['cursor'].rsplit('_', 1)
+            cursor_at, cursor_id = datetime.fromisoformat(cursor_at), int(cursor_id)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+        filters.append(or_(
+            MaterialUsageLog.created_at < cursor_at,
+            and_(MaterialUsageLog.created_at == cursor_at, MaterialUsageLog.id < cursor_id),
+        ))
+
+    limit = min(max(request.args.get('limit', USAGE_LOG_PAGE_SIZE, type=int), 1), USAGE_LOG_MAX_PAGE_SIZE)
+    logs = material_usage_logs_query(filters).options(
+        joinedload(MaterialUsageLog.material),
+        joinedload(MaterialUsageLog.premade_product),
+        joinedload(MaterialUsageLog.branch),
+        joinedload(MaterialUsageLog.used_by_user),
+    ).limit(limit + 1).all()
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    return jsonify({
+        'status': 'success',
+        'data': [material_usage_to_dict(log) for log in logs],
+        'nextCursor': _usage_log_cursor(logs[-1]) if has_more else None,
+    })
 
 @app.route('/api/inventory/finished-goods/public', methods=['GET'])
 def get_finished_goods_public():
@@ -1768,23 +2752,7 @@ def get_categories():
 @app.route('/api/inventory/low-stock', methods=['GET'])
 @require_auth
 def get_low_stock_items():
-    threshold_setting = SystemSetting.query.filter_by(key='inventory_low_stock_threshold').first()
-    threshold = float(threshold_setting.value) if threshold_setting and threshold_setting.value else 0
-
-    if threshold > 0:
-        from sqlalchemy import or_
-        low_stock = InventoryMaterial.query.filter(
-            InventoryMaterial.is_archived.is_(False),
-            or_(
-                InventoryMaterial.stock_quantity <= 0,
-                InventoryMaterial.stock_quantity <= threshold
-            )
-        ).order_by(InventoryMaterial.stock_quantity.asc()).all()
-    else:
-        low_stock = InventoryMaterial.query.filter(
-            InventoryMaterial.is_archived.is_(False),
-            InventoryMaterial.stock_quantity <= 0
-        ).order_by(InventoryMaterial.stock_quantity.asc()).all()
+    low_stock = low_stock_query(get_setting('inventory_low_stock_threshold')).all()
 
     return jsonify({'status': 'success', 'data': [material_to_dict(m) for m in low_stock]})
 
@@ -1882,10 +2850,7 @@ def waste_log_to_dict(log):
 @require_auth
 def get_waste_logs():
     branch_id = request.args.get('branchId')
-    query = MaterialWasteLog.query
-    if branch_id:
-        query = query.filter_by(branch_id=int(branch_id))
-    logs = query.order_by(MaterialWasteLog.created_at.desc()).all()
+    logs = waste_logs_query(int(branch_id) if branch_id else None).all()
     return jsonify({'status': 'success', 'data': [waste_log_to_dict(l) for l in logs]})
 
 @app.route('/api/inventory/waste-logs', methods=['POST'])
@@ -1902,7 +2867,13 @@ def create_waste_log():
     if qty <= 0:
         return jsonify({'status': 'error', 'message': 'Quantity must be positive'}), 400
     # Deduct from stock
-    material.stock_quantity = max(0, float(material.stock_quantity) - qty)
+    try:
+        apply_stock_deltas(
+            InventoryMaterial, {material.id: -qty}, 'waste', data['reason'].strip(), request.current_user['id']
+        )
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Insufficient stock for {e.name}. Available: {e.available}'}), 400
     log = MaterialWasteLog(
         material_id=material.id,
         quantity=qty,
@@ -1916,6 +2887,412 @@ def create_waste_log():
     log_action(request.current_user['id'], request.current_user['fullName'], 'CREATE', 'Inventory', f"Logged waste: {qty} of {material.material_type}", request.remote_addr or '0.0.0.0')
     return jsonify({'status': 'success', 'data': waste_log_to_dict(log)}), 201
 
+def stock_movement_to_dict(movement):
+    return {
+        'id': movement.id,
+        'itemType': movement.item_type,
+        'itemId': movement.item_id,
+        'branchId': movement.branch_id,
+        'delta': float(movement.delta),
+        'reason': movement.reason,
+        'reference': movement.reference,
+        'createdBy': movement.created_by,
+        'createdAt': movement.created_at.isoformat() if movement.created_at else None,
+    }
+
+STOCK_MOVEMENT_PAGE_SIZE = 100
+STOCK_MOVEMENT_MAX_PAGE_SIZE = 500
+
+def _stock_branch_scope(user):
+    """Branch a non-admin is limited to; None for admins (use ?branchId)."""
+    if user['role'] == 'administrator':
+        return request.args.get('branchId', type=int)
+    return _request_branch_id(user) or -1
+
+@app.route('/api/inventory/stock-movements', methods=['GET'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def get_stock_movements():
+    """Ledger history, newest first. Query args: itemType, itemId, branchId,
+    reason, startDate, endDate, beforeId (cursor from the previous page), limit."""
+    query = StockMovement.query
+    branch_id = _stock_branch_scope(request.current_user)
+    if branch_id:
+        query = query.filter(StockMovement.branch_id == branch_id)
+    if request.args.get('itemType'):
+        query = query.filter(StockMovement.item_type == request.args['itemType'])
+    if request.args.get('itemId'):
+        query = query.filter(StockMovement.item_id == request.args.get('itemId', type=int))
+    if request.args.get('reason'):
+        query = query.filter(StockMovement.reason == request.args['reason'])
+    try:
+        if request.args.get('startDate'):
+            query = query.filter(StockMovement.created_at >= datetime.strptime(request.args['startDate'], '%Y-%m-%d'))
+        if request.args.get('endDate'):
+            end = datetime.strptime(request.args['endDate'], '%Y-%m-%d') + timedelta(days=1)
+            query = query.filter(StockMovement.created_at < end)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date format'}), 400
+    if request.args.get('beforeId'):
+        query = query.filter(StockMovement.id < request.args.get('beforeId', type=int))
+
+    limit = min(max(request.args.get('limit', STOCK_MOVEMENT_PAGE_SIZE, type=int), 1), STOCK_MOVEMENT_MAX_PAGE_SIZE)
+    rows = query.order_by(StockMovement.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'status': 'success',
+        'data': [stock_movement_to_dict(m) for m in rows],
+        'nextCursor': rows[-1].id if has_more else None,
+    })
+
+@app.route('/api/inventory/stock-on-date', methods=['GET'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def get_stock_on_date():
+    """Stock levels at the end of ?date=YYYY-MM-DD, per branch. Optional
+    branchId (admins) and itemType (material | product)."""
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'date is required (YYYY-MM-DD)'}), 400
+    item_type = request.args.get('itemType') or None
+    if item_type and item_type not in STOCK_ITEM_TYPES.values():
+        return jsonify({'status': 'error', 'message': 'itemType must be material or product'}), 400
+
+    branch_id = _stock_branch_scope(request.current_user)
+    branch_ids = [branch_id] if branch_id else [b.id for b in Branch.query.order_by(Branch.id).all()]
+
+    levels = {b: stock_on_date(day, b, item_type) for b in branch_ids}
+    names = {}
+    for model, label in ((InventoryMaterial, InventoryMaterial.material_type), (PremadeProduct, PremadeProduct.name)):
+        kind = STOCK_ITEM_TYPES[model.__table__.name]
+        ids = {item_id for per_branch in levels.values() for k, item_id in per_branch if k == kind}
+        if ids:
+            names.update({(kind, i): n for i, n in db.session.query(model.id, label).filter(model.id.in_(ids)).all()})
+
+    data = [{
+        'itemType': kind,
+        'itemId': item_id,
+        'name': names.get((kind, item_id)),
+        'branchId': b,
+        'quantity': round(quantity, 4),
+    } for b, per_branch in levels.items() for (kind, item_id), quantity in sorted(per_branch.items())]
+    return jsonify({'status': 'success', 'data': data, 'date': day.isoformat()})
+
+@app.route('/api/inventory/stock-snapshots', methods=['POST'])
+@require_auth
+@require_roles('administrator')
+def create_stock_snapshot():
+    data = request.get_json(silent=True) or {}
+    try:
+        day = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date format'}), 400
+    try:
+        rows = take_stock_snapshot(day, data.get('branchId'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    log_action(request.current_user['id'], request.current_user['fullName'], 'CREATE', 'Inventory', f"Took stock snapshot ({rows} rows)", request.remote_addr or '0.0.0.0')
+    return jsonify({'status': 'success', 'data': {'rows': rows, 'date': (day or datetime.utcnow().date()).isoformat()}}), 201
+
+# A count sheet is at most STOCK_TAKE_MAX_LINES lines; lines that fail
+# validation are reported (up to STOCK_TAKE_MAX_ERRORS) and nothing is applied.
+STOCK_TAKE_MAX_LINES = 20000
+STOCK_TAKE_MAX_ERRORS = 200
+
+@app.route('/api/inventory/stock-takes', methods=['POST'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def reconcile_stock_take():
+    """Reconcile a physical count of a branch's raw materials.
+
+    Body: {branchId, lines: [{materialId | itemId, countedQuantity}], notes,
+    dryRun}. Current stock for every counted material is read in one query;
+    each difference is set with one UPDATE guarded on the stock the diff was
+    made against and recorded as a 'stock_take' movement, all in one
+    transaction. Active materials at the branch missing from the sheet are left
+    alone and reported as uncounted. dryRun returns the summary without writing.
+    """
+    from sqlalchemy import bindparam, or_
+
+    data = request.get_json(silent=True) or {}
+    user = request.current_user
+    branch_id = data.get('branchId') if user['role'] == 'administrator' else _request_branch_id(user)
+    try:
+        branch_id = int(branch_id)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'branchId is required'}), 400
+    branch = db.session.get(Branch, branch_id)
+    if not branch or not branch.is_active:
+        return jsonify({'status': 'error', 'message': 'Invalid or inactive branch'}), 400
+
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'status': 'error', 'message': 'lines must be a non-empty list'}), 400
+    if len(lines) > STOCK_TAKE_MAX_LINES:
+        return jsonify({'status': 'error', 'message': f'A stock take can have at most {STOCK_TAKE_MAX_LINES} lines'}), 400
+
+    errors = {}
+    parsed = []  # (line number, material id or None, item id or None, counted)
+    for idx, line in enumerate(lines, start=1):
+        line = line if isinstance(line, dict) else {}
+        try:
+            counted = float(line.get('countedQuantity'))
+        except (TypeError, ValueError):
+            counted = None
+            errors.setdefault(idx, []).append('countedQuantity must be a number')
+        if counted is not None and counted < 0:
+            errors.setdefault(idx, []).append('countedQuantity cannot be negative')
+        try:
+            material_id = int(line['materialId']) if line.get('materialId') not in (None, '') else None
+        except (TypeError, ValueError):
+            material_id = None
+        item_id = str(line.get('itemId') or '').strip() or None
+        if material_id is None and item_id is None:
+            errors.setdefault(idx, []).append('materialId or itemId is required')
+            continue
+        parsed.append((idx, material_id, item_id, counted))
+
+    # One query for every counted material at the branch
+    ids = {m for _, m, _, _ in parsed if m is not None}
+    item_ids = {i for _, m, i, _ in parsed if m is None}
+    table = InventoryMaterial.__table__
+    conditions = []
+    if ids:
+        conditions.append(table.c.id.in_(ids))
+    if item_ids:
+        conditions.append(table.c.item_id.in_(item_ids))
+    current = db.session.execute(
+        db.select(table.c.id, table.c.item_id, table.c.material_type, table.c.stock_quantity, table.c.unit_price)
+        .where(table.c.branch_id == branch_id, table.c.is_archived.is_(False), or_(*conditions))
+    ).all() if conditions else []
+    by_id = {row.id: row for row in current}
+    by_item_id = {row.item_id: row for row in current if row.item_id}
+
+    counts = {}  # material id -> (line number, counted)
+    first_line = {}  # material id -> first line naming it, valid or not
+    for idx, material_id, item_id, counted in parsed:
+        row = by_id.get(material_id) if material_id is not None else by_item_id.get(item_id)
+        if row is None:
+            errors.setdefault(idx, []).append('Material not found at this branch')
+        elif row.id in first_line:
+            errors.setdefault(idx, []).append(f'Material already counted on line {first_line[row.id]}')
+        else:
+            first_line[row.id] = idx
+            if idx not in errors:
+                counts[row.id] = (idx, counted)
+
+    if errors:
+        rows = [{'line': idx, 'errors': messages} for idx, messages in sorted(errors.items())]
+        return jsonify({
+            'status': 'error',
+            'message': f'{len(rows)} line(s) failed validation; nothing was applied',
+            'errors': rows[:STOCK_TAKE_MAX_ERRORS],
+            'errorCount': len(rows),
+        }), 400
+
+    adjustments = []
+    for material_id, (_, counted) in counts.items():
+        row = by_id[material_id]
+        system = float(row.stock_quantity or 0)
+        variance = counted - system
+        if variance:
+            adjustments.append({
+                'materialId': row.id,
+                'itemId': row.item_id,
+                'materialType': row.material_type,
+                'systemQuantity': system,
+                'countedQuantity': counted,
+                'variance': variance,
+                'varianceValue': round(variance * float(row.unit_price or 0), 2),
+            })
+    uncounted = db.session.query(db.func.count(InventoryMaterial.id)).filter(
+        InventoryMaterial.branch_id == branch_id,
+        InventoryMaterial.is_archived.is_(False),
+        InventoryMaterial.id.notin_(list(counts)),
+    ).scalar()
+
+    summary = {
+        'branchId': branch_id,
+        'linesCounted': len(counts),
+        'matched': len(counts) - len(adjustments),
+        'adjusted': len(adjustments),
+        'increased': sum(1 for a in adjustments if a['variance'] > 0),
+        'decreased': sum(1 for a in adjustments if a['variance'] < 0),
+        'netVariance': round(sum(a['variance'] for a in adjustments), 4),
+        'netVarianceValue': round(sum(a['varianceValue'] for a in adjustments), 2),
+        'uncounted': uncounted,
+        'adjustments': adjustments,
+        'reference': None,
+    }
+    if data.get('dryRun'):
+        db.session.rollback()
+        return jsonify({'status': 'success', 'data': summary})
+
+    reference = f"ST-{next_sequence_value('stock_take'):05d}"
+    if data.get('notes'):
+        reference = f"{reference} {str(data['notes']).strip()}"
+    if adjustments:
+        # Guarded on the quantity diffed above: a sale or transfer that lands
+        # in between makes the count stale, so the whole take is rejected.
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('b_id'), table.c.stock_quantity == bindparam('b_system'))
+            .values(stock_quantity=bindparam('b_counted'), updated_at=datetime.utcnow()),
+            [{'b_id': a['materialId'], 'b_system': a['systemQuantity'], 'b_counted': a['countedQuantity']}
+             for a in adjustments],
+        )
+        if result.rowcount != len(adjustments):
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': 'Stock changed while the count was being applied; reload and try again'}), 409
+        record_stock_movements(InventoryMaterial, [(a['materialId'], branch_id, a['variance']) for a in adjustments],
+                               'stock_take', reference, user['id'])
+    db.session.commit()
+    summary['reference'] = reference
+
+    log_action(user['id'], user['fullName'], 'UPDATE', 'Inventory',
+               f"Stock take {reference.split()[0]} at {branch.name}: {len(adjustments)} of {len(counts)} items adjusted",
+               request.remote_addr or '0.0.0.0')
+
+    return jsonify({'status': 'success', 'data': summary}), 201
+
+# ============================================
+# INVENTORY EXPORT
+# ============================================
+
+# Exports stream from a server-side cursor EXPORT_CHUNK_ROWS rows at a time;
+# XLSX goes through an openpyxl write-only workbook spooled to a temp file and
+# is sent back in EXPORT_FILE_BLOCK_BYTES blocks.
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_FILE_BLOCK_BYTES = 64 * 1024
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+def _inventory_export_query(kind, branch_id, category, archived):
+    """(header, Core select) for an export kind, or None for an unknown kind."""
+    from sqlalchemy import select
+
+    if kind == 'raw-materials':
+        table = InventoryMaterial.__table__
+        supplier = Supplier.__table__
+        header = ['ID', 'Item ID', 'Material Type', 'Color', 'Pattern', 'Branch', 'Stock Quantity',
+                  'Unit Price', 'Low Stock Threshold', 'Supplier', 'Status', 'Archived', 'Updated At']
+        stmt = select(
+            table.c.id, table.c.item_id, table.c.material_type, table.c.color, table.c.pattern,
+            Branch.__table__.c.name, table.c.stock_quantity, table.c.unit_price,
+            table.c.low_stock_threshold, supplier.c.name, table.c.status, table.c.is_archived,
+            table.c.updated_at,
+        ).select_from(
+            table.join(Branch.__table__, Branch.__table__.c.id == table.c.branch_id)
+                 .outerjoin(supplier, supplier.c.id == table.c.supplier_id)
+        )
+        # Materials have no category column; the material type plays that role
+        category_column = table.c.material_type
+    elif kind == 'finished-goods':
+        table = PremadeProduct.__table__
+        header = ['ID', 'SKU', 'Name', 'Category', 'Branch', 'Quantity', 'Unit',
+                  'Price', 'Cost', 'Archived', 'Updated At']
+        stmt = select(
+            table.c.id, table.c.sku, table.c.name, table.c.category, Branch.__table__.c.name,
+            table.c.quantity, table.c.unit, table.c.price, table.c.cost, table.c.is_archived,
+            table.c.updated_at,
+        ).select_from(table.join(Branch.__table__, Branch.__table__.c.id == table.c.branch_id))
+        category_column = table.c.category
+    else:
+        return None
+
+    if branch_id:
+        stmt = stmt.where(table.c.branch_id == branch_id)
+    if category:
+        stmt = stmt.where(db.func.lower(category_column) == category.lower())
+    if archived == 'only':
+        stmt = stmt.where(table.c.is_archived.is_(True))
+    elif archived != 'true':
+        stmt = stmt.where(table.c.is_archived.is_(False))
+    return header, stmt.order_by(table.c.id)
+
+def _iter_export_rows(stmt):
+    """Yield lists of result rows, EXPORT_CHUNK_ROWS at a time, from a server-side cursor."""
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    try:
+        for partition in result.partitions():
+            yield [[v.isoformat() if isinstance(v, datetime) else v for v in row] for row in partition]
+    finally:
+        result.close()
+
+def _stream_csv(header, stmt):
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for rows in _iter_export_rows(stmt):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _stream_xlsx(header, stmt, title):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(header)
+    for rows in _iter_export_rows(stmt):
+        for row in rows:
+            sheet.append(row)
+    fd, path = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(EXPORT_FILE_BLOCK_BYTES)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+@app.route('/api/inventory/export/<kind>', methods=['GET'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def export_inventory(kind):
+    """Download raw-materials or finished-goods as a file. Query args: format
+    (csv | xlsx), branchId, category, includeArchived (true | false | only)."""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': 'Format must be csv or xlsx'}), 400
+    if export_format == 'xlsx':
+        try:
+            import openpyxl
+        except ImportError:
+            return jsonify({'status': 'error', 'message': 'openpyxl not installed. Run: pip install openpyxl'}), 503
+
+    archived = request.args.get('includeArchived', 'false').lower()
+    branch_id = _stock_branch_scope(request.current_user)
+    query = _inventory_export_query(kind, branch_id, request.args.get('category'), archived)
+    if query is None:
+        return jsonify({'status': 'error', 'message': 'Unknown export; use raw-materials or finished-goods'}), 404
+    header, stmt = query
+
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%d')}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = _stream_csv(header, stmt), 'text/csv'
+    else:
+        body = _stream_xlsx(header, stmt, kind)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    log_action(request.current_user['id'], request.current_user['fullName'], 'EXPORT', 'Inventory',
+               f"Exported {kind} ({export_format})", request.remote_addr or '0.0.0.0')
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
+
 # ============================================
 # PAYMENTS
 # ============================================
@@ -1942,12 +3319,12 @@ def get_payments():
     job_order_id = request.args.get('jobOrderId')
     query = PaymentRecord.query
     if job_order_id:
-        query = query.filter_by(job_order_id=int(job_order_id))
+        query = job_order_payments_query(int(job_order_id))
     elif user['role'] != 'administrator':
         # Non-admins: only show payments for their branch's job orders
         branch_id = user.get('branchId')
         if branch_id:
-            branch_order_ids = [jo.id for jo in JobOrder.query.filter_by(branch_id=branch_id).all()]
+            branch_order_ids = [jo.id for jo in job_orders_query(branch_id).all()]
             query = query.filter(PaymentRecord.job_order_id.in_(branch_order_ids))
     payments = query.order_by(PaymentRecord.created_at.desc()).all()
     return jsonify({'status': 'success', 'data': [payment_record_to_dict(p) for p in payments]})
@@ -2024,7 +3401,7 @@ def get_job_orders():
     status = request.args.get('status')
     
     # Branch-level access control with database
-    query = JobOrder.query
+    branch_id = None
     
     if user['role'] == 'administrator':
         # Admins see all job orders
@@ -2033,21 +3410,17 @@ def get_job_orders():
         # Supervisors and sales managers see only orders from their branch
         # Use branch_id directly from user if available, otherwise look up by name
         if user.get('branchId'):
-            query = query.filter_by(branch_id=user['branchId'])
+            branch_id = user['branchId']
         elif user.get('branch'):
             user_branch = Branch.query.filter_by(name=user['branch']).first()
             if user_branch:
-                query = query.filter_by(branch_id=user_branch.id)
+                branch_id = user_branch.id
             else:
                 return jsonify({'status': 'success', 'data': []})
         else:
             return jsonify({'status': 'success', 'data': []})
     
-    # Filter by status if provided
-    if status:
-        query = query.filter_by(status=status)
-    
-    orders = query.order_by(JobOrder.created_at.desc()).all()
+    orders = job_orders_query(branch_id, status).all()
     
     # Convert to dict format
     def job_order_to_dict(jo):
@@ -2102,7 +3475,7 @@ def get_job_order(order_id):
             return jsonify({'status': 'error', 'message': 'Access denied'}), 403
     
     # Get tasks associated with this job order
-    tasks = WorkTask.query.filter_by(job_order_id=order.job_order_id).all()
+    tasks = job_order_tasks_query(order.job_order_id).all()
     tasks_with_workers = []
     for task in tasks:
         worker_info = None
@@ -2215,7 +3588,8 @@ def create_job_order():
         estimated_completion=estimated_completion,
         created_by=request.current_user['id']
     )
-    
+    apply_job_order_costs(new_order)
+
     db.session.add(new_order)
     db.session.flush()  # get new_order.id before commit
 
@@ -2294,62 +3668,21 @@ def update_job_order(order_id):
         elif order.total_price <= 0:
             order.payment_status = 'unpaid'
 
+    if 'items' in data or 'totalPrice' in data:
+        apply_job_order_costs(order)
+
     if data.get('status') == 'completed':
         order.completed_at = datetime.now()
 
-    order.updated_at = datetime.now()
+    order.updated_at = datetime.utcnow()
 
     # ── Deduct inventory when a job order is completed ──────────────────────
     if data.get('status') == 'completed' and prev_status != 'completed':
-        for item in (order.items or []):
-            qty = float(item.get('quantity', 0))
-            if qty <= 0:
-                continue
-
-            # Skip pure-labor items (have laborCost > 0 and no materialCost)
-            labor_cost = float(item.get('laborCost', 0))
-            material_cost = float(item.get('materialCost', 0))
-            if labor_cost > 0 and material_cost == 0:
-                continue
-
-            # Resolve the inventory material – prefer stored ID, fall back to name match.
-            # Do NOT restrict by branch_id on ID lookup — the material may belong to the
-            # warehouse even when the order is from a different branch.
-            inv_material = None
-            stored_material_id = item.get('materialId')
-            if stored_material_id:
-                inv_material = InventoryMaterial.query.filter_by(
-                    id=int(stored_material_id)
-                ).first()
-            if not inv_material:
-                material_name = item.get('name', '').strip().lower()
-                if material_name:
-                    warehouse = Branch.query.filter_by(is_warehouse=True).first()
-                    warehouse_id = warehouse.id if warehouse else 1
-                    # Search the order's branch first, then the warehouse
-                    inv_material = InventoryMaterial.query.filter(
-                        db.func.lower(InventoryMaterial.material_type) == material_name,
-                        InventoryMaterial.branch_id.in_([order.branch_id, warehouse_id]),
-                        InventoryMaterial.is_archived.is_(False)
-                    ).order_by(
-                        db.case((InventoryMaterial.branch_id == order.branch_id, 0), else_=1)
-                    ).first()
-
-            if inv_material:
-                inv_material.stock_quantity = float(inv_material.stock_quantity) - qty
-                inv_material.status = 'available'   # clear 'needed' flag
-                inv_material.updated_at = datetime.now()
-
-                usage_log = MaterialUsageLog(
-                    material_id=inv_material.id,
-                    quantity_used=qty,
-                    used_in_type='job_order',
-                    used_in_reference=order.job_order_id,
-                    branch_id=order.branch_id,
-                    used_by=request.current_user['id'],
-                    notes=f"Used in job order {order.job_order_id} — {order.customer_name}"
-                )
-                db.session.add(usage_log)
+        try:
+            deduct_job_order_materials(order, request.current_user['id'])
+        except InsufficientStock as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': f'Cannot complete job order. {e}'}), 400
 
     db.session.commit()
 
@@ -2372,6 +3705,75 @@ def update_job_order(order_id):
         }
     })
 
+def deduct_job_order_materials(order, user_id):
+    """Deduct stock for a completed order's material lines and log the usage.
+
+    Stored material ids are resolved in one query and the remaining lines by
+    case-insensitive name (order branch first, then the warehouse) in a second;
+    stock decrements and usage logs are then written in bulk. Raises
+    InsufficientStock when a material lacks stock. Caller commits.
+    """
+    lines = []
+    for item in (order.items or []):
+        qty = float(item.get('quantity', 0) or 0)
+        if qty <= 0:
+            continue
+        # Skip pure-labor items (have laborCost > 0 and no materialCost)
+        labor_cost = float(item.get('laborCost', 0) or 0)
+        material_cost = float(item.get('materialCost', 0) or 0)
+        if labor_cost > 0 and material_cost == 0:
+            continue
+        try:
+            material_id = int(item['materialId']) if item.get('materialId') else None
+        except (TypeError, ValueError):
+            material_id = None
+        lines.append((qty, material_id, (item.get('name') or '').strip().lower()))
+    if not lines:
+        return
+
+    # Do NOT restrict by branch_id on ID lookup — the material may belong to the
+    # warehouse even when the order is from a different branch.
+    by_id = {}
+    material_ids = {material_id for _, material_id, _ in lines if material_id}
+    if material_ids:
+        by_id = {m.id: m for m in InventoryMaterial.query.filter(InventoryMaterial.id.in_(material_ids))}
+
+    by_name = {}
+    names = {name for _, material_id, name in lines if name and material_id not in by_id}
+    if names:
+        warehouse_id = get_warehouse_branch_id() or 1
+        candidates = materials_by_name_query(names, [order.branch_id, warehouse_id]).all()
+        for material in candidates:
+            by_name.setdefault(material.material_type.lower(), material)
+
+    now = datetime.now()
+    deductions = defaultdict(float)
+    usage_logs = []
+    for qty, material_id, name in lines:
+        material = by_id.get(material_id) or by_name.get(name)
+        if not material:
+            continue
+        deductions[material.id] += qty
+        usage_logs.append({
+            'material_id': material.id,
+            'quantity_used': qty,
+            'used_in_type': 'job_order',
+            'used_in_reference': order.job_order_id,
+            'branch_id': order.branch_id,
+            'used_by': user_id,
+            'notes': f"Used in job order {order.job_order_id} — {order.customer_name}",
+            'created_at': datetime.utcnow(),
+        })
+    if not deductions:
+        return
+
+    # Conditional decrements (raises InsufficientStock); 'needed' rows go back to 'available'
+    apply_stock_deltas(
+        InventoryMaterial, {material_id: -qty for material_id, qty in deductions.items()},
+        'job_order', order.job_order_id, user_id, status='available', updated_at=now,
+    )
+    db.session.execute(MaterialUsageLog.__table__.insert(), usage_logs)
+
 @app.route('/api/sales/job-orders/<int:order_id>/void', methods=['POST'])
 @require_auth
 @require_roles('administrator', 'supervisor')
@@ -2412,18 +3814,18 @@ def get_all_orders():
     # Get job orders from database
     if user['role'] == 'administrator':
         # Administrators can see all orders
-        job_orders_db = JobOrder.query.order_by(JobOrder.created_at.desc()).all()
+        job_orders_db = job_orders_query().all()
         customer_orders_db = CustomerOrder.query.order_by(CustomerOrder.created_at.desc()).all()
     else:
         # Other users can only see orders from their branch
         # Use branch_id directly from user if available, otherwise look up by name
         if user.get('branchId'):
-            job_orders_db = JobOrder.query.filter_by(branch_id=user['branchId']).order_by(JobOrder.created_at.desc()).all()
+            job_orders_db = job_orders_query(user['branchId']).all()
             customer_orders_db = CustomerOrder.query.filter_by(branch_id=user['branchId']).order_by(CustomerOrder.created_at.desc()).all()
         elif user.get('branch'):
             user_branch = Branch.query.filter_by(name=user['branch']).first()
             if user_branch:
-                job_orders_db = JobOrder.query.filter_by(branch_id=user_branch.id).order_by(JobOrder.created_at.desc()).all()
+                job_orders_db = job_orders_query(user_branch.id).all()
                 customer_orders_db = CustomerOrder.query.filter_by(branch_id=user_branch.id).order_by(CustomerOrder.created_at.desc()).all()
             else:
                 job_orders_db = []
@@ -2536,169 +3938,347 @@ def update_lineup_slip(slip_id):
 # JOB ORDER COSTING MODULE
 # ============================================
 
+COSTING_OVERHEAD_BASES = ('material', 'labor', 'prime', 'price')
+COSTING_BACKFILL_BATCH_SIZE = 500
+
+def _overhead_model():
+    """Overhead settings: {'basis', 'rate', 'fixed'}; unknown bases fall back to material."""
+    basis = get_setting('costing_overhead_basis')
+    return {
+        'basis': basis if basis in COSTING_OVERHEAD_BASES else 'material',
+        'rate': get_setting('costing_overhead_rate'),
+        'fixed': get_setting('costing_overhead_fixed'),
+    }
+
+def _overhead_basis_amount(basis, material, labor, price):
+    """Works on floats and on SQL column expressions alike."""
+    return {
+        'material': material,
+        'labor': labor,
+        'prime': material + labor,
+        'price': price,
+    }[basis]
+
+def apply_job_order_costs(order, model=None):
+    """Store the order's material/labor/overhead components from its items.
+    Call whenever items or the total price change; caller commits."""
+    model = model or _overhead_model()
+    items = order.items or []
+    material = sum(float(item.get('quantity', 0) or 0) * float(item.get('materialCost', 0) or 0) for item in items)
+    labor = sum(float(item.get('quantity', 0) or 0) * float(item.get('laborCost', 0) or 0) for item in items)
+    price = float(order.total_price or 0)
+    order.material_cost = material
+    order.labor_cost = labor
+    order.overhead_cost = _overhead_basis_amount(model['basis'], material, labor, price) * model['rate'] + model['fixed']
+
+def restate_job_order_overhead():
+    """Re-apply the current overhead model to every costed order in one UPDATE."""
+    model = _overhead_model()
+    base = _overhead_basis_amount(
+        model['basis'], JobOrder.material_cost, JobOrder.labor_cost, db.func.coalesce(JobOrder.total_price, 0)
+    )
+    JobOrder.query.filter(JobOrder.material_cost.isnot(None)).update(
+        {JobOrder.overhead_cost: base * model['rate'] + model['fixed']}, synchronize_session=False
+    )
+    db.session.commit()
+
+def backfill_job_order_costs():
+    """Cost orders created before the stored components existed, in batches."""
+    model = None
+    while True:
+        orders = JobOrder.query.filter(JobOrder.material_cost.is_(None)).limit(COSTING_BACKFILL_BATCH_SIZE).all()
+        if not orders:
+            return
+        model = model or _overhead_model()
+        for order in orders:
+            apply_job_order_costs(order, model)
+        db.session.commit()
+
+def _request_branch_id(user):
+    """Branch the current non-admin user is scoped to, or None when unknown."""
+    if user.get('branchId'):
+        return user['branchId']
+    if user.get('branch'):
+        user_branch = Branch.query.filter_by(name=user['branch']).first()
+        if user_branch:
+            return user_branch.id
+    return None
+
+def _costing_access_error(user, order):
+    if order is None:
+        return jsonify({'status': 'error', 'message': 'Job order not found'}), 404
+    if user['role'] != 'administrator' and order.branch_id != _request_branch_id(user):
+        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
+    return None
+
+def job_order_costing_to_dict(order):
+    material = order.material_cost or 0
+    labor = order.labor_cost or 0
+    overhead = order.overhead_cost or 0
+    total_cost = material + labor + overhead
+    price = order.total_price or 0
+    actual = order.actual_cost or 0
+    estimated = order.estimated_cost or 0
+    return {
+        'jobOrderId': order.job_order_id,
+        'items': order.items,
+        'estimatedCost': estimated,
+        'actualCost': actual,
+        'materialCost': round(material, 2),
+        'laborCost': round(labor, 2),
+        'overheadCost': round(overhead, 2),
+        'totalCost': round(total_cost, 2),
+        'totalPrice': price,
+        'grossProfit': round(price - total_cost, 2),
+        'profitMargin': round((price - total_cost) / price * 100, 2) if price > 0 else 0,
+        'variance': round(actual - estimated, 2) if actual > 0 else 0
+    }
+
 @app.route('/api/costing/all', methods=['GET'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def get_all_costings():
     user = request.current_user
-    orders = list(job_orders)
+    query = db.session.query(
+        JobOrder.id, JobOrder.job_order_id, JobOrder.material_cost, JobOrder.labor_cost,
+        JobOrder.overhead_cost, JobOrder.total_price, JobOrder.status
+    )
 
     if user['role'] != 'administrator':
-        user_branch = Branch.query.filter_by(name=user['branch']).first()
-        if user_branch:
-            orders = [jo for jo in orders if jo['branchId'] == user_branch.id]
-
-    result = []
-    for order in orders:
-        total_material_cost = sum(item.get('materialCost', 0) * item['quantity'] for item in order.get('items', []))
-        total_labor_cost = sum(item.get('laborCost', 0) * item['quantity'] for item in order.get('items', []))
-        overhead = total_material_cost * 0.1
-
-        result.append({
-            'id': order['id'],
-            'jobOrderNumber': order['jobOrderId'],
-            'materialsCost': round(total_material_cost, 2),
-            'laborCost': round(total_labor_cost, 2),
-            'overheadCost': round(overhead, 2),
-            'totalAmount': order.get('totalPrice', 0),
-            'status': order.get('status', ''),
-        })
+        branch_id = _request_branch_id(user)
+        if not branch_id:
+            return jsonify({'status': 'success', 'data': []})
+        query = query.filter(JobOrder.branch_id == branch_id)
+
+    result = [{
+        'id': row.id,
+        'jobOrderNumber': row.job_order_id,
+        'materialsCost': round(row.material_cost or 0, 2),
+        'laborCost': round(row.labor_cost or 0, 2),
+        'overheadCost': round(row.overhead_cost or 0, 2),
+        'totalAmount': row.total_price or 0,
+        'status': row.status or '',
+    } for row in query.order_by(JobOrder.created_at.desc()).all()]
 
     return jsonify({'status': 'success', 'data': result})
 
 @app.route('/api/costing/job-order/<int:order_id>', methods=['GET'])
 @require_auth
 def get_job_order_costing(order_id):
-    user = request.current_user
-    order = next((jo for jo in job_orders if jo['id'] == order_id), None)
-    if not order:
-        return jsonify({'status': 'error', 'message': 'Job order not found'}), 404
-    
-    # Branch-level access control
-    if user['role'] != 'administrator':
-        user_branch = Branch.query.filter_by(name=user['branch']).first()
-        if not user_branch or order['branchId'] != user_branch.id:
-            return jsonify({'status': 'error', 'message': 'Access denied'}), 403
-    
-    total_material_cost = sum(item.get('materialCost', 0) * item['quantity'] for item in order['items'])
-    total_labor_cost = sum(item.get('laborCost', 0) * item['quantity'] for item in order['items'])
-    overhead = total_material_cost * 0.1  # 10% overhead
-    
-    costing_data = {
-        'jobOrderId': order['jobOrderId'],
-        'items': order['items'],
-        'estimatedCost': order['estimatedCost'],
-        'actualCost': order['actualCost'],
-        'materialCost': total_material_cost,
-        'laborCost': total_labor_cost,
-        'overheadCost': round(overhead, 2),
-        'totalCost': round(total_material_cost + total_labor_cost + overhead, 2),
-        'totalPrice': order['totalPrice'],
-        'grossProfit': round(order['totalPrice'] - (total_material_cost + total_labor_cost + overhead), 2),
-        'profitMargin': round((order['totalPrice'] - (total_material_cost + total_labor_cost + overhead)) / order['totalPrice'] * 100, 2) if order['totalPrice'] > 0 else 0,
-        'variance': round(order['actualCost'] - order['estimatedCost'], 2) if order['actualCost'] > 0 else 0
-    }
-    
-    return jsonify({'status': 'success', 'data': costing_data})
+    order = JobOrder.query.get(order_id)
+    error = _costing_access_error(request.current_user, order)
+    if error:
+        return error
+
+    return jsonify({'status': 'success', 'data': job_order_costing_to_dict(order)})
 
 @app.route('/api/costing/job-order/<int:order_id>/actual', methods=['PUT'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def update_actual_cost(order_id):
-    user = request.current_user
-    order = next((jo for jo in job_orders if jo['id'] == order_id), None)
-    if not order:
-        return jsonify({'status': 'error', 'message': 'Job order not found'}), 404
-    
-    # Branch-level access control
-    if user['role'] != 'administrator':
-        user_branch = Branch.query.filter_by(name=user['branch']).first()
-        if not user_branch or order['branchId'] != user_branch.id:
-            return jsonify({'status': 'error', 'message': 'Access denied'}), 403
-    
+    order = JobOrder.query.get(order_id)
+    error = _costing_access_error(request.current_user, order)
+    if error:
+        return error
+
     data = request.get_json()
-    
+
     if 'actualCost' in data:
-        order['actualCost'] = data['actualCost']
-    
+        order.actual_cost = float(data['actualCost'] or 0)
+
     if 'items' in data:
-        order['items'] = data['items']
-    
-    order['updatedAt'] = datetime.now().strftime('%Y-%m-%d')
-    
-    log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Costing', f"Updated actual cost for: {order['jobOrderId']}", request.remote_addr or '0.0.0.0')
-    
-    return jsonify({'status': 'success', 'data': order})
+        order.items = data['items']
+        apply_job_order_costs(order)
+        order.estimated_cost = order.material_cost + order.labor_cost
+
+    order.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Costing', f"Updated actual cost for: {order.job_order_id}", request.remote_addr or '0.0.0.0')
+
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'id': order.id,
+            'jobOrderId': order.job_order_id,
+            'status': order.status,
+            'estimatedCost': order.estimated_cost,
+            'actualCost': order.actual_cost,
+            'totalPrice': order.total_price,
+            'items': order.items,
+            'updatedAt': order.updated_at.strftime('%Y-%m-%d')
+        }
+    })
+
+# Variance reports cached per (branch scope, period), stamped with the job_orders
+# version so any order edit invalidates them. Oldest entries are evicted first.
+VARIANCE_CACHE_MAX_ENTRIES = 32
+VARIANCE_PERCENTILES = (10, 25, 50, 75, 90)
+# Orders outside [Q1 - k*IQR, Q3 + k*IQR] of variance % are flagged as outliers
+VARIANCE_OUTLIER_IQR_FACTOR = 1.5
+
+_variance_lock = threading.Lock()
+_variance_cache = {}
+
+def _job_orders_version_stamp():
+    """Cheap version stamp for job_orders: (row count, latest updated_at)."""
+    count, latest = db.session.query(db.func.count(JobOrder.id), db.func.max(JobOrder.updated_at)).one()
+    return (count, latest.isoformat() if latest else None)
+
+def _build_variance_report(branch_id, start_dt, end_dt):
+    """Per-order variance plus branch/month rollups and percentile summary, all
+    aggregation done in SQL except the percentiles (not portable to SQLite)."""
+    import numpy as np
+    from sqlalchemy import case, func
+    variance = JobOrder.actual_cost - JobOrder.estimated_cost
+    variance_pct = case(
+        (JobOrder.estimated_cost > 0, variance * 100.0 / JobOrder.estimated_cost), else_=0.0
+    )
+    if 'sqlite' in str(db.engine.url):
+        month = func.strftime('%Y-%m', JobOrder.created_at)
+    else:
+        month = func.to_char(JobOrder.created_at, 'YYYY-MM')
+
+    # status = 'completed' AND created_at range -> ix_job_orders_status_created
+    filters = [JobOrder.status == 'completed', JobOrder.actual_cost > 0]
+    if start_dt:
+        filters.append(JobOrder.created_at >= start_dt)
+    if end_dt:
+        filters.append(JobOrder.created_at <= end_dt)
+    if branch_id:
+        filters.append(JobOrder.branch_id == branch_id)
+
+    orders = db.session.query(
+        JobOrder.job_order_id, JobOrder.customer_name, JobOrder.branch_id,
+        JobOrder.estimated_cost, JobOrder.actual_cost,
+        variance.label('variance'), variance_pct.label('variance_pct'), month.label('month')
+    ).filter(*filters).order_by(JobOrder.created_at.desc()).all()
+
+    rollups = db.session.query(
+        JobOrder.branch_id, Branch.name, month.label('month'),
+        func.count(JobOrder.id),
+        func.sum(JobOrder.estimated_cost),
+        func.sum(JobOrder.actual_cost),
+        func.avg(variance_pct),
+        func.sum(case((variance > 0, 1), else_=0)),
+        func.sum(case((variance < 0, 1), else_=0)),
+    ).join(Branch, Branch.id == JobOrder.branch_id).filter(*filters).group_by(
+        JobOrder.branch_id, Branch.name, month
+    ).order_by(month, JobOrder.branch_id).all()
+
+    pcts = np.array([float(o.variance_pct or 0) for o in orders])
+    summary = {'orders': len(orders), 'percentiles': {}, 'outlierBounds': None, 'outliers': 0}
+    outlier_mask = np.zeros(len(orders), dtype=bool)
+    if len(pcts):
+        values = np.percentile(pcts, VARIANCE_PERCENTILES)
+        summary['percentiles'] = {f'p{p}': round(float(v), 2) for p, v in zip(VARIANCE_PERCENTILES, values)}
+        q1, q3 = np.percentile(pcts, [25, 75])
+        low, high = q1 - VARIANCE_OUTLIER_IQR_FACTOR * (q3 - q1), q3 + VARIANCE_OUTLIER_IQR_FACTOR * (q3 - q1)
+        outlier_mask = (pcts < low) | (pcts > high)
+        summary['outlierBounds'] = {'low': round(float(low), 2), 'high': round(float(high), 2)}
+        summary['outliers'] = int(outlier_mask.sum())
+        summary['meanVariancePercent'] = round(float(pcts.mean()), 2)
+        summary['totalVariance'] = round(float(sum(o.variance for o in orders)), 2)
+
+    data = [{
+        'jobOrderId': o.job_order_id,
+        'customerName': o.customer_name,
+        'branchId': o.branch_id,
+        'month': o.month,
+        'estimatedCost': o.estimated_cost,
+        'actualCost': o.actual_cost,
+        'variance': round(float(o.variance), 2),
+        'variancePercent': round(float(o.variance_pct or 0), 2),
+        'status': 'over' if o.variance > 0 else 'under' if o.variance < 0 else 'on_target',
+        'outlier': bool(outlier_mask[i]),
+    } for i, o in enumerate(orders)]
+
+    return {
+        'data': data,
+        'rollups': [{
+            'branchId': r[0],
+            'branchName': r[1],
+            'month': r[2],
+            'orders': r[3],
+            'estimatedCost': round(float(r[4] or 0), 2),
+            'actualCost': round(float(r[5] or 0), 2),
+            'variance': round(float((r[5] or 0) - (r[4] or 0)), 2),
+            'avgVariancePercent': round(float(r[6] or 0), 2),
+            'overCount': int(r[7] or 0),
+            'underCount': int(r[8] or 0),
+        } for r in rollups],
+        'summary': summary,
+    }
 
 @app.route('/api/costing/variance-report', methods=['GET'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def get_variance_report():
+    """Cost variance of completed orders. Query args: startDate / endDate
+    (YYYY-MM-DD, order creation date; both optional), branchId (admins only)."""
     user = request.current_user
-    completed_orders = [jo for jo in job_orders if jo['status'] == 'completed' and jo['actualCost'] > 0]
-    
-    # Branch-level access control
-    if user['role'] != 'administrator':
-        user_branch = Branch.query.filter_by(name=user['branch']).first()
-        if user_branch:
-            completed_orders = [jo for jo in completed_orders if jo['branchId'] == user_branch.id]
-    
-    report = []
-    for order in completed_orders:
-        variance = order['actualCost'] - order['estimatedCost']
-        variance_pct = (variance / order['estimatedCost'] * 100) if order['estimatedCost'] > 0 else 0
-        
-        report.append({
-            'jobOrderId': order['jobOrderId'],
-            'customerName': order['customerName'],
-            'estimatedCost': order['estimatedCost'],
-            'actualCost': order['actualCost'],
-            'variance': round(variance, 2),
-            'variancePercent': round(variance_pct, 2),
-            'status': 'over' if variance > 0 else 'under' if variance < 0 else 'on_target'
-        })
-    
-    return jsonify({'status': 'success', 'data': report})
+    try:
+        start_dt = datetime.strptime(request.args['startDate'], '%Y-%m-%d') if request.args.get('startDate') else None
+        end_dt = datetime.strptime(request.args['endDate'], '%Y-%m-%d').replace(hour=23, minute=59, second=59) if request.args.get('endDate') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date format'}), 400
+
+    if user['role'] != 'administrator':
+        branch_id = _request_branch_id(user)
+        if not branch_id:
+            return jsonify({'status': 'success', 'data': [], 'rollups': [], 'summary': {'orders': 0, 'percentiles': {}, 'outlierBounds': None, 'outliers': 0}})
+    else:
+        branch_id = request.args.get('branchId', type=int)
+
+    key = (branch_id, start_dt, end_dt)
+    stamp = _job_orders_version_stamp()
+    with _variance_lock:
+        cached = _variance_cache.get(key)
+    if cached and cached[0] == stamp:
+        report = cached[1]
+    else:
+        report = _build_variance_report(branch_id, start_dt, end_dt)
+        with _variance_lock:
+            _variance_cache.pop(key, None)
+            _variance_cache[key] = (stamp, report)
+            while len(_variance_cache) > VARIANCE_CACHE_MAX_ENTRIES:
+                _variance_cache.pop(next(iter(_variance_cache)))
+
+    return jsonify({'status': 'success', **report})
+
+@app.route('/api/costing/receipt/<int:order_id>', methods=['GET'])
+@require_auth
+def generate_receipt(order_id):
+    order = JobOrder.query.get(order_id)
+    error = _costing_access_error(request.current_user, order)
+    if error:
+        return error
 
-@app.route('/api/costing/receipt/<int:order_id>', methods=['GET'])
-@require_auth
-def generate_receipt(order_id):
-    user = request.current_user
-    order = next((jo for jo in job_orders if jo['id'] == order_id), None)
-    if not order:
-        return jsonify({'status': 'error', 'message': 'Job order not found'}), 404
-    
-    # Branch-level access control
-    if user['role'] != 'administrator':
-        user_branch = Branch.query.filter_by(name=user['branch']).first()
-        if not user_branch or order['branchId'] != user_branch.id:
-            return jsonify({'status': 'error', 'message': 'Access denied'}), 403
-    
     receipt = {
-        'receiptNumber': f"RCP-{order['jobOrderId']}",
+        'receiptNumber': f"RCP-{order.job_order_id}",
         'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'customer': {
-            'name': order['customerName'],
-            'phone': order['customerPhone'],
-            'email': order['customerEmail']
+            'name': order.customer_name,
+            'phone': order.customer_phone,
+            'email': order.customer_email or ''
         },
-        'jobOrder': order['jobOrderId'],
-        'branch': order['branchName'],
+        'jobOrder': order.job_order_id,
+        'branch': order.branch.name if order.branch else '',
         'items': [
             {
-                'description': item['name'],
-                'quantity': item['quantity'],
-                'unitPrice': item['unitPrice'],
-                'total': item['quantity'] * item['unitPrice']
+                'description': item.get('name', ''),
+                'quantity': item.get('quantity', 0),
+                'unitPrice': item.get('unitPrice', 0),
+                'total': item.get('quantity', 0) * item.get('unitPrice', 0)
             }
-            for item in order['items']
+            for item in (order.items or [])
         ],
-        'subtotal': order['totalPrice'],
-        'downPayment': order['downPayment'],
-        'balance': order['balance'],
-        'paymentStatus': order['paymentStatus']
+        'subtotal': order.total_price,
+        'downPayment': order.down_payment,
+        'balance': order.balance,
+        'paymentStatus': order.payment_status
     }
-    
+
     return jsonify({'status': 'success', 'data': receipt})
 
 # ============================================
@@ -2787,10 +4367,12 @@ def receive_purchase_order(po_id):
         return jsonify({'status': 'error', 'message': 'PO must be approved first'}), 400
     
     # Update inventory
+    received = defaultdict(float)
     for item in po['items']:
         material = InventoryMaterial.query.get(item.get('materialId'))
         if material:
-            material.stock_quantity = float(material.stock_quantity) + float(item['quantity'])
+            received[material.id] += float(item['quantity'])
+    apply_stock_deltas(InventoryMaterial, received, 'po_receipt', po['poNumber'], request.current_user['id'])
     
     po['status'] = 'received'
     po['receivedAt'] = datetime.now().strftime('%Y-%m-%d')
@@ -3074,19 +4656,15 @@ def get_appointments():
     user = request.current_user
     status = request.args.get('status')
     
-    query = Appointment.query
-    
-    # Filter by status if provided
-    if status:
-        query = query.filter_by(status=status)
+    branch_id = None
     
     # Supervisors only see appointments for their assigned branch.
     if user['role'] == 'supervisor':
         if not user.get('branchId'):
             return jsonify({'status': 'error', 'message': 'Supervisor account has no assigned branch'}), 400
-        query = query.filter(Appointment.branch_id == user['branchId'])
+        branch_id = user['branchId']
     
-    appointments = query.order_by(Appointment.preferred_date.desc()).all()
+    appointments = branch_appointments_query(branch_id, status).all()
     
     return jsonify({'status': 'success', 'data': [appointment_to_dict(a) for a in appointments]})
 
@@ -3147,7 +4725,7 @@ def update_appointment(appointment_id):
 def get_my_appointments():
     """Get appointments for the logged-in customer"""
     user_id = request.current_user['id']
-    appointments = Appointment.query.filter_by(user_id=user_id).order_by(Appointment.created_at.desc()).all()
+    appointments = user_appointments_query(user_id).all()
     return jsonify({'status': 'success', 'data': [appointment_to_dict(a) for a in appointments]})
 
 # ============================================
@@ -3358,8 +4936,14 @@ def create_multi_branch_product_order():
     db.session.flush()  # get order.id
 
     # Deduct inventory immediately for items already at the pickup branch
+    deductions = defaultdict(float)
     for product, qty in same_branch_deductions:
-        product.quantity = float(product.quantity) - qty
+        deductions[product.id] -= qty
+    try:
+        apply_stock_deltas(PremadeProduct, deductions, 'product_order', order.order_number, user_id)
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Insufficient stock for {e.name}'}), 400
 
     # Create a transfer request for each source branch ≠ pickup branch
     for src_branch_id, branch_items in items_by_source.items():
@@ -3402,13 +4986,9 @@ def get_my_transfer_requests():
         branch_id = user.get('branchId')
         if not branch_id:
             return jsonify({'status': 'success', 'data': []})
-        transfers = ProductOrderTransfer.query.filter_by(
-            source_branch_id=branch_id
-        ).order_by(ProductOrderTransfer.created_at.desc()).all()
+        transfers = outgoing_transfers_query(branch_id).all()
     else:
-        transfers = ProductOrderTransfer.query.order_by(
-            ProductOrderTransfer.created_at.desc()
-        ).all()
+        transfers = outgoing_transfers_query().all()
     return jsonify({'status': 'success', 'data': [transfer_to_dict(t) for t in transfers]})
 
 
@@ -3422,19 +5002,9 @@ def get_pickup_queue():
         branch_id = user.get('branchId')
         if not branch_id:
             return jsonify({'status': 'success', 'data': []})
-        orders = (ProductOrder.query
-            .filter(ProductOrder.pickup_branch_id == branch_id)
-            .join(ProductOrderTransfer, ProductOrderTransfer.product_order_id == ProductOrder.id)
-            .filter(ProductOrderTransfer.source_branch_id != branch_id)
-            .distinct()
-            .order_by(ProductOrder.created_at.desc())
-            .all())
+        orders = pickup_queue_query(branch_id).all()
     else:
-        orders = (ProductOrder.query
-            .join(ProductOrderTransfer, ProductOrderTransfer.product_order_id == ProductOrder.id)
-            .distinct()
-            .order_by(ProductOrder.created_at.desc())
-            .all())
+        orders = pickup_queue_query().all()
     return jsonify({'status': 'success', 'data': [product_order_to_dict(o) for o in orders]})
 
 
@@ -3470,8 +5040,17 @@ def mark_transfer_sent(transfer_id):
             return jsonify({'status': 'error', 'message': f"Insufficient stock for '{product.name}' at source branch. Available: {product.quantity:g}, required: {requested_qty:g}"}), 400
         deductions.append((product, requested_qty))
 
+    deltas = defaultdict(float)
     for product, qty in deductions:
-        product.quantity = float(product.quantity) - qty
+        deltas[product.id] -= qty
+    try:
+        apply_stock_deltas(
+            PremadeProduct, deltas, 'transfer_out',
+            f"Transfer {transfer_id} for {transfer.order.order_number if transfer.order else '?'}", user['id']
+        )
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f"Insufficient stock for '{e.name}' at source branch. Available: {e.available:g}, required: {e.required:g}"}), 400
 
     transfer.status = 'transferred'
     db.session.commit()
@@ -3506,13 +5085,14 @@ def confirm_transfer_receipt(transfer_id):
         derived_sku = f"{item['sku']}-{pickup_branch.code}" if pickup_branch else item['sku']
 
         existing = (
-            PremadeProduct.query.filter_by(sku=item['sku'], branch_id=order.branch_id).first()
-            or PremadeProduct.query.filter_by(sku=derived_sku, branch_id=order.branch_id).first()
+            finished_good_by_sku_query(item['sku'], order.branch_id).first()
+            or finished_good_by_sku_query(derived_sku, order.branch_id).first()
         )
+        reference = f"Transfer {transfer_id} for {order.order_number if order else '?'}"
         if existing:
-            existing.quantity = float(existing.quantity) + float(item['quantity'])
+            apply_stock_deltas(PremadeProduct, {existing.id: float(item['quantity'])}, 'transfer_in', reference, user['id'])
         else:
-            db.session.add(PremadeProduct(
+            received_product = PremadeProduct(
                 name=item['name'],
                 sku=derived_sku,
                 quantity=float(item['quantity']),
@@ -3522,7 +5102,13 @@ def confirm_transfer_receipt(transfer_id):
                 cost=float(orig_product.cost) if orig_product else 0,
                 branch_id=order.branch_id,
                 is_archived=False
-            ))
+            )
+            db.session.add(received_product)
+            db.session.flush()
+            record_stock_movements(
+                PremadeProduct, [(received_product.id, received_product.branch_id, received_product.quantity)],
+                'transfer_in', reference, user['id']
+            )
 
     transfer.status = 'received'
     db.session.flush()
@@ -3648,18 +5234,15 @@ def get_product_orders():
     user = request.current_user
     status = request.args.get('status')
     
-    query = ProductOrder.query
-    
-    if status:
-        query = query.filter_by(status=status)
+    branch_id = None
     
     # Supervisors only see orders assigned to their branch.
     if user['role'] == 'supervisor':
         if not user.get('branchId'):
             return jsonify({'status': 'error', 'message': 'Supervisor account has no assigned branch'}), 400
-        query = query.filter_by(branch_id=user['branchId'])
+        branch_id = user['branchId']
     
-    orders = query.order_by(ProductOrder.created_at.desc()).all()
+    orders = branch_product_orders_query(branch_id, status).all()
     
     return jsonify({'status': 'success', 'data': [product_order_to_dict(o) for o in orders]})
 
@@ -3714,8 +5297,8 @@ def update_product_order(order_id):
                     # Transferred item — find the copy added to the pickup branch on receipt
                     derived_sku = f"{item_sku}-{pickup_branch.code}" if pickup_branch else item_sku
                     product = (
-                        PremadeProduct.query.filter_by(sku=item_sku, branch_id=order.branch_id).first()
-                        or PremadeProduct.query.filter_by(sku=derived_sku, branch_id=order.branch_id).first()
+                        finished_good_by_sku_query(item_sku, order.branch_id).first()
+                        or finished_good_by_sku_query(derived_sku, order.branch_id).first()
                     )
 
                 if not product:
@@ -3731,8 +5314,17 @@ def update_product_order(order_id):
 
                 stock_deductions.append((product, requested_qty))
 
+            deltas = defaultdict(float)
             for product, requested_qty in stock_deductions:
-                product.quantity = float(product.quantity) - requested_qty
+                deltas[product.id] -= requested_qty
+            try:
+                apply_stock_deltas(PremadeProduct, deltas, 'product_order', order.order_number, request.current_user['id'])
+            except InsufficientStock as e:
+                db.session.rollback()
+                return jsonify({
+                    'status': 'error',
+                    'message': f"Cannot complete order. Insufficient stock for '{e.name}' at pickup branch. Current stock: {e.available:g}, required: {e.required:g}"
+                }), 400
     
     if 'paymentStatus' in data:
         if data['paymentStatus'] not in valid_payment_statuses:
@@ -4119,60 +5711,78 @@ def respond_to_quotation(order_id):
 # FORECASTING MODULE
 # ============================================
 
+# Monthly usage totals for the forecast trend, cached per process. Usage logs
+# are only ever inserted, so the latest log id is a complete version stamp.
+_usage_trend_lock = threading.Lock()
+_usage_trend_cache = {'key': None, 'rows': None}
+
+def _monthly_usage_trend(since):
+    """[(month 'YYYY-MM', total)] of MaterialUsageLog quantities since the given
+    date, re-aggregated only when a usage log was added or the date moved."""
+    from sqlalchemy import func
+    key = (db.session.query(func.max(MaterialUsageLog.id)).scalar(), since)
+    with _usage_trend_lock:
+        if _usage_trend_cache['key'] == key:
+            return _usage_trend_cache['rows']
+
+    since_dt = datetime.combine(since, datetime.min.time())
+    if 'sqlite' in str(db.engine.url):
+        month = func.strftime('%Y-%m', MaterialUsageLog.created_at)
+    else:
+        month = func.to_char(MaterialUsageLog.created_at, 'YYYY-MM')
+    rows = db.session.query(
+        month.label('month'),
+        func.sum(MaterialUsageLog.quantity_used).label('total')
+    ).filter(MaterialUsageLog.created_at >= since_dt).group_by('month').order_by('month').all()
+    rows = [(r.month, float(r.total or 0)) for r in rows]
+
+    with _usage_trend_lock:
+        _usage_trend_cache['key'] = key
+        _usage_trend_cache['rows'] = rows
+    return rows
+
 @app.route('/api/forecasting/inventory', methods=['GET'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def get_inventory_forecast():
-    from sqlalchemy import func
     period = request.args.get('period', 'month')
-    period_days = {'week': 7, 'month': 30, 'quarter': 90}.get(period, 30)
-    today = datetime.now().date()
-    cutoff = today + timedelta(days=period_days)
+    period_days = PREDICTION_PERIOD_DAYS.get(period, 30)
 
     cache = AIPredictionCache.query.first()
-    predictions = []
-    if cache and cache.status == 'done':
-        try:
-            predictions = json.loads(cache.predictions_json or '[]')
-        except Exception:
-            predictions = []
+    has_predictions = bool(cache and cache.status == 'done')
+    predictions = MaterialPrediction.query if has_predictions else MaterialPrediction.query.filter(db.false())
+
+    # Items needing restock within the selected period, priced with one IN query
+    restock_rows = predictions.filter(_prediction_period_filter(period_days)).order_by(MaterialPrediction.days_until_stockout).all()
+    unit_prices = {}
+    if restock_rows:
+        price_rows = db.session.query(InventoryMaterial.item_id, InventoryMaterial.unit_price).filter(
+            InventoryMaterial.item_id.in_([row.item_id for row in restock_rows]),
+            InventoryMaterial.is_archived.is_(False),
+        ).order_by(InventoryMaterial.id).all()
+        for item_id, unit_price in price_rows:
+            unit_prices.setdefault(item_id, float(unit_price or 0))
 
-    # Items needing restock within the selected period
     restock_items = []
-    for p in predictions:
-        days_left = p.get('daysUntilStockout', 9999)
-        restock_by = p.get('restockByDate')
-        in_period = days_left <= period_days
-        if restock_by:
-            try:
-                in_period = in_period or (datetime.strptime(restock_by, '%Y-%m-%d').date() <= cutoff)
-            except Exception:
-                pass
-        if in_period:
-            mat = InventoryMaterial.query.filter_by(item_id=p['itemId'], is_archived=False).first()
-            unit_price = float(mat.unit_price) if mat else 0
-            restock_items.append({**p, 'estimatedCost': round(p.get('suggestedRestockQty', 0) * unit_price, 2)})
-
-    restock_items.sort(key=lambda x: x.get('daysUntilStockout', 9999))
+    for row in restock_rows:
+        p = material_prediction_to_dict(row)
+        unit_price = unit_prices.get(row.item_id, 0)
+        restock_items.append({**p, 'estimatedCost': round(p.get('suggestedRestockQty', 0) * unit_price, 2)})
 
     # Monthly usage trend from MaterialUsageLog — last 6 months
-    six_months_ago = datetime.now() - timedelta(days=180)
-    is_sqlite = 'sqlite' in str(db.engine.url)
-    if is_sqlite:
-        rows = db.session.query(
-            func.strftime('%Y-%m', MaterialUsageLog.created_at).label('month'),
-            func.sum(MaterialUsageLog.quantity_used).label('total')
-        ).filter(MaterialUsageLog.created_at >= six_months_ago).group_by('month').order_by('month').all()
-    else:
-        rows = db.session.query(
-            func.to_char(MaterialUsageLog.created_at, 'YYYY-MM').label('month'),
-            func.sum(MaterialUsageLog.quantity_used).label('total')
-        ).filter(MaterialUsageLog.created_at >= six_months_ago).group_by('month').order_by('month').all()
-
-    monthly_usage = [{'month': r.month, 'total': float(r.total or 0), 'projected': False} for r in rows]
+    rows = _monthly_usage_trend((datetime.now() - timedelta(days=180)).date())
+    monthly_usage = [{'month': month, 'total': total, 'projected': False} for month, total in rows]
+
+    days = MaterialPrediction.days_until_stockout
+    total_predicted, avg_daily_all, urgent_count, soon_count = predictions.with_entities(
+        db.func.count(MaterialPrediction.id),
+        db.func.coalesce(db.func.sum(MaterialPrediction.avg_daily_usage), 0),
+        db.func.sum(db.case((days <= PREDICTION_URGENT_DAYS, 1), else_=0)),
+        db.func.sum(db.case(((days > PREDICTION_URGENT_DAYS) & (days <= PREDICTION_SOON_DAYS), 1), else_=0)),
+    ).one()
+    top_row = predictions.order_by(MaterialPrediction.avg_daily_usage.desc()).first()
 
     # Add 3 projected months using avg daily usage from AI
-    avg_daily_all = sum(p.get('avgDailyUsage', 0) for p in predictions) if predictions else 0
     for i in range(1, 4):
         future = datetime.now() + timedelta(days=30 * i)
         monthly_usage.append({
@@ -4181,80 +5791,434 @@ def get_inventory_forecast():
             'projected': True
         })
 
-    urgent = [p for p in predictions if p.get('daysUntilStockout', 9999) <= 7]
-    soon = [p for p in predictions if 7 < p.get('daysUntilStockout', 9999) <= 30]
-    top_consuming = max(predictions, key=lambda p: p.get('avgDailyUsage', 0)) if predictions else None
-
     return jsonify({'status': 'success', 'data': {
         'restockItems': restock_items,
         'monthlyUsageTrend': monthly_usage,
-        'totalPredictedItems': len(predictions),
-        'urgentCount': len(urgent),
-        'soonCount': len(soon),
+        'totalPredictedItems': total_predicted,
+        'urgentCount': int(urgent_count or 0),
+        'soonCount': int(soon_count or 0),
         'periodItemCount': len(restock_items),
         'estimatedRestockCost': round(sum(r.get('estimatedCost', 0) for r in restock_items), 2),
-        'topConsuming': top_consuming,
-        'hasPredictions': len(predictions) > 0,
+        'topConsuming': material_prediction_to_dict(top_row) if top_row else None,
+        'hasPredictions': total_predicted > 0,
         'predictionStatus': cache.status if cache else 'idle',
         'period': period,
     }})
 
+# Demand forecasts are fitted by a background job (PredictionJob kind='demand')
+# from weekly and monthly JobOrder counts and revenue, per branch and for all
+# branches, and stored in demand_forecasts. The endpoint only reads stored rows.
+DEMAND_FORECAST_HORIZON = {'month': 6, 'week': 12}
+DEMAND_PROPHET_MIN_PERIODS = {'month': 24, 'week': 104}
+DEMAND_FORECAST_MAX_AGE_HOURS = 24
+DEMAND_INTERVAL_Z = 1.2816  # 80% prediction interval
+DEMAND_HOLT_ALPHA = 0.5
+DEMAND_HOLT_BETA = 0.3
+DEMAND_HOLT_PHI = 0.9  # trend damping
+
+def _period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def _shift_period(start, granularity, steps):
+    if granularity == 'week':
+        return start + timedelta(weeks=steps)
+    month = start.month - 1 + steps
+    return date_type(start.year + month // 12, month % 12 + 1, 1)
+
+def _job_order_demand_history(granularity):
+    """Completed-period JobOrder counts and revenue per (branch, period), grouped
+    in SQL. Voided and cancelled orders are excluded. Returns a DataFrame with
+    branch_id, period_start, orders, revenue."""
+    import pandas as pd
+
+    if 'sqlite' in str(db.engine.url):
+        if granularity == 'week':
+            bucket = db.func.date(JobOrder.created_at, 'weekday 0', '-6 days')
+        else:
+            bucket = db.func.strftime('%Y-%m-01', JobOrder.created_at)
+    else:
+        bucket = db.func.date_trunc(granularity, JobOrder.created_at)
+
+    current = _period_start(datetime.utcnow().date(), granularity)
+    rows = db.session.query(
+        JobOrder.branch_id,
+        bucket.label('period'),
+        db.func.count(JobOrder.id),
+        db.func.coalesce(db.func.sum(JobOrder.total_price), 0),
+    ).filter(
+        JobOrder.status.notin_(('voided', 'cancelled')),
+        JobOrder.created_at < datetime.combine(current, datetime.min.time()),
+    ).group_by(JobOrder.branch_id, bucket).all()
+
+    history = pd.DataFrame(rows, columns=['branch_id', 'period_start', 'orders', 'revenue'])
+    history['period_start'] = pd.to_datetime(history['period_start']).dt.date
+    return history
+
+def _holt_forecast(values, horizon):
+    """Damped Holt linear-trend forecast with a prediction interval from the
+    one-step-ahead residuals. Returns (points, half_widths) as NumPy arrays."""
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    if len(values) < 3:
+        points = np.full(horizon, values.mean())
+        sigma = values.std() if len(values) > 1 else values.mean() * 0.5
+        return points, DEMAND_INTERVAL_Z * sigma * np.sqrt(np.arange(1, horizon + 1))
+
+    level, trend = values[0], values[1] - values[0]
+    residuals = []
+    for x in values[1:]:
+        residuals.append(x - (level + DEMAND_HOLT_PHI * trend))
+        new_level = DEMAND_HOLT_ALPHA * x + (1 - DEMAND_HOLT_ALPHA) * (level + DEMAND_HOLT_PHI * trend)
+        trend = DEMAND_HOLT_BETA * (new_level - level) + (1 - DEMAND_HOLT_BETA) * DEMAND_HOLT_PHI * trend
+        level = new_level
+
+    steps = np.arange(1, horizon + 1)
+    damping = np.cumsum(DEMAND_HOLT_PHI ** steps)
+    sigma = float(np.std(residuals))
+    return level + damping * trend, DEMAND_INTERVAL_Z * sigma * np.sqrt(steps)
+
+def _prophet_demand_forecast(period_starts, values, granularity, horizon):
+    """Prophet forecast with its own 80% interval; for long histories only."""
+    import pandas as pd
+    from prophet import Prophet
+
+    model = Prophet(
+        # Few Fourier terms on monthly data, or the yearly curve fits the noise
+        yearly_seasonality=3 if granularity == 'month' else True,
+        weekly_seasonality=False,
+        daily_seasonality=False,
+        interval_width=0.8,
+    )
+    model.fit(pd.DataFrame({'ds': pd.to_datetime(period_starts), 'y': values}))
+    future = model.make_future_dataframe(periods=horizon, freq='W-MON' if granularity == 'week' else 'MS', include_history=False)
+    forecast = model.predict(future)
+    points = forecast['yhat'].to_numpy()
+    return points, (forecast['yhat_upper'] - forecast['yhat_lower']).to_numpy() / 2
+
+def _forecast_demand_series(period_starts, orders, revenue, granularity):
+    """Forecast one branch (or all-branches) series. Returns (engine, orders
+    (points, half widths), revenue (points, half widths))."""
+    horizon = DEMAND_FORECAST_HORIZON[granularity]
+    if len(period_starts) >= DEMAND_PROPHET_MIN_PERIODS[granularity]:
+        try:
+            return ('prophet',
+                    _prophet_demand_forecast(period_starts, orders, granularity, horizon),
+                    _prophet_demand_forecast(period_starts, revenue, granularity, horizon))
+        except Exception:
+            pass  # Prophet unavailable or failed; fall back to Holt
+    return 'holt', _holt_forecast(orders, horizon), _holt_forecast(revenue, horizon)
+
+def _build_demand_forecast_rows(granularity, computed_at):
+    """demand_forecasts rows for every branch series plus the all-branches series."""
+    import pandas as pd
+
+    history = _job_order_demand_history(granularity)
+    if history.empty:
+        return []
+
+    current = _period_start(datetime.utcnow().date(), granularity)
+    first = history['period_start'].min()
+    periods = []
+    period = first
+    while period < current:
+        periods.append(period)
+        period = _shift_period(period, granularity, 1)
+
+    series = {branch_id: rows.set_index('period_start')[['orders', 'revenue']] for branch_id, rows in history.groupby('branch_id')}
+    series[None] = history.groupby('period_start')[['orders', 'revenue']].sum()
+
+    rows = []
+    for branch_id, frame in series.items():
+        # Periods without orders count as zero demand
+        frame = frame.reindex(periods, fill_value=0)
+        engine, (orders, orders_half), (revenue, revenue_half) = _forecast_demand_series(
+            periods, frame['orders'].to_numpy(dtype=float), frame['revenue'].to_numpy(dtype=float), granularity)
+        for step in range(DEMAND_FORECAST_HORIZON[granularity]):
+            rows.append({
+                'granularity': granularity,
+                'branch_id': None if branch_id is None or pd.isna(branch_id) else int(branch_id),
+                'period_start': _shift_period(current, granularity, step),
+                'forecasted_orders': max(0.0, float(orders[step])),
+                'orders_lower': max(0.0, float(orders[step] - orders_half[step])),
+                'orders_upper': max(0.0, float(orders[step] + orders_half[step])),
+                'forecasted_revenue': max(0.0, float(revenue[step])),
+                'revenue_lower': max(0.0, float(revenue[step] - revenue_half[step])),
+                'revenue_upper': max(0.0, float(revenue[step] + revenue_half[step])),
+                'history_periods': len(periods),
+                'engine': engine,
+                'computed_at': computed_at,
+            })
+    return rows
+
+def _run_demand_forecast_job(job, worker_id):
+    """Refit and replace all stored demand forecasts for a claimed job."""
+    job_id = job.id
+    try:
+        computed_at = datetime.utcnow()
+        progress = {'total': len(DEMAND_FORECAST_HORIZON), 'processed': 0}
+        _renew_prediction_job_lease(job_id, worker_id, progress)
+        rows = []
+        for granularity in DEMAND_FORECAST_HORIZON:
+            rows.extend(_build_demand_forecast_rows(granularity, computed_at))
+            progress['processed'] += 1
+            _renew_prediction_job_lease(job_id, worker_id, progress)
+
+        DemandForecast.query.delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(DemandForecast, rows)
+        db.session.commit()
+        _finish_prediction_job(job_id, worker_id, 'done')
+    except PredictionJobCancelled:
+        db.session.rollback()
+        _finish_prediction_job(job_id, worker_id, 'cancelled')
+    except PredictionLeaseLost:
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        _finish_prediction_job(job_id, worker_id, 'error', str(e))
+
+def demand_forecast_to_dict(row):
+    label = row.period_start.strftime('%b %Y') if row.granularity == 'month' else f"Wk of {row.period_start.strftime('%b %d')}"
+    band = (row.orders_upper - row.orders_lower) / 2
+    return {
+        'month': label,
+        'periodStart': row.period_start.isoformat(),
+        'granularity': row.granularity,
+        'branchId': row.branch_id,
+        'forecastedOrders': round(row.forecasted_orders),
+        'ordersLower': round(row.orders_lower, 1),
+        'ordersUpper': round(row.orders_upper, 1),
+        'forecastedRevenue': round(row.forecasted_revenue, 2),
+        'revenueLower': round(row.revenue_lower, 2),
+        'revenueUpper': round(row.revenue_upper, 2),
+        # Narrower band relative to the forecast -> higher confidence (0-100)
+        'confidence': round(max(0.0, min(100.0, 100 * (1 - band / max(row.forecasted_orders, 1)))), 1),
+        'engine': row.engine,
+        'historyPeriods': row.history_periods,
+    }
+
 @app.route('/api/forecasting/demand', methods=['GET'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def get_demand_forecast():
-    # Simple demand forecasting based on historical data
-    months = ['Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul']
-    
-    # Simulated forecast based on completed orders
-    completed_count = len([jo for jo in job_orders if jo['status'] == 'completed'])
-    base_demand = max(completed_count * 1.2, 5)  # Minimum 5 orders forecasted
-    
-    forecast = []
-    for i, month in enumerate(months):
-        # Add some variance for realistic forecasting
-        seasonal_factor = 1.0 + (0.1 * (i % 3))  # Slight seasonal variation
-        forecasted = round(base_demand * seasonal_factor + random.uniform(-2, 2))
-        
-        forecast.append({
-            'month': month,
-            'forecastedOrders': max(forecasted, 1),
-            'forecastedRevenue': round(forecasted * 500, 2),  # Avg order value
-            'confidence': round(85 - (i * 3), 1)  # Confidence decreases over time
-        })
-    
-    return jsonify({'status': 'success', 'data': forecast})
+    """Stored demand forecast. Query args: granularity (month|week), branchId
+    (omit for all branches). A refit is queued when no demand run has finished
+    in the last DEMAND_FORECAST_MAX_AGE_HOURS."""
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in DEMAND_FORECAST_HORIZON:
+        return jsonify({'status': 'error', 'message': 'granularity must be month or week'}), 400
+    branch_id = request.args.get('branchId', type=int)
+
+    query = DemandForecast.query.filter_by(granularity=granularity)
+    query = query.filter(DemandForecast.branch_id == branch_id) if branch_id else query.filter(DemandForecast.branch_id.is_(None))
+    rows = query.order_by(DemandForecast.period_start).all()
+
+    computed_at = db.session.query(db.func.max(DemandForecast.computed_at)).scalar()
+    # Staleness follows the last finished run, not the stored rows: a run that
+    # writes nothing (no job orders yet) or fails must not be requeued on every GET
+    last_run = db.session.query(db.func.max(PredictionJob.finished_at)).filter(
+        PredictionJob.kind == 'demand', PredictionJob.status.in_(('done', 'error'))
+    ).scalar()
+    job = active_prediction_job('demand')
+    if not job and (last_run is None or last_run < datetime.utcnow() - timedelta(hours=DEMAND_FORECAST_MAX_AGE_HOURS)):
+        job, _ = enqueue_prediction_job(requested_by=request.current_user['id'], kind='demand')
+
+    return jsonify({
+        'status': 'success',
+        'data': [demand_forecast_to_dict(row) for row in rows],
+        'computedAt': computed_at.isoformat() if computed_at else None,
+        'job': prediction_job_to_dict(job) if job else None,
+    })
+
+@app.route('/api/forecasting/demand/recompute', methods=['POST'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def recompute_demand_forecast():
+    job, created = enqueue_prediction_job(requested_by=request.current_user['id'], kind='demand')
+    if not created:
+        return jsonify({'status': 'error', 'message': 'Computation already in progress', 'data': prediction_job_to_dict(job)}), 400
+    return jsonify({'status': 'success', 'message': 'Recomputing demand forecast...', 'data': prediction_job_to_dict(job)})
+
+# Consumption-rate windows (days) and the weights blending them into one daily rate
+MATERIAL_RATE_WINDOWS = (7, 30, 90)
+MATERIAL_RATE_WEIGHTS = (0.5, 0.3, 0.2)
+# Recommended orders cover the supplier lead time plus this many days of usage
+MATERIAL_ORDER_COVER_DAYS = 30
+MATERIAL_DEFAULT_LEAD_DAYS = 7
+# 7-day rate vs 30-day rate beyond this ratio counts as rising / falling
+MATERIAL_TREND_TOLERANCE = 0.15
+
+# Per-material consumption rates, cached per process. Usage and waste logs are
+# only ever inserted, so their latest ids plus the day form a complete version stamp.
+_consumption_lock = threading.Lock()
+_consumption_cache = {'key': None, 'rates': None}
+
+def _material_consumption_rates(today):
+    """{material_id: rates} from MaterialUsageLog + MaterialWasteLog over the
+    longest window, aggregated per day in SQL and reduced in one NumPy pass."""
+    import numpy as np
+    from sqlalchemy import func
+    key = (
+        db.session.query(func.max(MaterialUsageLog.id)).scalar(),
+        db.session.query(func.max(MaterialWasteLog.id)).scalar(),
+        today,
+    )
+    with _consumption_lock:
+        if _consumption_cache['key'] == key:
+            return _consumption_cache['rates']
+
+    span = max(MATERIAL_RATE_WINDOWS)
+    first_day = today - timedelta(days=span - 1)
+    since_dt = datetime.combine(first_day, datetime.min.time())
+
+    def daily_totals(model, quantity):
+        day = func.date(model.created_at)
+        return db.session.query(model.material_id, day, func.sum(quantity)).filter(
+            model.created_at >= since_dt
+        ).group_by(model.material_id, day).all()
+
+    usage_rows = daily_totals(MaterialUsageLog, MaterialUsageLog.quantity_used)
+    waste_rows = daily_totals(MaterialWasteLog, MaterialWasteLog.quantity)
+
+    material_ids = sorted({r[0] for r in usage_rows} | {r[0] for r in waste_rows})
+    rates = {}
+    if material_ids:
+        position = {material_id: i for i, material_id in enumerate(material_ids)}
+
+        def to_matrix(rows):
+            matrix = np.zeros((len(material_ids), span))
+            if not rows:
+                return matrix
+            cols, idx, qty = [], [], []
+            for material_id, day, total in rows:
+                if day is None:
+                    continue
+                # SQLite returns date() as text; PostgreSQL returns a date
+                day = day if isinstance(day, date_type) else datetime.strptime(str(day)[:10], '%Y-%m-%d').date()
+                offset = (day - first_day).days
+                if 0 <= offset < span:
+                    idx.append(position[material_id])
+                    cols.append(offset)
+                    qty.append(float(total or 0))
+            np.add.at(matrix, (idx, cols), qty)
+            return matrix
+
+        usage = to_matrix(usage_rows)
+        waste = to_matrix(waste_rows)
+        consumed = usage + waste
+
+        # A material created mid-window is only averaged over the days it existed
+        created = dict(db.session.query(InventoryMaterial.id, InventoryMaterial.created_at).filter(
+            InventoryMaterial.id.in_(material_ids)
+        ).all())
+        age_days = np.array([
+            (today - created[m].date()).days + 1 if created.get(m) else span
+            for m in material_ids
+        ], dtype=float).clip(1, span)
+
+        window_rates = np.column_stack([
+            consumed[:, -w:].sum(axis=1) / np.minimum(age_days, w) for w in MATERIAL_RATE_WINDOWS
+        ])
+        blended = window_rates @ np.array(MATERIAL_RATE_WEIGHTS)
+
+        # Least-squares slope of daily consumption over the 30-day window
+        recent = consumed[:, -30:]
+        x = np.arange(recent.shape[1], dtype=float)
+        x -= x.mean()
+        slope = recent @ x / (x @ x)
+
+        short, medium = window_rates[:, 0], window_rates[:, 1]
+        ratio = np.divide(short, medium, out=np.ones_like(short), where=medium > 0)
+        trend = np.where(ratio > 1 + MATERIAL_TREND_TOLERANCE, 'rising',
+                         np.where(ratio < 1 - MATERIAL_TREND_TOLERANCE, 'falling', 'stable'))
+
+        total = consumed.sum(axis=1)
+        waste_share = np.divide(waste.sum(axis=1), total, out=np.zeros_like(total), where=total > 0)
+
+        for i, material_id in enumerate(material_ids):
+            rates[material_id] = {
+                'rates': [float(r) for r in window_rates[i]],
+                'dailyUsage': float(blended[i]),
+                'trend': str(trend[i]),
+                'trendPerDay': float(slope[i]),
+                'wasteShare': float(waste_share[i]),
+            }
+
+    with _consumption_lock:
+        _consumption_cache['key'] = key
+        _consumption_cache['rates'] = rates
+    return rates
 
 @app.route('/api/forecasting/materials', methods=['GET'])
 @require_auth
 @require_roles('administrator', 'supervisor')
 def get_material_forecast():
-    # Material requirement prediction
+    """Reorder forecast for active inventory materials from logged consumption.
+    Optional branchId narrows it to one branch."""
+    import numpy as np
+    today = datetime.now().date()
+    rates = _material_consumption_rates(today)
+
+    query = InventoryMaterial.query.filter(InventoryMaterial.is_archived.is_(False))
+    branch_id = request.args.get('branchId')
+    if branch_id:
+        query = query.filter(InventoryMaterial.branch_id == int(branch_id))
+    materials = query.order_by(InventoryMaterial.id).all()
+    if not materials:
+        return jsonify({'status': 'success', 'data': []})
+
+    # Supplier lead times learned by the AI predictions, when available
+    lead_times = dict(db.session.query(
+        MaterialPrediction.item_id, MaterialPrediction.avg_lead_time_days
+    ).filter(MaterialPrediction.item_id.in_([m.item_id for m in materials if m.item_id])).all())
+
+    default_threshold = get_setting('inventory_low_stock_threshold')
+    empty = {'rates': [0.0] * len(MATERIAL_RATE_WINDOWS), 'dailyUsage': 0.0, 'trend': 'stable', 'trendPerDay': 0.0, 'wasteShare': 0.0}
+    material_rates = [rates.get(m.id, empty) for m in materials]
+
+    stock = np.array([float(m.stock_quantity or 0) for m in materials])
+    reorder_point = np.array([float(m.low_stock_threshold or 0) or default_threshold for m in materials])
+    daily = np.array([r['dailyUsage'] for r in material_rates])
+    lead = np.array([lead_times.get(m.item_id) or MATERIAL_DEFAULT_LEAD_DAYS for m in materials], dtype=float)
+
+    # Already at/below the reorder point -> 0 days; no consumption -> 999 (never)
+    headroom = np.maximum(stock - reorder_point, 0)
+    days_until_reorder = np.where(
+        headroom <= 0, 0,
+        np.where(daily > 0, np.floor(np.divide(headroom, daily, out=np.zeros_like(daily), where=daily > 0)), 999)
+    ).clip(max=999).astype(int)
+    recommended = np.ceil(np.maximum(daily * (lead + MATERIAL_ORDER_COVER_DAYS) + reorder_point - stock, 0)).astype(int)
+
     forecasts = []
-    
-    for material in raw_materials:
-        if material['isArchived']:
-            continue
-        
-        # Calculate average daily usage (simulated)
-        daily_usage = material['quantity'] * 0.02  # 2% daily usage
-        days_until_reorder = int((material['quantity'] - material['reorderPoint']) / daily_usage) if daily_usage > 0 else 999
-        
+    for i, material in enumerate(materials):
+        r = material_rates[i]
+        days = int(days_until_reorder[i])
+        urgency = 'high' if days <= lead[i] else 'medium' if days <= lead[i] + 7 else 'low'
         forecasts.append({
-            'materialId': material['id'],
-            'name': material['name'],
-            'currentStock': material['quantity'],
-            'reorderPoint': material['reorderPoint'],
-            'dailyUsage': round(daily_usage, 2),
-            'daysUntilReorder': max(days_until_reorder, 0),
-            'recommendedOrderQty': max(int(daily_usage * 30), material['reorderPoint']),  # 30 days supply
-            'urgency': 'high' if days_until_reorder <= 7 else 'medium' if days_until_reorder <= 14 else 'low'
+            'materialId': material.id,
+            'itemId': material.item_id,
+            'name': material.material_type,
+            'branchId': material.branch_id,
+            'currentStock': float(stock[i]),
+            'reorderPoint': float(reorder_point[i]),
+            'dailyUsage': round(r['dailyUsage'], 2),
+            'usageRates': {f'{w}d': round(rate, 2) for w, rate in zip(MATERIAL_RATE_WINDOWS, r['rates'])},
+            'trend': r['trend'],
+            'trendPerDay': round(r['trendPerDay'], 3),
+            'wasteShare': round(r['wasteShare'], 3),
+            'leadTimeDays': int(lead[i]),
+            'daysUntilReorder': days,
+            'reorderDate': (today + timedelta(days=days)).isoformat() if days < 999 else None,
+            'recommendedOrderQty': int(recommended[i]),
+            'urgency': urgency,
         })
-    
-    # Sort by urgency
+
+    # Sort by urgency, then soonest reorder
     urgency_order = {'high': 0, 'medium': 1, 'low': 2}
-    forecasts.sort(key=lambda x: urgency_order[x['urgency']])
-    
+    forecasts.sort(key=lambda x: (urgency_order[x['urgency']], x['daysUntilReorder']))
+
     return jsonify({'status': 'success', 'data': forecasts})
 
 # ============================================
@@ -4276,20 +6240,15 @@ def get_sales_report():
     except ValueError:
         return jsonify({'status': 'error', 'message': 'Invalid date format'}), 400
 
-    query = JobOrder.query.filter(
-        JobOrder.created_at >= start_dt,
-        JobOrder.created_at <= end_dt
-    )
-
     # Branch-level access control
     if user['role'] != 'administrator':
         user_branch = Branch.query.filter_by(name=user['branch']).first()
         if user_branch:
-            query = query.filter(JobOrder.branch_id == user_branch.id)
+            query = job_orders_created_between(start_dt, end_dt, user_branch.id)
         else:
-            query = query.filter(False)
-    elif branch_id:
-        query = query.filter(JobOrder.branch_id == int(branch_id))
+            query = job_orders_created_between(start_dt, end_dt).filter(False)
+    else:
+        query = job_orders_created_between(start_dt, end_dt, int(branch_id) if branch_id else None)
 
     orders = query.all()
 
@@ -4569,7 +6528,7 @@ def update_user(user_id):
             specialization = 'general'
         
         # Check if worker profile exists
-        existing_worker = Worker.query.filter_by(user_id=user.id).first()
+        existing_worker = worker_for_user_query(user.id).first()
         if not existing_worker:
             # Create new worker profile
             new_worker = Worker(
@@ -4682,6 +6641,7 @@ def create_branch():
     
     db.session.add(new_branch)
     db.session.commit()
+    invalidate_warehouse_cache()
     
     log_action(request.current_user['id'], request.current_user['fullName'], 'CREATE', 'Settings', f"Created branch: {new_branch.name}", request.remote_addr or '0.0.0.0')
     
@@ -4714,6 +6674,7 @@ def update_branch(branch_id):
         branch.is_active = data['isActive']
     
     db.session.commit()
+    invalidate_warehouse_cache()
     
     log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Settings', f"Updated branch: {branch.name}", request.remote_addr or '0.0.0.0')
     
@@ -4722,8 +6683,7 @@ def update_branch(branch_id):
 @app.route('/api/settings/system', methods=['GET'])
 @require_auth
 def get_system_settings():
-    settings = SystemSetting.query.all()
-    return jsonify({'status': 'success', 'data': {s.key: s.value for s in settings}})
+    return jsonify({'status': 'success', 'data': dict(get_all_settings())})
 
 @app.route('/api/settings/system/<key>', methods=['PUT'])
 @require_auth
@@ -4737,7 +6697,11 @@ def update_system_setting(key):
         db.session.add(setting)
     else:
         setting.value = value
+        setting.updated_at = datetime.utcnow()
     db.session.commit()
+    invalidate_settings_cache()
+    if key.startswith('costing_overhead_'):
+        restate_job_order_overhead()
     log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'Settings', f"Updated system setting: {key} = {value}", request.remote_addr or '0.0.0.0')
     return jsonify({'status': 'success', 'data': {setting.key: setting.value}})
 
@@ -4754,7 +6718,7 @@ def get_worker_profile():
         print(f"DEBUG: get_worker_profile called for user: {user.get('fullName', 'Unknown')}")
         
         # Check if user has a worker profile
-        worker = Worker.query.filter_by(user_id=user['id']).first()
+        worker = worker_for_user_query(user['id']).first()
         if not worker:
             print(f"DEBUG: Creating new worker profile for user {user['id']}")
             # Create worker profile if user is a seat_maker or sewer
@@ -4809,7 +6773,7 @@ def toggle_worker_availability():
     user = sessions[token]
     data = request.json
     
-    worker = Worker.query.filter_by(user_id=user['id']).first()
+    worker = worker_for_user_query(user['id']).first()
     if not worker:
         return jsonify({'error': 'Worker profile not found'}), 404
     
@@ -4834,15 +6798,11 @@ def get_worker_tasks():
         user = sessions[token]
         status = request.args.get('status')
         
-        worker = Worker.query.filter_by(user_id=user['id']).first()
+        worker = worker_for_user_query(user['id']).first()
         if not worker:
             return jsonify({'error': 'Worker profile not found'}), 404
         
-        query = WorkTask.query.filter_by(worker_id=worker.id)
-        if status:
-            query = query.filter_by(status=status)
-        
-        tasks = query.order_by(WorkTask.due_date.asc(), WorkTask.priority.desc()).all()
+        tasks = worker_tasks_query(worker.id, status).all()
         
         task_list = []
         for task in tasks:
@@ -4883,7 +6843,7 @@ def get_worker_task_detail(task_id):
     
     user = sessions[token]
     
-    worker = Worker.query.filter_by(user_id=user['id']).first()
+    worker = worker_for_user_query(user['id']).first()
     if not worker:
         return jsonify({'error': 'Worker profile not found'}), 404
     
@@ -4923,7 +6883,7 @@ def update_task_status(task_id):
     user = sessions[token]
     data = request.json
     
-    worker = Worker.query.filter_by(user_id=user['id']).first()
+    worker = worker_for_user_query(user['id']).first()
     if not worker:
         return jsonify({'error': 'Worker profile not found'}), 404
     
@@ -5050,7 +7010,7 @@ def get_all_tasks_admin():
         user_branch_id = user.get('branchId')
         if user_branch_id:
             # Get workers from this branch
-            branch_workers = Worker.query.filter_by(branch_id=user_branch_id).all()
+            branch_workers = branch_workers_query(user_branch_id).all()
             worker_ids = [w.id for w in branch_workers]
             if worker_ids:
                 query = query.filter(WorkTask.worker_id.in_(worker_ids))
@@ -5112,7 +7072,7 @@ def get_all_workers():
         # Supervisors and sales managers see only workers from their branch
         user_branch_id = user.get('branchId')
         if user_branch_id:
-            workers = Worker.query.filter_by(branch_id=user_branch_id).all()
+            workers = branch_workers_query(user_branch_id).all()
         else:
             workers = []
     
@@ -5161,7 +7121,7 @@ def sync_worker_profiles():
     for user in users_with_worker_roles:
         print(f"DEBUG: Checking user {user.username} (ID: {user.id}, Role: {user.role.key if user.role else 'None'})")
         # Check if worker profile already exists
-        existing_worker = Worker.query.filter_by(user_id=user.id).first()
+        existing_worker = worker_for_user_query(user.id).first()
         if not existing_worker:
             # Determine specialization based on role
             if user.role.key in ['seat_maker', 'sewer']:
@@ -5207,7 +7167,7 @@ def debug_workers():
     
     users_info = []
     for user in all_users:
-        worker = Worker.query.filter_by(user_id=user.id).first()
+        worker = worker_for_user_query(user.id).first()
         users_info.append({
             'id': user.id,
             'username': user.username,
@@ -5631,163 +7591,830 @@ def serve_catalog_image(filename):
 # ============================================
 
 import json
-import threading
+import multiprocessing
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date as date_type
 
-def _parse_date(val):
-    if not val or str(val).strip().lower() in ('', 'no restock', 'none', 'nat', 'nan'):
-        return None
-    try:
-        import pandas as pd
-        ts = pd.to_datetime(val, errors='coerce')
-        return None if pd.isna(ts) else ts.date()
-    except Exception:
-        return None
+# Prophet fits are CPU-bound and can be spread over a process pool in chunks of
+# AI_PREDICTION_CHUNK_SIZE items. The pool is opt-in: each spawned worker imports
+# the app and Prophet before its first fit, so set AI_PREDICTION_WORKERS above 1
+# only where bench/prediction_pool.py shows a gain on that host. The default of 1
+# keeps every fit in the background thread.
+AI_PREDICTION_WORKERS = max(1, int(os.getenv('AI_PREDICTION_WORKERS', '1')))
+AI_PREDICTION_CHUNK_SIZE = max(1, int(os.getenv('AI_PREDICTION_CHUNK_SIZE', '8')))
+
+# Short and intermittent series skip Prophet and use the batched NumPy engines
+# (see _choose_prediction_engine). Engine choice and thresholds are system settings.
+AI_PREDICTION_ENGINES = ('prophet', 'croston', 'ses', 'moving_average')
+AI_SES_MIN_POINTS = 10
+AI_SES_ALPHA = 0.3
+AI_CROSTON_ALPHA = 0.1
+AI_MOVING_AVERAGE_WINDOW = 14
+AI_MAX_ZERO_GAP_DAYS = 30
+
+# Historical uploads are read in chunks of HISTORICAL_READ_CHUNK_ROWS rows and
+# inserted in executemany batches of HISTORICAL_INSERT_CHUNK_SIZE rows.
+HISTORICAL_UPLOAD_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.parquet')
+HISTORICAL_READ_CHUNK_ROWS = 20000
+HISTORICAL_INSERT_CHUNK_SIZE = 5000
+
+def _iter_historical_chunks(path, ext):
+    """Yield an uploaded historical file as DataFrames of at most
+    HISTORICAL_READ_CHUNK_ROWS rows: openpyxl read-only rows for .xlsx,
+    chunked read_csv for .csv and record batches for .parquet. Legacy .xls
+    has no streaming reader and is read in one piece. CSV is read as text and
+    parquet integers keep nulls as None, so a column's type does not depend on
+    which chunk a blank falls in."""
+    import pandas as pd
+
+    if ext == '.csv':
+        yield from pd.read_csv(path, chunksize=HISTORICAL_READ_CHUNK_ROWS, dtype=str, keep_default_na=False)
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=HISTORICAL_READ_CHUNK_ROWS):
+            yield batch.to_pandas(integer_object_nulls=True)
+    elif ext == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = ['' if c is None else str(c) for c in header]
+            width = len(columns)
+            padding = (None,) * width
+            buffer = []
+            for row in rows:
+                buffer.append((tuple(row) + padding)[:width])
+                if len(buffer) >= HISTORICAL_READ_CHUNK_ROWS:
+                    yield pd.DataFrame(buffer, columns=columns)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=columns)
+        finally:
+            workbook.close()
+    else:
+        yield pd.read_excel(path)
 
-def _compute_prediction_for_item(item_id):
-    try:
-        import pandas as pd
-        from prophet import Prophet
-    except ImportError:
-        return None
+def _historical_column_map(columns):
+    """Map historical_inventory_data fields to the (normalized) upload columns."""
+    return {
+        'item_id': next((c for c in columns if 'item' in c and 'id' in c), None),
+        'material_type': next((c for c in columns if 'material' in c and 'type' in c), None),
+        'stock_quantity': next((c for c in columns if 'stock' in c and 'qty' in c or ('stock' in c and 'quantity' in c)), None),
+        'incoming_date': next((c for c in columns if 'incoming' in c), None),
+        'outgoing_date': next((c for c in columns if 'outgoing' in c), None),
+        'restock_date': next((c for c in columns if 'restock' in c and 'date' in c), None),
+        'restock_quantity': next((c for c in columns if 'restock' in c and ('qty' in c or 'quantity' in c)), None),
+        'restock_cycle': next((c for c in columns if 'restock' in c and 'cycle' in c), None),
+    }
+
+_NO_DATE_VALUES = ('', 'no restock', 'none', 'nat', 'nan')
+
+def _parse_date_column(series):
+    """Parse a whole date column to datetime.date, with placeholders
+    ('No restock', blanks) and unparseable values as None."""
+    import pandas as pd
+
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        text = series.astype(str).str.strip()
+        series = series.where(series.notna() & ~text.str.lower().isin(_NO_DATE_VALUES))
+        series = pd.to_datetime(series, errors='coerce', format='mixed')
+    return series.dt.date.astype(object).where(series.notna(), None)
+
+def _normalize_historical_frame(df, col_map):
+    """Coerce an uploaded sheet to historical_inventory_data columns, column by
+    column. Rows without an item id are dropped; missing or non-numeric
+    quantities become 0. Returns a DataFrame ready for a bulk insert."""
+    import pandas as pd
+
+    def numeric(key):
+        if not col_map[key]:
+            return pd.Series(0.0, index=df.index)
+        return pd.to_numeric(df[col_map[key]], errors='coerce').fillna(0)
+
+    def text(key):
+        if not col_map[key]:
+            return pd.Series('', index=df.index)
+        column = df[col_map[key]]
+        if pd.api.types.is_float_dtype(column) and (column.dropna() % 1 == 0).all():
+            # Whole numbers read as float because of a blank in this chunk
+            # (xlsx rows): keep "1001", not "1001.0", so ids match across chunks
+            column = column.astype('Int64')
+        return column.astype(object).where(column.notna(), '').astype(str).str.strip()
+
+    records = pd.DataFrame({
+        'item_id': text('item_id'),
+        'material_type': text('material_type'),
+        'stock_quantity': numeric('stock_quantity').astype(float),
+        'incoming_date': _parse_date_column(df[col_map['incoming_date']]),
+        'outgoing_date': _parse_date_column(df[col_map['outgoing_date']]),
+        'restock_date': _parse_date_column(df[col_map['restock_date']]) if col_map['restock_date'] else None,
+        'restock_quantity': numeric('restock_quantity').astype(float),
+        'restock_cycle': numeric('restock_cycle').astype(int),
+    })
+    return records[records['item_id'] != ''].reset_index(drop=True)
+
+def _load_batch_inputs(item_ids=None):
+    """Load model inputs for a batch of items (all historical items when item_ids
+    is None) in three bulk queries, partitioned in memory by item_id.
+
+    Returns {item_id: inputs}. Each inputs dict holds plain values and frames,
+    so the model fit can run in a worker process without a database session:
+    'history' (DataFrame of historical rows), 'usageByDay' (date -> quantity,
+    summed per day in SQL) and 'material' (current stock details or None).
+    """
+    import pandas as pd
+
+    history_query = db.session.query(
+        HistoricalInventoryData.item_id,
+        HistoricalInventoryData.material_type,
+        HistoricalInventoryData.stock_quantity,
+        HistoricalInventoryData.incoming_date,
+        HistoricalInventoryData.outgoing_date,
+        HistoricalInventoryData.restock_date,
+        HistoricalInventoryData.restock_quantity,
+    )
+    material_query = db.session.query(
+        InventoryMaterial.id,
+        InventoryMaterial.item_id,
+        InventoryMaterial.material_type,
+        InventoryMaterial.color,
+        InventoryMaterial.pattern,
+        InventoryMaterial.stock_quantity,
+        InventoryMaterial.branch_id,
+    ).filter(InventoryMaterial.is_archived.is_(False), InventoryMaterial.item_id.isnot(None))
+    if item_ids is not None:
+        history_query = history_query.filter(HistoricalInventoryData.item_id.in_(list(item_ids)))
+        material_query = material_query.filter(InventoryMaterial.item_id.in_(list(item_ids)))
+
+    history = pd.DataFrame(
+        history_query.order_by(HistoricalInventoryData.item_id, HistoricalInventoryData.incoming_date).all(),
+        columns=['itemId', 'materialType', 'stockQuantity', 'incomingDate', 'outgoingDate', 'restockDate', 'restockQuantity'],
+    )
+    if history.empty:
+        return {}
+
+    materials = {}
+    for row in material_query.all():
+        materials.setdefault(row.item_id, {
+            'id': row.id,
+            'materialType': row.material_type,
+            'color': row.color,
+            'pattern': row.pattern,
+            'stockQuantity': float(row.stock_quantity),
+            'branchId': row.branch_id,
+        })
+
+    usage_by_material = defaultdict(dict)
+    material_ids = [m['id'] for m in materials.values()]
+    if material_ids:
+        usage_day = db.func.date(MaterialUsageLog.created_at)
+        usage_query = db.session.query(
+            MaterialUsageLog.material_id, usage_day, db.func.sum(MaterialUsageLog.quantity_used)
+        ).group_by(MaterialUsageLog.material_id, usage_day)
+        if item_ids is not None:
+            usage_query = usage_query.filter(MaterialUsageLog.material_id.in_(material_ids))
+        for material_id, day, total in usage_query.all():
+            if day is None:
+                continue
+            # SQLite returns date() as text; PostgreSQL returns a date
+            day = day if isinstance(day, date_type) else datetime.strptime(str(day)[:10], '%Y-%m-%d').date()
+            usage_by_material[material_id][day] = float(total or 0)
+
+    batch = {}
+    for item_id, rows in history.groupby('itemId', sort=False):
+        material = materials.get(item_id)
+        batch[item_id] = {
+            'itemId': item_id,
+            'history': rows.drop(columns='itemId').reset_index(drop=True),
+            'usageByDay': usage_by_material.get(material['id'], {}) if material else {},
+            'material': material,
+        }
+    return batch
+
+def _build_daily_usage_frame(history, usage_by_day):
+    """Build the model frame (ds, y) from the historical rows frame and live daily usage.
+
+    Each historical row spreads its stock quantity evenly over every day from
+    incoming to outgoing date (inclusive). The days are expanded with NumPy
+    repeat/arange and summed per day, without building a Python object per day.
+    Returns (frame, raw_mean). raw_mean is the mean over all expanded day
+    records before they are summed per day, and is used as the fallback rate.
+    Returns (None, 0) when there is no usable data.
+    """
+    import numpy as np
+    import pandas as pd
+
+    parts = []
+    raw_total = 0.0
+    raw_count = 0
+
+    quantities = pd.to_numeric(history['stockQuantity'], errors='coerce').fillna(0)
+    valid = history[history['incomingDate'].notna() & history['outgoingDate'].notna() & (quantities != 0)]
+    if len(valid):
+        incoming = np.array(valid['incomingDate'].tolist(), dtype='datetime64[D]')
+        outgoing = np.array(valid['outgoingDate'].tolist(), dtype='datetime64[D]')
+        spans = (outgoing - incoming).astype(np.int64)
+        quantities = quantities[valid.index].to_numpy(dtype=float)
+        rates = np.round(quantities / np.maximum(spans, 1), 4)
+        counts = np.clip(spans + 1, 0, None)
+        total = int(counts.sum())
+        if total:
+            day_offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            parts.append(pd.DataFrame({
+                'ds': np.repeat(incoming, counts) + day_offsets.astype('timedelta64[D]'),
+                'y': np.repeat(rates, counts),
+            }))
+            raw_total += float((rates * counts).sum())
+            raw_count += total
+
+    if usage_by_day:
+        live_y = np.round(np.array(list(usage_by_day.values()), dtype=float), 4)
+        parts.append(pd.DataFrame({
+            'ds': np.array(list(usage_by_day.keys()), dtype='datetime64[D]'),
+            'y': live_y,
+        }))
+        raw_total += float(live_y.sum())
+        raw_count += len(live_y)
+
+    if not raw_count:
+        return None, 0.0
+
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    df['ds'] = df['ds'].astype('datetime64[ns]')
+    df = df.groupby('ds', as_index=False, sort=True)['y'].sum()
+    df['y'] = df['y'].clip(lower=0)
+    return df, raw_total / raw_count
+
+def _prepare_item_series(inputs):
+    """Build everything the usage-rate engines need for one item: the daily
+    usage frame plus the fit-independent fields (lead time, restock quantity,
+    data source). Returns None when the item has no usable data."""
+    import numpy as np
+    import pandas as pd
+
+    history = inputs['history']
+    material = inputs['material']
 
-    xlsx_rows = HistoricalInventoryData.query.filter_by(item_id=item_id).order_by(
-        HistoricalInventoryData.incoming_date
-    ).all()
-
-    daily_records = []
-    for row in xlsx_rows:
-        if row.incoming_date and row.outgoing_date and row.stock_quantity:
-            days = max(1, (row.outgoing_date - row.incoming_date).days)
-            daily_usage = float(row.stock_quantity) / days
-            cur = row.incoming_date
-            while cur <= row.outgoing_date:
-                daily_records.append({'ds': pd.Timestamp(cur), 'y': round(daily_usage, 4)})
-                cur += timedelta(days=1)
-
-    material = InventoryMaterial.query.filter_by(item_id=item_id, is_archived=False).first()
     live_day_span = 0
-    if material:
-        logs = MaterialUsageLog.query.filter_by(material_id=material.id).all()
-        day_totals = defaultdict(float)
-        for log in logs:
-            day_totals[log.created_at.date()] += log.quantity_used
-        if day_totals:
-            sorted_days = sorted(day_totals.keys())
-            live_day_span = (sorted_days[-1] - sorted_days[0]).days
-            for d, qty in day_totals.items():
-                daily_records.append({'ds': pd.Timestamp(d), 'y': round(qty, 4)})
-
-    if not daily_records:
+    day_totals = inputs['usageByDay']
+    if day_totals:
+        sorted_days = sorted(day_totals.keys())
+        live_day_span = (sorted_days[-1] - sorted_days[0]).days
+
+    df, raw_mean = _build_daily_usage_frame(history, day_totals)
+    if df is None:
         return None
 
-    data_source = 'live' if live_day_span >= 90 else ('hybrid' if live_day_span >= 30 else 'xlsx')
-    material_type = xlsx_rows[0].material_type if xlsx_rows else (material.material_type if material else 'Unknown')
+    lead_times = (pd.to_datetime(history['restockDate']) - pd.to_datetime(history['outgoingDate'])).dt.days
+    lead_times = lead_times[(lead_times > 0) & (lead_times < 180)]
 
-    lead_times = [
-        (row.restock_date - row.outgoing_date).days
-        for row in xlsx_rows
-        if row.outgoing_date and row.restock_date and 0 < (row.restock_date - row.outgoing_date).days < 180
-    ]
-    avg_lead_time = int(sum(lead_times) / len(lead_times)) if lead_times else 7
+    restock_qtys = pd.to_numeric(history['restockQuantity'], errors='coerce')
+    restock_qtys = restock_qtys[restock_qtys > 0]
 
-    restock_qtys = [float(row.restock_quantity) for row in xlsx_rows if row.restock_quantity and float(row.restock_quantity) > 0]
-    suggested_qty = round(sum(restock_qtys) / len(restock_qtys)) if restock_qtys else None
+    # Daily series for the NumPy engines: days without usage between two observed
+    # days count as 0, but gaps longer than AI_MAX_ZERO_GAP_DAYS (e.g. between the
+    # uploaded history and live logs) are treated as missing data and skipped.
+    gaps = df['ds'].diff().dt.days.fillna(1).to_numpy(dtype=int) - 1
+    zeros_before = np.where(gaps <= AI_MAX_ZERO_GAP_DAYS, gaps, 0)
+    positions = np.cumsum(zeros_before + 1) - 1
+    daily = np.zeros(int(positions[-1]) + 1)
+    daily[positions] = df['y'].to_numpy(dtype=float)
 
-    df = None
-    try:
-        import pandas as pd
-        df = pd.DataFrame(daily_records).groupby('ds', as_index=False)['y'].sum()
-        df = df.sort_values('ds').reset_index(drop=True)
-        df['y'] = df['y'].clip(lower=0)
-    except Exception:
-        pass
+    return {
+        'itemId': inputs['itemId'],
+        'material': material,
+        'materialType': history['materialType'].iloc[0] if len(history) else (material['materialType'] if material else 'Unknown'),
+        'dataSource': 'live' if live_day_span >= 90 else ('hybrid' if live_day_span >= 30 else 'xlsx'),
+        'avgLeadTime': int(lead_times.sum() / len(lead_times)) if len(lead_times) else 7,
+        'suggestedQty': round(float(restock_qtys.sum()) / len(restock_qtys)) if len(restock_qtys) else None,
+        'frame': df,
+        'daily': daily,
+        'rawMean': raw_mean,
+    }
+
+def _prediction_engine_config():
+    """Engine selection settings, read once per run in the app process and
+    passed to the fit (pool workers have no database session)."""
+    return {
+        'engine': str(get_setting('ai_forecast_engine') or 'auto').strip().lower(),
+        'prophetMinPoints': get_setting('ai_prophet_min_points'),
+        'intermittentZeroShare': get_setting('ai_intermittent_zero_share'),
+    }
 
-    n_unique = len(df) if df is not None else 0
-    confidence = 'low' if n_unique < 5 else ('medium' if n_unique < 20 else 'high')
+def _choose_prediction_engine(series, config):
+    """Pick the usage-rate engine for one item.
+
+    'auto' sends intermittent series (share of zero-usage days at or above the
+    threshold) to Croston, series with at least prophetMinPoints observed days
+    to Prophet, and everything else to exponential smoothing or, below
+    AI_SES_MIN_POINTS, a moving average. Any other configured engine is forced
+    for every item, except that a single data point always uses its mean.
+    """
+    n_points = len(series['frame'])
+    if n_points < 2:
+        return 'mean'
+    engine = config['engine']
+    if engine in AI_PREDICTION_ENGINES:
+        return engine
+    daily = series['daily']
+    if len(daily) and float((daily <= 0).mean()) >= config['intermittentZeroShare']:
+        return 'croston'
+    if n_points >= config['prophetMinPoints']:
+        return 'prophet'
+    return 'ses' if n_points >= AI_SES_MIN_POINTS else 'moving_average'
+
+def _prophet_usage_rate(series):
+    """Mean forecast daily usage over the next 60 days from a Prophet fit."""
+    import pandas as pd
+    from prophet import Prophet
+
+    df = series['frame']
+    n_points = len(df)
+    model = Prophet(
+        yearly_seasonality=n_points > 365,
+        weekly_seasonality=n_points > 14,
+        daily_seasonality=False,
+        changepoint_prior_scale=0.05,
+        seasonality_mode='additive'
+    )
+    model.fit(df)
+    future = model.make_future_dataframe(periods=60)
+    forecast = model.predict(future)
+    future_only = forecast[forecast['ds'] > pd.Timestamp.now()]
+    return float(future_only['yhat'].head(60).mean())
+
+def _numpy_usage_rates(series_list, engines):
+    """Usage rates for many items at once with vectorized NumPy engines.
+
+    The daily series are right-aligned into one (items x days) matrix padded
+    with NaN, and each engine steps through the days once, updating every
+    item's state in a single array operation:
+      - 'ses': simple exponential smoothing (alpha AI_SES_ALPHA), final level;
+      - 'croston': Croston's method (alpha AI_CROSTON_ALPHA), demand size over
+        demand interval;
+      - 'moving_average': mean of the last AI_MOVING_AVERAGE_WINDOW days;
+      - 'mean': mean of the raw observations.
+    Returns a list of rates in input order.
+    """
+    import numpy as np
+
+    rates = np.zeros(len(series_list))
+    if not series_list:
+        return rates.tolist()
+    engines = np.array(engines)
+    width = max(len(s['daily']) for s in series_list)
+    matrix = np.full((len(series_list), width), np.nan)
+    for row, s in enumerate(series_list):
+        if len(s['daily']):
+            matrix[row, width - len(s['daily']):] = s['daily']
+
+    mean_rows = engines == 'mean'
+    rates[mean_rows] = [s['rawMean'] for s, m in zip(series_list, mean_rows) if m]
+
+    ma_rows = engines == 'moving_average'
+    if ma_rows.any():
+        rates[ma_rows] = np.nanmean(matrix[ma_rows, -AI_MOVING_AVERAGE_WINDOW:], axis=1)
+
+    ses_rows = engines == 'ses'
+    if ses_rows.any():
+        values = matrix[ses_rows]
+        level = np.full(len(values), np.nan)
+        for t in range(width):
+            x = values[:, t]
+            seen = ~np.isnan(x)
+            level = np.where(seen & np.isnan(level), x, level)
+            level = np.where(seen, AI_SES_ALPHA * x + (1 - AI_SES_ALPHA) * level, level)
+        rates[ses_rows] = level
+
+    croston_rows = engines == 'croston'
+    if croston_rows.any():
+        values = matrix[croston_rows]
+        size = np.full(len(values), np.nan)      # smoothed non-zero demand
+        interval = np.full(len(values), np.nan)  # smoothed days between demands
+        since = np.zeros(len(values))            # days since last demand
+        for t in range(width):
+            x = values[:, t]
+            since = since + ~np.isnan(x)
+            demand = np.nan_to_num(x) > 0
+            first = demand & np.isnan(size)
+            size = np.where(first, x, size)
+            interval = np.where(first, since, interval)
+            update = demand & ~first
+            size = np.where(update, size + AI_CROSTON_ALPHA * (x - size), size)
+            interval = np.where(update, interval + AI_CROSTON_ALPHA * (since - interval), interval)
+            since = np.where(demand, 0, since)
+        rates[croston_rows] = np.nan_to_num(size / interval)
+
+    return np.nan_to_num(rates).tolist()
+
+def _finish_prediction(series, usage_rate, engine):
+    avg_daily_usage = max(0.001, usage_rate)
+    material = series['material']
+    suggested_qty = series['suggestedQty'] or max(1, round(avg_daily_usage * 30))
+    n_points = len(series['frame'])
+
+    prediction = {
+        'itemId': series['itemId'],
+        'branchId': material['branchId'] if material else None,
+        'materialType': series['materialType'],
+        'color': material['color'] if material else '',
+        'pattern': material['pattern'] if material else '',
+        'avgDailyUsage': round(avg_daily_usage, 3),
+        'usageRate': avg_daily_usage,
+        'suggestedRestockQty': int(suggested_qty),
+        'avgLeadTimeDays': series['avgLeadTime'],
+        'confidence': 'low' if n_points < 5 else ('medium' if n_points < 20 else 'high'),
+        'dataSource': series['dataSource'],
+        'dataPoints': n_points,
+        'engine': engine,
+        'hasCurrentInventory': material is not None,
+    }
+    return _apply_stock_to_prediction(prediction, material['stockQuantity'] if material else 0)
 
-    avg_daily_usage = 0.001
+def _fit_prophet_series(series):
+    """Prophet fit for one prepared series, falling back to the raw mean when
+    Prophet is unavailable or the fit fails."""
     try:
-        if df is not None and n_unique >= 2:
-            import pandas as pd
-            model = Prophet(
-                yearly_seasonality=n_unique > 365,
-                weekly_seasonality=n_unique > 14,
-                daily_seasonality=False,
-                changepoint_prior_scale=0.05,
-                seasonality_mode='additive'
-            )
-            model.fit(df)
-            future = model.make_future_dataframe(periods=60)
-            forecast = model.predict(future)
-            future_only = forecast[forecast['ds'] > pd.Timestamp.now()]
-            avg_daily_usage = max(0.001, float(future_only['yhat'].head(60).mean()))
-        elif daily_records:
-            avg_daily_usage = max(0.001, sum(r['y'] for r in daily_records) / len(daily_records))
+        return _finish_prediction(series, _prophet_usage_rate(series), 'prophet')
     except Exception:
-        if daily_records:
-            avg_daily_usage = max(0.001, sum(r['y'] for r in daily_records) / len(daily_records))
+        return _finish_prediction(series, series['rawMean'], 'mean')
 
-    current_stock = float(material.stock_quantity) if material else 0
-    days_until_stockout = min(9999, int(current_stock / avg_daily_usage))
+def _fit_item_prediction(inputs, config=None):
+    series = _prepare_item_series(inputs)
+    if series is None:
+        return None
+    engine = _choose_prediction_engine(series, config or _prediction_engine_config())
+    if engine == 'prophet':
+        return _fit_prophet_series(series)
+    return _finish_prediction(series, _numpy_usage_rates([series], [engine])[0], engine)
+
+def _apply_stock_to_prediction(prediction, current_stock):
+    """(Re)derive the stock-dependent fields of a prediction from its fitted usage
+    rate, so a stock change does not require a new model fit."""
+    rate = prediction.get('usageRate') or max(0.001, prediction.get('avgDailyUsage') or 0)
+    days_until_stockout = min(9999, int(current_stock / rate))
     stockout_date = (datetime.now() + timedelta(days=days_until_stockout)).date() if days_until_stockout < 9999 else None
-    restock_by = (datetime.now() + timedelta(days=max(0, days_until_stockout - avg_lead_time))).date() if days_until_stockout < 9999 else None
+    restock_by = (datetime.now() + timedelta(days=max(0, days_until_stockout - prediction['avgLeadTimeDays']))).date() if days_until_stockout < 9999 else None
+
+    prediction['currentStock'] = current_stock
+    prediction['daysUntilStockout'] = days_until_stockout
+    prediction['stockoutDate'] = stockout_date.isoformat() if stockout_date else None
+    prediction['restockByDate'] = restock_by.isoformat() if restock_by else None
+    return prediction
+
+def _prediction_fingerprint(inputs, config):
+    """Hash of everything the model fit depends on: historical rows, daily usage,
+    the linked material and the engine settings. Current stock is deliberately
+    excluded — see _apply_stock_to_prediction()."""
+    material = inputs['material']
+    payload = json.dumps({
+        'config': config,
+        'history': inputs['history'].values.tolist(),
+        'usage': sorted((day.isoformat(), qty) for day, qty in inputs['usageByDay'].items()),
+        'material': [material['id'], material['materialType'], material['color'], material['pattern'], material['branchId']] if material else None,
+    }, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def material_prediction_to_dict(row, with_fingerprint=False):
+    data = {
+        'itemId': row.item_id,
+        'branchId': row.branch_id,
+        'materialType': row.material_type,
+        'color': row.color or '',
+        'pattern': row.pattern or '',
+        'currentStock': row.current_stock,
+        'avgDailyUsage': row.avg_daily_usage,
+        'usageRate': row.usage_rate,
+        'daysUntilStockout': row.days_until_stockout,
+        'stockoutDate': row.stockout_date.isoformat() if row.stockout_date else None,
+        'restockByDate': row.restock_by_date.isoformat() if row.restock_by_date else None,
+        'suggestedRestockQty': row.suggested_restock_qty,
+        'avgLeadTimeDays': row.avg_lead_time_days,
+        'confidence': row.confidence,
+        'dataSource': row.data_source,
+        'dataPoints': row.data_points,
+        'engine': row.engine,
+        'hasCurrentInventory': bool(row.has_current_inventory),
+    }
+    if with_fingerprint:
+        data['fingerprint'] = row.fingerprint
+    return data
 
-    if not suggested_qty:
-        suggested_qty = max(1, round(avg_daily_usage * 30))
+def _material_prediction_row(prediction):
+    """Column mapping of a prediction dict for bulk insert into material_predictions."""
+    return {
+        'item_id': prediction['itemId'],
+        'branch_id': prediction.get('branchId'),
+        'material_type': prediction['materialType'],
+        'color': prediction['color'],
+        'pattern': prediction['pattern'],
+        'current_stock': prediction['currentStock'],
+        'avg_daily_usage': prediction['avgDailyUsage'],
+        'usage_rate': prediction['usageRate'],
+        'days_until_stockout': prediction['daysUntilStockout'],
+        'stockout_date': date_type.fromisoformat(prediction['stockoutDate']) if prediction['stockoutDate'] else None,
+        'restock_by_date': date_type.fromisoformat(prediction['restockByDate']) if prediction['restockByDate'] else None,
+        'suggested_restock_qty': prediction['suggestedRestockQty'],
+        'avg_lead_time_days': prediction['avgLeadTimeDays'],
+        'confidence': prediction['confidence'],
+        'data_source': prediction['dataSource'],
+        'data_points': prediction['dataPoints'],
+        'engine': prediction.get('engine', 'mean'),
+        'has_current_inventory': prediction['hasCurrentInventory'],
+        'fingerprint': prediction.get('fingerprint'),
+        'computed_at': datetime.utcnow(),
+    }
 
+def _compute_prediction_for_item(item_id):
+    inputs = _load_batch_inputs([item_id]).get(item_id)
+    return _fit_item_prediction(inputs) if inputs else None
+
+def _fit_item_chunk(chunk_series):
+    """Prophet-fit a chunk of prepared series; runs inside a pool worker. A failed
+    fit yields None for that item instead of failing the chunk."""
+    results = []
+    for series in chunk_series:
+        try:
+            results.append(_fit_prophet_series(series))
+        except Exception:
+            results.append(None)
+    return results
+
+# Prediction runs are PredictionJob rows. A worker claims the active job under a
+# lease and renews it with every progress update; a job whose lease expired
+# (its worker died) is claimed again, up to AI_JOB_MAX_ATTEMPTS times.
+# Jobs are run by `flask --app app prediction-worker`; with
+# AI_INLINE_PREDICTION_WORKER=1 (the default) the web process that queues a job
+# also drains the queue in a background thread. The same queue runs demand
+# forecasts (kind='demand'), at most one active job per kind.
+PREDICTION_JOB_KINDS = ('predictions', 'demand')
+AI_JOB_LEASE_SECONDS = int(os.getenv('AI_JOB_LEASE_SECONDS', '300'))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', '3'))
+AI_JOB_POLL_SECONDS = 5
+AI_INLINE_PREDICTION_WORKER = os.getenv('AI_INLINE_PREDICTION_WORKER', '1') == '1'
+
+class PredictionJobInterrupted(Exception):
+    pass
+
+class PredictionJobCancelled(PredictionJobInterrupted):
+    pass
+
+class PredictionLeaseLost(PredictionJobInterrupted):
+    pass
+
+def prediction_job_to_dict(job):
     return {
-        'itemId': item_id,
-        'materialType': material_type,
-        'color': material.color if material else '',
-        'pattern': material.pattern if material else '',
-        'currentStock': current_stock,
-        'avgDailyUsage': round(avg_daily_usage, 3),
-        'daysUntilStockout': days_until_stockout,
-        'stockoutDate': stockout_date.isoformat() if stockout_date else None,
-        'restockByDate': restock_by.isoformat() if restock_by else None,
-        'suggestedRestockQty': int(suggested_qty),
-        'avgLeadTimeDays': avg_lead_time,
-        'confidence': confidence,
-        'dataSource': data_source,
-        'dataPoints': n_unique,
-        'hasCurrentInventory': material is not None,
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'fullRefit': bool(job.full_refit),
+        'requestedBy': job.requested_by,
+        'workerId': job.worker_id,
+        'attempts': job.attempts,
+        'cancelRequested': bool(job.cancel_requested),
+        'totalItems': job.total_items,
+        'processedItems': job.processed_items,
+        'error': job.error_message,
+        'createdAt': job.created_at.isoformat() if job.created_at else None,
+        'startedAt': job.started_at.isoformat() if job.started_at else None,
+        'finishedAt': job.finished_at.isoformat() if job.finished_at else None,
     }
 
-def _run_predictions_background(app_obj):
+def active_prediction_job(kind='predictions'):
+    """The queued or running job of this kind, if any."""
+    return PredictionJob.query.filter_by(active_key=kind).first()
+
+def enqueue_prediction_job(full_refit=False, requested_by=None, kind='predictions'):
+    """Queue a run of this kind unless one is already queued or running.
+    Returns (job, created); when a job is already active it is returned instead."""
+    job = PredictionJob(kind=kind, status='queued', active_key=kind, full_refit=full_refit, requested_by=requested_by)
+    db.session.add(job)
+    try:
+        db.session.commit()
+        created = True
+    except IntegrityError:
+        db.session.rollback()
+        job, created = active_prediction_job(kind), False
+    if AI_INLINE_PREDICTION_WORKER:
+        threading.Thread(target=run_prediction_worker, args=(app,), kwargs={'once': True}, daemon=True).start()
+    return job, created
+
+def claim_prediction_job(worker_id):
+    """Claim the oldest active job that is queued or running under an expired
+    lease. Returns the claimed job or None."""
+    for job in PredictionJob.query.filter(PredictionJob.active_key.isnot(None)).order_by(PredictionJob.created_at).all():
+        claimed = _claim_job(job, worker_id)
+        if claimed:
+            return claimed
+    return None
+
+def _claim_job(job, worker_id):
+    """The claim is a conditional UPDATE, so of several workers racing for the
+    same job exactly one gets it."""
+    now = datetime.utcnow()
+
+    expired = (PredictionJob.status == 'running') & (PredictionJob.lease_expires_at < now)
+    if job.attempts >= AI_JOB_MAX_ATTEMPTS or job.cancel_requested:
+        # Cancelled before it ran, or its worker died too often to retry
+        status, message = ('cancelled', None) if job.cancel_requested else ('error', f'Worker lost {job.attempts} times; giving up')
+        db.session.execute(
+            db.update(PredictionJob)
+            .where(PredictionJob.id == job.id, (PredictionJob.status == 'queued') | expired)
+            .values(status=status, active_key=None, error_message=message, lease_expires_at=None, finished_at=now)
+        )
+        db.session.commit()
+        return None
+
+    result = db.session.execute(
+        db.update(PredictionJob)
+        .where(PredictionJob.id == job.id, (PredictionJob.status == 'queued') | expired)
+        .values(
+            status='running',
+            worker_id=worker_id,
+            attempts=PredictionJob.attempts + 1,
+            lease_expires_at=now + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+            started_at=db.func.coalesce(PredictionJob.started_at, now),
+        )
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        return None
+    return db.session.get(PredictionJob, job.id, populate_existing=True)
+
+def _renew_prediction_job_lease(job_id, worker_id, progress):
+    """Record progress and extend the lease. Raises PredictionLeaseLost if another
+    worker has taken the job over, PredictionJobCancelled if a cancel was requested."""
+    result = db.session.execute(
+        db.update(PredictionJob)
+        .where(PredictionJob.id == job_id, PredictionJob.worker_id == worker_id, PredictionJob.status == 'running')
+        .values(
+            total_items=progress['total'],
+            processed_items=progress['processed'],
+            lease_expires_at=datetime.utcnow() + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+        )
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        raise PredictionLeaseLost()
+    if db.session.query(PredictionJob.cancel_requested).filter_by(id=job_id).scalar():
+        raise PredictionJobCancelled()
+
+def _finish_prediction_job(job_id, worker_id, status, error=None):
+    db.session.execute(
+        db.update(PredictionJob)
+        .where(PredictionJob.id == job_id, PredictionJob.worker_id == worker_id)
+        .values(status=status, active_key=None, error_message=error, lease_expires_at=None, finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def run_prediction_worker(app_obj, once=False):
+    """Claim and run prediction jobs. With once=True return as soon as there is
+    nothing to claim; otherwise poll every AI_JOB_POLL_SECONDS."""
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
     with app_obj.app_context():
-        cache = AIPredictionCache.query.first()
-        if not cache:
-            return
-        try:
-            item_ids = [
-                r[0] for r in db.session.query(HistoricalInventoryData.item_id).distinct().all()
-            ]
-            cache.total_items = len(item_ids)
-            cache.processed_items = 0
-            db.session.commit()
+        while True:
+            job = claim_prediction_job(worker_id)
+            if job:
+                if job.kind == 'demand':
+                    _run_demand_forecast_job(job, worker_id)
+                else:
+                    _run_prediction_job(job, worker_id)
+                continue
+            db.session.remove()
+            if once:
+                return
+            time.sleep(AI_JOB_POLL_SECONDS)
+
+@app.cli.command('prediction-worker')
+@click.option('--once', is_flag=True, help='Exit when no job is waiting instead of polling.')
+def prediction_worker_command(once):
+    """Run queued AI prediction and demand forecast jobs."""
+    run_prediction_worker(app, once=once)
+
+def _run_prediction_job(job, worker_id):
+    """Recompute AI predictions for a claimed job. Only items whose input
+    fingerprint changed since the last run are refitted; the rest keep their
+    fitted usage rate and only get their stock-dependent fields refreshed.
+    job.full_refit refits everything. Progress is written to the job together
+    with a lease renewal after every chunk."""
+    cache = AIPredictionCache.query.first()
+    if not cache:
+        cache = AIPredictionCache()
+        db.session.add(cache)
+        db.session.commit()
+    job_id = job.id
+    try:
+        previous = {}
+        if not job.full_refit:
+            previous = {row.item_id: material_prediction_to_dict(row, with_fingerprint=True) for row in MaterialPrediction.query.all()}
+
+        # Inputs are bulk-loaded here, in the app process; pool workers only fit models.
+        config = _prediction_engine_config()
+        batch = _load_batch_inputs()
+        item_ids = list(batch.keys())
+        fingerprints = {item_id: _prediction_fingerprint(inputs, config) for item_id, inputs in batch.items()}
+
+        by_item = {}
+        to_fit = []
+        for item_id in item_ids:
+            prev = previous.get(item_id)
+            if prev and prev.get('fingerprint') == fingerprints[item_id]:
+                material = batch[item_id]['material']
+                by_item[item_id] = _apply_stock_to_prediction(prev, material['stockQuantity'] if material else 0)
+            else:
+                to_fit.append(item_id)
+
+        progress = {'total': len(item_ids), 'processed': len(item_ids) - len(to_fit)}
+        _renew_prediction_job_lease(job_id, worker_id, progress)
+
+        def record(chunk_series, preds):
+            for series, pred in zip(chunk_series, preds):
+                if pred:
+                    pred['fingerprint'] = fingerprints[series['itemId']]
+                    by_item[series['itemId']] = pred
+            progress['processed'] += len(chunk_series)
+            _renew_prediction_job_lease(job_id, worker_id, progress)
+
+        prophet_series, light_series, light_engines = [], [], []
+        skipped = 0
+        for item_id in to_fit:
+            series = _prepare_item_series(batch[item_id])
+            if series is None:
+                skipped += 1
+                continue
+            engine = _choose_prediction_engine(series, config)
+            if engine == 'prophet':
+                prophet_series.append(series)
+            else:
+                light_series.append(series)
+                light_engines.append(engine)
+        progress['processed'] += skipped
+
+        # Short and sparse series: one vectorized pass over all of them
+        if light_series:
+            rates = _numpy_usage_rates(light_series, light_engines)
+            record(light_series, [
+                _finish_prediction(series, rate, engine)
+                for series, rate, engine in zip(light_series, rates, light_engines)
+            ])
+
+        chunks = [
+            prophet_series[i:i + AI_PREDICTION_CHUNK_SIZE]
+            for i in range(0, len(prophet_series), AI_PREDICTION_CHUNK_SIZE)
+        ]
 
-            results = []
-            for i, item_id in enumerate(item_ids):
-                try:
-                    pred = _compute_prediction_for_item(item_id)
-                    if pred:
-                        results.append(pred)
-                except Exception:
-                    pass
-                cache.processed_items = i + 1
-                if i % 10 == 0:
-                    db.session.commit()
-
-            cache.predictions_json = json.dumps(results)
-            cache.status = 'done'
-            cache.computed_at = datetime.utcnow()
-            db.session.commit()
-        except Exception as e:
-            cache.status = 'error'
-            cache.error_message = str(e)
-            db.session.commit()
+        pending = set(range(len(chunks)))
+        workers = min(AI_PREDICTION_WORKERS, len(chunks))
+        if workers > 1:
+            try:
+                # spawn: forking from this (threaded) server process is not safe
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    futures = {pool.submit(_fit_item_chunk, chunks[idx]): idx for idx in pending}
+                    try:
+                        for future in as_completed(futures):
+                            idx = futures[future]
+                            try:
+                                preds = future.result()
+                            except Exception:
+                                continue  # worker died; refitted in-process below
+                            record(chunks[idx], preds)
+                            pending.discard(idx)
+                    except PredictionJobInterrupted:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+            except PredictionJobInterrupted:
+                raise
+            except Exception:
+                pass  # pool could not start or broke; remaining chunks are fitted below
+
+        for idx in sorted(pending):
+            record(chunks[idx], _fit_item_chunk(chunks[idx]))
+
+        results = [by_item[item_id] for item_id in item_ids if item_id in by_item]
+        MaterialPrediction.query.delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(MaterialPrediction, [_material_prediction_row(p) for p in results])
+        cache.status = 'done'
+        cache.total_items = progress['total']
+        cache.processed_items = progress['processed']
+        cache.computed_at = datetime.utcnow()
+        cache.error_message = None
+        db.session.commit()
+        _finish_prediction_job(job_id, worker_id, 'done')
+    except PredictionJobCancelled:
+        db.session.rollback()
+        _finish_prediction_job(job_id, worker_id, 'cancelled')
+    except PredictionLeaseLost:
+        db.session.rollback()  # another worker reclaimed the job; leave it alone
+    except Exception as e:
+        db.session.rollback()
+        cache.status = 'error'
+        cache.error_message = str(e)
+        db.session.commit()
+        _finish_prediction_job(job_id, worker_id, 'error', str(e))
 
 @app.route('/api/inventory/ai/upload-historical', methods=['POST'])
 @require_auth
@@ -5801,75 +8428,64 @@ def upload_historical_inventory():
     if 'file' not in request.files:
         return jsonify({'status': 'error', 'message': 'No file provided'}), 400
 
-    file = request.files['file']
-    if not file.filename or not file.filename.lower().endswith(('.xlsx', '.xls')):
-        return jsonify({'status': 'error', 'message': 'Please upload an Excel file (.xlsx or .xls)'}), 400
+    job = active_prediction_job()
+    if job and job.status == 'running':
+        return jsonify({'status': 'error', 'message': 'Predictions are being computed. Wait for the run to finish or cancel it first.'}), 400
 
+    file = request.files['file']
+    ext = os.path.splitext(file.filename.lower())[1] if file.filename else ''
+    if ext not in HISTORICAL_UPLOAD_EXTENSIONS:
+        return jsonify({'status': 'error', 'message': 'Please upload an Excel (.xlsx or .xls), CSV or Parquet file'}), 400
+    if ext == '.parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            return jsonify({'status': 'error', 'message': 'pyarrow not installed. Run: pip install pyarrow'}), 503
+
+    # Spool the upload to disk and read it back in chunks, so memory stays
+    # bounded by HISTORICAL_READ_CHUNK_ROWS rather than by the file size.
+    fd, path = tempfile.mkstemp(prefix='historical_', suffix=ext)
+    os.close(fd)
+    chunks = None
     try:
-        df = pd.read_excel(file, engine='openpyxl')
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': f'Could not read file: {str(e)}'}), 400
-
-    # Normalize column names
-    df.columns = [str(c).strip().lower().replace(' ', '_') for c in df.columns]
-
-    col_map = {
-        'item_id': next((c for c in df.columns if 'item' in c and 'id' in c), None),
-        'material_type': next((c for c in df.columns if 'material' in c and 'type' in c), None),
-        'stock_quantity': next((c for c in df.columns if 'stock' in c and 'qty' in c or ('stock' in c and 'quantity' in c)), None),
-        'incoming_date': next((c for c in df.columns if 'incoming' in c), None),
-        'outgoing_date': next((c for c in df.columns if 'outgoing' in c), None),
-        'restock_date': next((c for c in df.columns if 'restock' in c and 'date' in c), None),
-        'restock_quantity': next((c for c in df.columns if 'restock' in c and ('qty' in c or 'quantity' in c)), None),
-        'restock_cycle': next((c for c in df.columns if 'restock' in c and 'cycle' in c), None),
-    }
-
-    if not col_map['item_id'] or not col_map['stock_quantity'] or not col_map['incoming_date'] or not col_map['outgoing_date']:
-        missing = [k for k, v in col_map.items() if v is None and k in ('item_id', 'stock_quantity', 'incoming_date', 'outgoing_date')]
-        return jsonify({'status': 'error', 'message': f'Missing required columns: {", ".join(missing)}. Found columns: {list(df.columns)}'}), 400
-
-    # Clear old data
-    HistoricalInventoryData.query.delete()
-    db.session.commit()
-
-    rows_saved = 0
-    for _, row in df.iterrows():
-        item_id = str(row.get(col_map['item_id'], '') or '').strip()
-        if not item_id:
-            continue
-
-        stock_qty = row.get(col_map['stock_quantity'], 0)
+        file.save(path)
+        chunks = _iter_historical_chunks(path, ext)
         try:
-            stock_qty = float(stock_qty)
-        except (ValueError, TypeError):
-            stock_qty = 0
-
-        restock_qty = 0
-        if col_map['restock_quantity']:
-            try:
-                restock_qty = float(row.get(col_map['restock_quantity'], 0) or 0)
-            except (ValueError, TypeError):
-                restock_qty = 0
-
-        restock_cycle = 0
-        if col_map['restock_cycle']:
-            try:
-                restock_cycle = int(float(row.get(col_map['restock_cycle'], 0) or 0))
-            except (ValueError, TypeError):
-                restock_cycle = 0
-
-        entry = HistoricalInventoryData(
-            item_id=item_id,
-            material_type=str(row.get(col_map['material_type'], '') or '').strip() if col_map['material_type'] else '',
-            stock_quantity=stock_qty,
-            incoming_date=_parse_date(row.get(col_map['incoming_date'])),
-            outgoing_date=_parse_date(row.get(col_map['outgoing_date'])),
-            restock_date=_parse_date(row.get(col_map['restock_date'])) if col_map['restock_date'] else None,
-            restock_quantity=restock_qty,
-            restock_cycle=restock_cycle,
-        )
-        db.session.add(entry)
-        rows_saved += 1
+            chunk = next(chunks, None)
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': f'Could not read file: {str(e)}'}), 400
+        if chunk is None:
+            return jsonify({'status': 'error', 'message': 'The uploaded file has no header row'}), 400
+
+        # Normalize column names
+        columns = [str(c).strip().lower().replace(' ', '_') for c in chunk.columns]
+        col_map = _historical_column_map(columns)
+
+        if not col_map['item_id'] or not col_map['stock_quantity'] or not col_map['incoming_date'] or not col_map['outgoing_date']:
+            missing = [k for k, v in col_map.items() if v is None and k in ('item_id', 'stock_quantity', 'incoming_date', 'outgoing_date')]
+            return jsonify({'status': 'error', 'message': f'Missing required columns: {", ".join(missing)}. Found columns: {columns}'}), 400
+
+        # Replace old data; the delete and the chunked inserts commit together below
+        HistoricalInventoryData.query.delete()
+        insert = HistoricalInventoryData.__table__.insert()
+        rows_saved = 0
+        item_ids = set()
+        try:
+            while chunk is not None:
+                chunk.columns = columns
+                records = _normalize_historical_frame(chunk, col_map)
+                for start in range(0, len(records), HISTORICAL_INSERT_CHUNK_SIZE):
+                    db.session.execute(insert, records.iloc[start:start + HISTORICAL_INSERT_CHUNK_SIZE].to_dict('records'))
+                rows_saved += len(records)
+                item_ids.update(records['item_id'].unique())
+                chunk = next(chunks, None)
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': f'Could not read file: {str(e)}'}), 400
+    finally:
+        if chunks is not None:
+            chunks.close()  # releases the read-only workbook handle
+        os.remove(path)
 
     # Update/create cache record
     cache = AIPredictionCache.query.first()
@@ -5877,11 +8493,9 @@ def upload_historical_inventory():
         cache = AIPredictionCache()
         db.session.add(cache)
 
-    unique_items = len(df[col_map['item_id']].dropna().unique()) if col_map['item_id'] else 0
-    cache.status = 'computing'
-    cache.predictions_json = '[]'
+    unique_items = len(item_ids)
+    # Previous predictions are kept so unchanged items can reuse their fit
     cache.total_items = unique_items
-    cache.processed_items = 0
     cache.upload_rows = rows_saved
     cache.upload_items = unique_items
     cache.last_uploaded_at = datetime.utcnow()
@@ -5894,20 +8508,77 @@ def upload_historical_inventory():
         request.remote_addr or '0.0.0.0'
     )
 
-    # Start background computation
-    t = threading.Thread(target=_run_predictions_background, args=(app,), daemon=True)
-    t.start()
+    job, _ = enqueue_prediction_job(requested_by=request.current_user['id'])
 
     return jsonify({
         'status': 'success',
         'message': f'Uploaded {rows_saved} rows for {unique_items} items. Computing predictions in background...',
         'rowsSaved': rows_saved,
         'uniqueItems': unique_items,
+        'job': prediction_job_to_dict(job),
     })
 
+PREDICTION_URGENT_DAYS = 7
+PREDICTION_SOON_DAYS = 30
+PREDICTION_PERIOD_DAYS = {'week': 7, 'month': 30, 'quarter': 90}
+PREDICTION_SORT_COLUMNS = {
+    'daysUntilStockout': MaterialPrediction.days_until_stockout,
+    'restockByDate': MaterialPrediction.restock_by_date,
+    'avgDailyUsage': MaterialPrediction.avg_daily_usage,
+    'currentStock': MaterialPrediction.current_stock,
+    'itemId': MaterialPrediction.item_id,
+    'materialType': MaterialPrediction.material_type,
+}
+
+def _prediction_period_filter(period_days):
+    """Items that run out, or must be reordered, within period_days from today."""
+    cutoff = datetime.now().date() + timedelta(days=period_days)
+    return db.or_(
+        MaterialPrediction.days_until_stockout <= period_days,
+        MaterialPrediction.restock_by_date <= cutoff,
+    )
+
+def _prediction_filters(args):
+    """SQL filters for the predictions list from query args:
+    urgency (urgent|soon|ok), period (week|month|quarter), branchId and search."""
+    filters = []
+    urgency = args.get('urgency', 'all')
+    if urgency == 'urgent':
+        filters.append(MaterialPrediction.days_until_stockout <= PREDICTION_URGENT_DAYS)
+    elif urgency == 'soon':
+        filters.append(MaterialPrediction.days_until_stockout > PREDICTION_URGENT_DAYS)
+        filters.append(MaterialPrediction.days_until_stockout <= PREDICTION_SOON_DAYS)
+    elif urgency == 'ok':
+        filters.append(MaterialPrediction.days_until_stockout > PREDICTION_SOON_DAYS)
+
+    period = args.get('period')
+    if period in PREDICTION_PERIOD_DAYS:
+        filters.append(_prediction_period_filter(PREDICTION_PERIOD_DAYS[period]))
+
+    branch_id = args.get('branchId', type=int)
+    if branch_id:
+        filters.append(MaterialPrediction.branch_id == branch_id)
+
+    search = (args.get('search') or '').strip()
+    if search:
+        pattern = f'%{search}%'
+        filters.append(db.or_(
+            MaterialPrediction.item_id.ilike(pattern),
+            MaterialPrediction.material_type.ilike(pattern),
+            MaterialPrediction.color.ilike(pattern),
+            MaterialPrediction.pattern.ilike(pattern),
+        ))
+    return filters
+
 @app.route('/api/inventory/ai/predictions', methods=['GET'])
 @require_auth
 def get_ai_predictions():
+    """Prediction status plus the filtered, sorted prediction list.
+
+    Query args: urgency, period, branchId, search (see _prediction_filters),
+    sort (a PREDICTION_SORT_COLUMNS key, default daysUntilStockout), order
+    (asc|desc) and page/pageSize. Without pageSize every matching row is returned.
+    """
     cache = AIPredictionCache.query.first()
     if not cache:
         return jsonify({'status': 'success', 'data': {
@@ -5920,25 +8591,122 @@ def get_ai_predictions():
             'lastUploadedAt': None,
             'computedAt': None,
             'error': None,
+            'summary': {'total': 0, 'urgentCount': 0, 'soonCount': 0},
+            'pagination': None,
+            'job': None,
         }})
 
-    try:
-        predictions = json.loads(cache.predictions_json or '[]')
-    except Exception:
-        predictions = []
+    query = MaterialPrediction.query.filter(*_prediction_filters(request.args))
+
+    sort_column = PREDICTION_SORT_COLUMNS.get(request.args.get('sort'), MaterialPrediction.days_until_stockout)
+    order = sort_column.desc() if request.args.get('order') == 'desc' else sort_column.asc()
+    query = query.order_by(order, MaterialPrediction.item_id)
+
+    pagination = None
+    page_size = request.args.get('pageSize', type=int)
+    if page_size:
+        page_size = max(1, min(page_size, 500))
+        page = max(1, request.args.get('page', 1, type=int))
+        total = query.order_by(None).count()
+        rows = query.offset((page - 1) * page_size).limit(page_size).all()
+        pagination = {
+            'page': page,
+            'pageSize': page_size,
+            'total': total,
+            'totalPages': (total + page_size - 1) // page_size,
+        }
+    else:
+        rows = query.all()
+
+    # Urgency counts over all predictions, independent of the list filters
+    days = MaterialPrediction.days_until_stockout
+    total, urgent_count, soon_count = db.session.query(
+        db.func.count(MaterialPrediction.id),
+        db.func.sum(db.case((days <= PREDICTION_URGENT_DAYS, 1), else_=0)),
+        db.func.sum(db.case(((days > PREDICTION_URGENT_DAYS) & (days <= PREDICTION_SOON_DAYS), 1), else_=0)),
+    ).one()
 
+    job = active_prediction_job()
     return jsonify({'status': 'success', 'data': {
-        'status': cache.status,
-        'predictions': predictions,
-        'totalItems': cache.total_items,
-        'processedItems': cache.processed_items,
+        'status': 'computing' if job else cache.status,
+        'predictions': [material_prediction_to_dict(row) for row in rows],
+        'totalItems': job.total_items if job else cache.total_items,
+        'processedItems': job.processed_items if job else cache.processed_items,
         'uploadRows': cache.upload_rows,
         'uploadItems': cache.upload_items,
         'lastUploadedAt': cache.last_uploaded_at.isoformat() if cache.last_uploaded_at else None,
         'computedAt': cache.computed_at.isoformat() if cache.computed_at else None,
         'error': cache.error_message,
+        'summary': {'total': total, 'urgentCount': int(urgent_count or 0), 'soonCount': int(soon_count or 0)},
+        'pagination': pagination,
+        'job': prediction_job_to_dict(job) if job else None,
     }})
 
+# The status stream re-reads progress every AI_STATUS_STREAM_INTERVAL seconds,
+# sends a keepalive comment when nothing changed for AI_STATUS_KEEPALIVE_SECONDS,
+# and closes after AI_STATUS_STREAM_MAX_SECONDS (clients reconnect).
+AI_STATUS_STREAM_INTERVAL = 1
+AI_STATUS_KEEPALIVE_SECONDS = 15
+AI_STATUS_STREAM_MAX_SECONDS = 600
+
+def _prediction_progress():
+    """Progress counters only — no prediction rows."""
+    cache = AIPredictionCache.query.first()
+    job = active_prediction_job()
+    if job:
+        return {
+            'status': 'computing',
+            'jobId': job.id,
+            'jobStatus': job.status,
+            'totalItems': job.total_items,
+            'processedItems': job.processed_items,
+            'computedAt': cache.computed_at.isoformat() if cache and cache.computed_at else None,
+            'error': None,
+        }
+    return {
+        'status': cache.status if cache else 'idle',
+        'jobId': None,
+        'jobStatus': None,
+        'totalItems': cache.total_items if cache else 0,
+        'processedItems': cache.processed_items if cache else 0,
+        'computedAt': cache.computed_at.isoformat() if cache and cache.computed_at else None,
+        'error': cache.error_message if cache else None,
+    }
+
+@app.route('/api/inventory/ai/status', methods=['GET'])
+@require_auth
+def get_ai_prediction_status():
+    return jsonify({'status': 'success', 'data': _prediction_progress()})
+
+@app.route('/api/inventory/ai/status/stream', methods=['GET'])
+@require_auth
+def stream_ai_prediction_status():
+    """Server-sent events: a 'progress' event whenever the counters change while
+    predictions compute, then one 'complete' event, after which the stream ends."""
+    def events():
+        last = None
+        last_sent = time.monotonic()
+        deadline = last_sent + AI_STATUS_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            progress = _prediction_progress()
+            db.session.rollback()  # end the read so the next poll sees new commits
+            if progress != last:
+                event = 'progress' if progress['status'] == 'computing' else 'complete'
+                yield f"event: {event}\ndata: {json.dumps(progress)}\n\n"
+                if event == 'complete':
+                    return
+                last = progress
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= AI_STATUS_KEEPALIVE_SECONDS:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(AI_STATUS_STREAM_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/api/inventory/ai/recompute', methods=['POST'])
 @require_auth
 @require_roles('administrator', 'supervisor')
@@ -5947,19 +8715,57 @@ def recompute_ai_predictions():
     if not cache or cache.upload_rows == 0:
         return jsonify({'status': 'error', 'message': 'No historical data uploaded yet'}), 400
 
-    if cache.status == 'computing':
-        return jsonify({'status': 'error', 'message': 'Computation already in progress'}), 400
+    # ?full=true discards stored fits and refits every item
+    full_refit = request.args.get('full', 'false').lower() == 'true'
 
-    cache.status = 'computing'
-    cache.predictions_json = '[]'
-    cache.processed_items = 0
-    cache.error_message = None
-    db.session.commit()
+    job, created = enqueue_prediction_job(full_refit=full_refit, requested_by=request.current_user['id'])
+    if not created:
+        return jsonify({'status': 'error', 'message': 'Computation already in progress', 'data': prediction_job_to_dict(job)}), 400
+
+    return jsonify({'status': 'success', 'message': 'Recomputing predictions...', 'data': prediction_job_to_dict(job)})
 
-    t = threading.Thread(target=_run_predictions_background, args=(app,), daemon=True)
-    t.start()
+@app.route('/api/inventory/ai/jobs', methods=['GET'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def get_prediction_jobs():
+    query = PredictionJob.query
+    kind = request.args.get('kind')
+    if kind in PREDICTION_JOB_KINDS:
+        query = query.filter_by(kind=kind)
+    jobs = query.order_by(PredictionJob.created_at.desc()).limit(20).all()
+    return jsonify({'status': 'success', 'data': [prediction_job_to_dict(j) for j in jobs]})
+
+@app.route('/api/inventory/ai/jobs/<int:job_id>', methods=['GET'])
+@require_auth
+def get_prediction_job(job_id):
+    job = db.session.get(PredictionJob, job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify({'status': 'success', 'data': prediction_job_to_dict(job)})
+
+@app.route('/api/inventory/ai/jobs/<int:job_id>/cancel', methods=['POST'])
+@require_auth
+@require_roles('administrator', 'supervisor')
+def cancel_prediction_job(job_id):
+    job = db.session.get(PredictionJob, job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    if job.status not in ('queued', 'running'):
+        return jsonify({'status': 'error', 'message': f'Job is already {job.status}'}), 400
+
+    # A queued job is cancelled here; a running one stops at its next progress update
+    result = db.session.execute(
+        db.update(PredictionJob)
+        .where(PredictionJob.id == job_id, PredictionJob.status == 'queued')
+        .values(status='cancelled', active_key=None, cancel_requested=True, finished_at=datetime.utcnow())
+    )
+    if result.rowcount != 1:
+        db.session.execute(db.update(PredictionJob).where(PredictionJob.id == job_id).values(cancel_requested=True))
+    db.session.commit()
+    db.session.refresh(job)
 
-    return jsonify({'status': 'success', 'message': 'Recomputing predictions...'})
+    log_action(request.current_user['id'], request.current_user['fullName'], 'UPDATE', 'AI', f"Cancelled prediction job #{job_id}", request.remote_addr or '0.0.0.0')
+    return jsonify({'status': 'success', 'data': prediction_job_to_dict(job)})
 
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,5 @@
+"""Reproducible benchmarks for the prediction and upload paths.
+
+Run from fullstack/backend, e.g. ``python -m bench.daily_usage``. Each script
+prints its own table; none of them touch smaeve_system.db.
+"""
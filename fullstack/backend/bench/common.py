@@ -0,0 +1,37 @@
+"""Shared helpers for the benchmark scripts."""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(database_path=None):
+    """Import the app against a throwaway SQLite file (the app reads
+    DATABASE_URL at import time) and return the module."""
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(prefix='smaeve_bench_'), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app
+    return app
+
+
+def measure(fn, *args, trace_memory=True, **kwargs):
+    """Run fn once; return (result, seconds, peak MB). Peak memory comes from
+    tracemalloc, which also slows the run, so timings are taken with it off
+    when trace_memory is False."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else 0.0
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
@@ -0,0 +1,86 @@
+"""Micro-benchmark for _build_daily_usage_frame() against the per-day loop it
+replaced (kept below as legacy_daily_usage_frame).
+
+    python -m bench.daily_usage            # 200, 2000 and 5000 rows
+    python -m bench.daily_usage --quick    # skips the 5000-row case
+
+Reports wall time (tracemalloc off) and tracemalloc peak for both versions and
+checks that they return the same frame.
+"""
+import argparse
+from datetime import date, timedelta
+
+from bench.common import load_app, measure
+
+# (history rows, longest incoming -> outgoing span in days)
+CASES = [(200, 60), (2000, 365), (5000, 730)]
+LIVE_USAGE_DAYS = 90
+
+
+def make_inputs(rows, max_span, seed=0):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    start = date(2022, 1, 1)
+    incoming = [start + timedelta(days=int(d)) for d in rng.integers(0, 1000, rows)]
+    outgoing = [d + timedelta(days=int(s)) for d, s in zip(incoming, rng.integers(0, max_span + 1, rows))]
+    history = pd.DataFrame({
+        'stockQuantity': rng.integers(1, 500, rows).astype(float),
+        'incomingDate': incoming,
+        'outgoingDate': outgoing,
+    })
+    live_start = date(2025, 1, 1)
+    usage_by_day = {live_start + timedelta(days=i): float(rng.integers(1, 20)) for i in range(LIVE_USAGE_DAYS)}
+    return history, usage_by_day
+
+
+def legacy_daily_usage_frame(history, usage_by_day):
+    """The loop _build_daily_usage_frame() replaced: one dict per expanded day."""
+    import pandas as pd
+
+    daily_records = []
+    for row in history.to_dict('records'):
+        if row['incomingDate'] and row['outgoingDate'] and row['stockQuantity']:
+            days = max(1, (row['outgoingDate'] - row['incomingDate']).days)
+            daily_usage = float(row['stockQuantity']) / days
+            cur = row['incomingDate']
+            while cur <= row['outgoingDate']:
+                daily_records.append({'ds': pd.Timestamp(cur), 'y': round(daily_usage, 4)})
+                cur += timedelta(days=1)
+    for d, qty in usage_by_day.items():
+        daily_records.append({'ds': pd.Timestamp(d), 'y': round(qty, 4)})
+    if not daily_records:
+        return None, 0.0
+
+    df = pd.DataFrame(daily_records).groupby('ds', as_index=False)['y'].sum()
+    df = df.sort_values('ds').reset_index(drop=True)
+    df['y'] = df['y'].clip(lower=0)
+    return df, sum(r['y'] for r in daily_records) / len(daily_records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='skip the largest case')
+    args = parser.parse_args()
+    app = load_app()
+
+    import pandas as pd
+
+    print(f"{'rows':>6} {'span':>5} | {'legacy s':>9} {'legacy MB':>10} | {'vector s':>9} {'vector MB':>10} | speedup")
+    for rows, span in CASES[:-1] if args.quick else CASES:
+        history, usage = make_inputs(rows, span)
+        (old_df, old_mean), old_s, _ = measure(legacy_daily_usage_frame, history, usage, trace_memory=False)
+        _, _, old_mb = measure(legacy_daily_usage_frame, history, usage)
+        (new_df, new_mean), new_s, _ = measure(app._build_daily_usage_frame, history, usage, trace_memory=False)
+        _, _, new_mb = measure(app._build_daily_usage_frame, history, usage)
+
+        old_df['ds'] = old_df['ds'].astype('datetime64[ns]')  # unit differs across pandas versions
+        pd.testing.assert_frame_equal(old_df.reset_index(drop=True), new_df.reset_index(drop=True), check_exact=False)
+        # The loop sums millions of day records one by one, NumPy per row: allow float drift
+        assert abs(old_mean - new_mean) < 1e-6 * max(1.0, abs(old_mean)), (old_mean, new_mean)
+        print(f"{rows:>6} {span:>5} | {old_s:>9.3f} {old_mb:>10.1f} | {new_s:>9.3f} {new_mb:>10.1f} | {old_s / new_s:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
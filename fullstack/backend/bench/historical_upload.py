@@ -0,0 +1,206 @@
+"""Timing script for the historical-inventory upload: the chunked read,
+column-wise normalization and executemany insert used by
+upload_historical_inventory(), against the iterrows/ORM loop it replaced (kept
+below as legacy_ingest).
+
+    python -m bench.historical_upload                  # 200k-row .xlsx
+    python -m bench.historical_upload --rows 50000 --format csv
+    python -m bench.historical_upload --keep upload.xlsx
+
+Generates a workbook shaped like a real export (100 rows per item, some
+'No restock' placeholders and blank cells), then reports read and insert time
+and rows/second for both versions, each into an emptied
+historical_inventory_data table.
+"""
+import argparse
+import os
+import tempfile
+from datetime import date, timedelta
+
+from bench.common import load_app, measure
+
+ROWS_PER_ITEM = 100
+HEADER = ['Item ID', 'Material Type', 'Stock Qty', 'Incoming Date', 'Outgoing Date',
+          'Restock Date', 'Restock Qty', 'Restock Cycle']
+MATERIAL_TYPES = ['Foam', 'Vinyl', 'Leather', 'Fabric', 'Thread', 'Webbing', 'Batting', 'Staples']
+
+
+def generate_rows(rows, seed=0):
+    """Yield rows of HEADER values: ids as ints, dates as date objects, with
+    about 1 in 5 restock columns set to 'No restock' and 1 in 50 stock cells
+    left blank."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    start = date(2022, 1, 1)
+    incoming = rng.integers(0, 1000, rows)
+    spans = rng.integers(1, 120, rows)
+    stock = rng.integers(1, 500, rows)
+    restock_after = rng.integers(0, 60, rows)
+    restock_qty = rng.integers(10, 300, rows)
+    cycle = rng.integers(7, 90, rows)
+    no_restock = rng.random(rows) < 0.2
+    blank_stock = rng.random(rows) < 0.02
+    for i in range(rows):
+        item = 1000 + i // ROWS_PER_ITEM
+        came_in = start + timedelta(days=int(incoming[i]))
+        went_out = came_in + timedelta(days=int(spans[i]))
+        if no_restock[i]:
+            restock = ('No restock', 'No restock', 'No restock')
+        else:
+            restock = (went_out + timedelta(days=int(restock_after[i])), int(restock_qty[i]), int(cycle[i]))
+        yield (item, MATERIAL_TYPES[item % len(MATERIAL_TYPES)], None if blank_stock[i] else int(stock[i]),
+               came_in, went_out, *restock)
+
+
+def write_upload(path, rows):
+    """Write the generated rows to path as .xlsx (write-only openpyxl) or .csv."""
+    if path.endswith('.csv'):
+        import csv
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(('' if v is None else v for v in row) for row in generate_rows(rows))
+        return
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('History')
+    sheet.append(HEADER)
+    for row in generate_rows(rows):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def legacy_parse_date(val):
+    if not val or str(val).strip().lower() in ('', 'no restock', 'none', 'nat', 'nan'):
+        return None
+    try:
+        import pandas as pd
+        ts = pd.to_datetime(val, errors='coerce')
+        return None if pd.isna(ts) else ts.date()
+    except Exception:
+        return None
+
+
+def legacy_ingest(app, path):
+    """The upload handler before the chunked rewrite: one read_excel/read_csv
+    of the whole file, then one ORM object per row."""
+    import pandas as pd
+
+    df = pd.read_csv(path) if path.endswith('.csv') else pd.read_excel(path)
+    df.columns = [str(c).strip().lower().replace(' ', '_') for c in df.columns]
+    col_map = app._historical_column_map(list(df.columns))
+
+    app.HistoricalInventoryData.query.delete()
+    app.db.session.commit()
+
+    rows_saved = 0
+    for _, row in df.iterrows():
+        item_id = str(row.get(col_map['item_id'], '') or '').strip()
+        if not item_id:
+            continue
+
+        stock_qty = row.get(col_map['stock_quantity'], 0)
+        try:
+            stock_qty = float(stock_qty)
+        except (ValueError, TypeError):
+            stock_qty = 0
+
+        restock_qty = 0
+        if col_map['restock_quantity']:
+            try:
+                restock_qty = float(row.get(col_map['restock_quantity'], 0) or 0)
+            except (ValueError, TypeError):
+                restock_qty = 0
+
+        restock_cycle = 0
+        if col_map['restock_cycle']:
+            try:
+                restock_cycle = int(float(row.get(col_map['restock_cycle'], 0) or 0))
+            except (ValueError, TypeError):
+                restock_cycle = 0
+
+        entry = app.HistoricalInventoryData(
+            item_id=item_id,
+            material_type=str(row.get(col_map['material_type'], '') or '').strip() if col_map['material_type'] else '',
+            stock_quantity=stock_qty,
+            incoming_date=legacy_parse_date(row.get(col_map['incoming_date'])),
+            outgoing_date=legacy_parse_date(row.get(col_map['outgoing_date'])),
+            restock_date=legacy_parse_date(row.get(col_map['restock_date'])) if col_map['restock_date'] else None,
+            restock_quantity=restock_qty,
+            restock_cycle=restock_cycle,
+        )
+        app.db.session.add(entry)
+        rows_saved += 1
+    app.db.session.commit()
+    return rows_saved
+
+
+def chunked_ingest(app, path):
+    """The body of upload_historical_inventory() between the saved file and
+    the cache update."""
+    ext = os.path.splitext(path)[1]
+    chunks = app._iter_historical_chunks(path, ext)
+    try:
+        chunk = next(chunks)
+        columns = [str(c).strip().lower().replace(' ', '_') for c in chunk.columns]
+        col_map = app._historical_column_map(columns)
+
+        app.HistoricalInventoryData.query.delete()
+        insert = app.HistoricalInventoryData.__table__.insert()
+        rows_saved = 0
+        while chunk is not None:
+            chunk.columns = columns
+            records = app._normalize_historical_frame(chunk, col_map)
+            for start in range(0, len(records), app.HISTORICAL_INSERT_CHUNK_SIZE):
+                app.db.session.execute(insert, records.iloc[start:start + app.HISTORICAL_INSERT_CHUNK_SIZE].to_dict('records'))
+            rows_saved += len(records)
+            chunk = next(chunks, None)
+    finally:
+        chunks.close()
+    app.db.session.commit()
+    return rows_saved
+
+
+def table_digest(app):
+    """Row count and per-column aggregates, to check both versions stored the same data."""
+    H = app.HistoricalInventoryData
+    f = app.db.func
+    return app.db.session.query(
+        f.count(H.id), f.count(f.distinct(H.item_id)), f.sum(H.stock_quantity), f.sum(H.restock_quantity),
+        f.sum(H.restock_cycle), f.count(H.restock_date), f.min(H.incoming_date), f.max(H.outgoing_date),
+    ).one()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='data rows to generate (default 200000)')
+    parser.add_argument('--format', choices=('xlsx', 'csv'), default='xlsx')
+    parser.add_argument('--keep', metavar='PATH', help='write the generated file here and keep it')
+    parser.add_argument('--skip-legacy', action='store_true', help='time only the current path')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='smaeve_bench_')
+    path = args.keep or os.path.join(workdir, f'historical.{args.format}')
+    app = load_app(os.path.join(workdir, 'bench.db'))
+    with app.app.app_context():
+        app.db.create_all()
+
+        _, gen_s, _ = measure(write_upload, path, args.rows, trace_memory=False)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f'generated {args.rows} rows ({args.rows // ROWS_PER_ITEM} items), {size_mb:.1f} MB {args.format} in {gen_s:.1f}s')
+
+        print(f"{'version':>8} | {'rows':>7} {'seconds':>8} {'rows/s':>9} | {'peak MB':>8}")
+        results = {}
+        versions = [('chunked', chunked_ingest)] if args.skip_legacy else [('legacy', legacy_ingest), ('chunked', chunked_ingest)]
+        for name, ingest in versions:
+            saved, seconds, _ = measure(ingest, app, path, trace_memory=False)
+            results[name] = table_digest(app)
+            _, _, peak = measure(ingest, app, path)
+            print(f'{name:>8} | {saved:>7} {seconds:>8.2f} {saved / seconds:>9.0f} | {peak:>8.1f}')
+        if len(results) == 2:
+            assert tuple(results['legacy']) == tuple(results['chunked']), results
+
+
+if __name__ == '__main__':
+    main()
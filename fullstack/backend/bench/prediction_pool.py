@@ -0,0 +1,95 @@
+"""Benchmark for the Prophet fits in _run_prediction_job(): chunks fitted
+in-process (AI_PREDICTION_WORKERS=1) against the spawn process pool at
+several worker counts.
+
+    python -m bench.prediction_pool                    # 48 items, 1/2/4/cpu workers
+    python -m bench.prediction_pool --items 96 --workers 1 2 4 8
+
+Pool timings include starting the pool, since every job pays for it (spawn
+workers import the app module). The table is only meaningful on a machine
+with at least as many cores as the largest worker count; the script prints
+os.cpu_count() next to it. cmdstanpy logs every fit to stderr, so add
+2>/dev/null to see only the table.
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from bench.common import load_app, measure
+
+HISTORY_ROWS_PER_ITEM = 40
+
+
+def make_series(app, items, seed=0):
+    """Prepared Prophet series for synthetic items, built the way
+    _load_batch_inputs() and _prepare_item_series() build them."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    series = []
+    for n in range(items):
+        incoming = [date(2023, 1, 1) + timedelta(days=int(d)) for d in np.sort(rng.integers(0, 900, HISTORY_ROWS_PER_ITEM))]
+        outgoing = [d + timedelta(days=int(s)) for d, s in zip(incoming, rng.integers(3, 30, HISTORY_ROWS_PER_ITEM))]
+        history = pd.DataFrame({
+            'materialType': 'Foam',
+            'stockQuantity': rng.integers(10, 400, HISTORY_ROWS_PER_ITEM).astype(float),
+            'incomingDate': incoming,
+            'outgoingDate': outgoing,
+            'restockDate': [d + timedelta(days=int(s)) for d, s in zip(outgoing, rng.integers(1, 20, HISTORY_ROWS_PER_ITEM))],
+            'restockQuantity': rng.integers(50, 300, HISTORY_ROWS_PER_ITEM).astype(float),
+        })
+        prepared = app._prepare_item_series({
+            'itemId': f'BENCH-{n:04d}', 'history': history, 'usageByDay': {}, 'material': None,
+        })
+        if prepared is not None:
+            series.append(prepared)
+    return series
+
+
+def fit_inline(app, chunks):
+    return [pred for chunk in chunks for pred in app._fit_item_chunk(chunk)]
+
+
+def fit_pooled(app, chunks, workers):
+    """The pool branch of _run_prediction_job(), without the job bookkeeping."""
+    preds = [None] * len(chunks)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(app._fit_item_chunk, chunk): idx for idx, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            preds[futures[future]] = future.result()
+    return [pred for chunk_preds in preds for pred in chunk_preds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=48, help='items to fit (default 48)')
+    parser.add_argument('--workers', type=int, nargs='+', help='worker counts (default 1, 2, 4 and the cpu count)')
+    parser.add_argument('--chunk-size', type=int, help='items per chunk (default AI_PREDICTION_CHUNK_SIZE)')
+    args = parser.parse_args()
+    app = load_app()
+
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted(set(args.workers or [1, 2, 4, cpus]))
+    chunk_size = args.chunk_size or app.AI_PREDICTION_CHUNK_SIZE
+    series = make_series(app, args.items)
+    chunks = [series[i:i + chunk_size] for i in range(0, len(series), chunk_size)]
+    print(f'{len(series)} items in {len(chunks)} chunks of {chunk_size}, os.cpu_count() = {cpus}')
+
+    print(f"{'workers':>7} | {'seconds':>8} {'items/s':>8} | vs inline")
+    inline_s = None
+    for workers in worker_counts:
+        if workers == 1:
+            preds, seconds, _ = measure(fit_inline, app, chunks, trace_memory=False)
+            inline_s = seconds
+        else:
+            preds, seconds, _ = measure(fit_pooled, app, chunks, workers, trace_memory=False)
+        assert len(preds) == len(series) and all(preds), 'a fit failed'
+        ratio = f'{inline_s / seconds:>8.2f}x' if inline_s else '        -'
+        print(f'{workers:>7} | {seconds:>8.2f} {len(series) / seconds:>8.1f} | {ratio}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Add stored demand forecasts and job kinds
+
+Revision ID: a8c4e2f6d9b3
+Revises: f7a3d9e1b5c2
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c4e2f6d9b3'
+down_revision = 'f7a3d9e1b5c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('prediction_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(length=20), nullable=True, server_default='predictions'))
+
+    op.create_table('demand_forecasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=True),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('forecasted_orders', sa.Float(), nullable=True),
+    sa.Column('orders_lower', sa.Float(), nullable=True),
+    sa.Column('orders_upper', sa.Float(), nullable=True),
+    sa.Column('forecasted_revenue', sa.Float(), nullable=True),
+    sa.Column('revenue_lower', sa.Float(), nullable=True),
+    sa.Column('revenue_upper', sa.Float(), nullable=True),
+    sa.Column('history_periods', sa.Integer(), nullable=True),
+    sa.Column('engine', sa.String(length=20), nullable=True),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_demand_forecasts_granularity_branch_period', 'demand_forecasts', ['granularity', 'branch_id', 'period_start'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_demand_forecasts_granularity_branch_period', table_name='demand_forecasts')
+    op.drop_table('demand_forecasts')
+
+    with op.batch_alter_table('prediction_jobs', schema=None) as batch_op:
+        batch_op.drop_column('kind')
@@ -0,0 +1,31 @@
+"""Store job-order cost components
+
+Revision ID: b3d7f1a9c5e8
+Revises: a8c4e2f6d9b3
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d7f1a9c5e8'
+down_revision = 'a8c4e2f6d9b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left NULL here; the app costs existing orders on startup (backfill_job_order_costs)
+    with op.batch_alter_table('job_orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('material_cost', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('labor_cost', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('overhead_cost', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job_orders', schema=None) as batch_op:
+        batch_op.drop_column('overhead_cost')
+        batch_op.drop_column('labor_cost')
+        batch_op.drop_column('material_cost')
@@ -0,0 +1,59 @@
+"""Add stock movement ledger and snapshots
+
+Revision ID: c6e2a8d4b7f1
+Revises: b3d7f1a9c5e8
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2a8d4b7f1'
+down_revision = 'b3d7f1a9c5e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('item_type', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('delta', sa.Float(), nullable=False),
+    sa.Column('reason', sa.String(length=30), nullable=False),
+    sa.Column('reference', sa.String(length=255), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_movements_item_created', 'stock_movements', ['item_type', 'item_id', 'created_at'], unique=False)
+    op.create_index('ix_stock_movements_branch_created', 'stock_movements', ['branch_id', 'created_at'], unique=False)
+
+    op.create_table('stock_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=False),
+    sa.Column('item_type', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Float(), nullable=False),
+    sa.Column('ledger_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_snapshots_branch_date', 'stock_snapshots', ['branch_id', 'snapshot_date'], unique=False)
+    op.create_index('ix_stock_snapshots_item_date', 'stock_snapshots', ['item_type', 'item_id', 'snapshot_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_stock_snapshots_item_date', table_name='stock_snapshots')
+    op.drop_index('ix_stock_snapshots_branch_date', table_name='stock_snapshots')
+    op.drop_table('stock_snapshots')
+    op.drop_index('ix_stock_movements_branch_created', table_name='stock_movements')
+    op.drop_index('ix_stock_movements_item_created', table_name='stock_movements')
+    op.drop_table('stock_movements')
@@ -0,0 +1,72 @@
+"""Add indexes for hot filter columns
+
+Revision ID: d3a1f7c9e2b4
+Revises: 417211201afc
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a1f7c9e2b4'
+down_revision = '417211201afc'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns) — mirrors the __table_args__ declared on the models
+INDEXES = [
+    ('ix_job_orders_branch_created', 'job_orders', ['branch_id', 'created_at']),
+    ('ix_job_orders_branch_status_created', 'job_orders', ['branch_id', 'status', 'created_at']),
+    ('ix_job_orders_status_created', 'job_orders', ['status', 'created_at']),
+    ('ix_job_orders_created_at', 'job_orders', ['created_at']),
+    ('ix_workers_user_id', 'workers', ['user_id']),
+    ('ix_workers_branch_id', 'workers', ['branch_id']),
+    ('ix_work_tasks_worker_status', 'work_tasks', ['worker_id', 'status']),
+    ('ix_work_tasks_job_order_id', 'work_tasks', ['job_order_id']),
+    ('ix_appointments_branch_date', 'appointments', ['branch_id', 'preferred_date']),
+    ('ix_appointments_preferred_date', 'appointments', ['preferred_date']),
+    ('ix_appointments_user_created', 'appointments', ['user_id', 'created_at']),
+    ('ix_product_orders_branch_created', 'product_orders', ['branch_id', 'created_at']),
+    ('ix_product_orders_pickup_branch', 'product_orders', ['pickup_branch_id']),
+    ('ix_product_orders_user_created', 'product_orders', ['user_id', 'created_at']),
+    ('ix_product_order_transfers_source_created', 'product_order_transfers', ['source_branch_id', 'created_at']),
+    ('ix_product_order_transfers_order_id', 'product_order_transfers', ['product_order_id']),
+    ('ix_inventory_materials_branch_archived_type', 'inventory_materials', ['branch_id', 'is_archived', 'material_type']),
+    ('ix_inventory_materials_archived_type', 'inventory_materials', ['is_archived', 'material_type']),
+    ('ix_premade_products_sku_branch', 'premade_products', ['sku', 'branch_id']),
+    ('ix_premade_products_branch_archived_name', 'premade_products', ['branch_id', 'is_archived', 'name']),
+    ('ix_material_usage_logs_material_created', 'material_usage_logs', ['material_id', 'created_at']),
+    ('ix_material_usage_logs_branch_created', 'material_usage_logs', ['branch_id', 'created_at']),
+    ('ix_material_usage_logs_created_at', 'material_usage_logs', ['created_at']),
+    ('ix_material_waste_logs_branch_created', 'material_waste_logs', ['branch_id', 'created_at']),
+    ('ix_material_waste_logs_material_created', 'material_waste_logs', ['material_id', 'created_at']),
+    ('ix_payment_records_job_order_id', 'payment_records', ['job_order_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+    # Partial index: the low-stock scan only looks at active materials
+    op.create_index(
+        'ix_inventory_materials_active_stock', 'inventory_materials', ['stock_quantity'],
+        unique=False, if_not_exists=True,
+        sqlite_where=sa.text('is_archived IS 0'),
+        postgresql_where=sa.text('is_archived IS false'),
+    )
+    # Expression index for the case-insensitive material name match on job-order completion
+    op.create_index(
+        'ix_inventory_materials_lower_type', 'inventory_materials',
+        [sa.text('lower(material_type)')], unique=False, if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_inventory_materials_lower_type', table_name='inventory_materials', if_exists=True)
+    op.drop_index('ix_inventory_materials_active_stock', table_name='inventory_materials', if_exists=True)
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
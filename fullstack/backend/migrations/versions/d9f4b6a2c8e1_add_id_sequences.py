@@ -0,0 +1,28 @@
+"""Add named id sequences
+
+Revision ID: d9f4b6a2c8e1
+Revises: c6e2a8d4b7f1
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9f4b6a2c8e1'
+down_revision = 'c6e2a8d4b7f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('id_sequences',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('id_sequences')
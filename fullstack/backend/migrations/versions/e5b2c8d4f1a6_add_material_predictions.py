@@ -0,0 +1,109 @@
+"""Store AI predictions one row per item
+
+Revision ID: e5b2c8d4f1a6
+Revises: d3a1f7c9e2b4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+import json
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c8d4f1a6'
+down_revision = 'd3a1f7c9e2b4'
+branch_labels = None
+depends_on = None
+
+
+def _to_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not inspector.has_table('material_predictions'):
+        predictions = op.create_table('material_predictions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.String(length=50), nullable=False),
+        sa.Column('branch_id', sa.Integer(), nullable=True),
+        sa.Column('material_type', sa.String(length=255), nullable=True),
+        sa.Column('color', sa.String(length=100), nullable=True),
+        sa.Column('pattern', sa.String(length=100), nullable=True),
+        sa.Column('current_stock', sa.Float(), nullable=True),
+        sa.Column('avg_daily_usage', sa.Float(), nullable=True),
+        sa.Column('usage_rate', sa.Float(), nullable=True),
+        sa.Column('days_until_stockout', sa.Integer(), nullable=True),
+        sa.Column('stockout_date', sa.Date(), nullable=True),
+        sa.Column('restock_by_date', sa.Date(), nullable=True),
+        sa.Column('suggested_restock_qty', sa.Integer(), nullable=True),
+        sa.Column('avg_lead_time_days', sa.Integer(), nullable=True),
+        sa.Column('confidence', sa.String(length=20), nullable=True),
+        sa.Column('data_source', sa.String(length=20), nullable=True),
+        sa.Column('data_points', sa.Integer(), nullable=True),
+        sa.Column('engine', sa.String(length=30), nullable=True),
+        sa.Column('has_current_inventory', sa.Boolean(), nullable=True),
+        sa.Column('fingerprint', sa.String(length=64), nullable=True),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('item_id')
+        )
+        op.create_index('ix_material_predictions_days_until_stockout', 'material_predictions', ['days_until_stockout'], unique=False)
+        op.create_index('ix_material_predictions_restock_by_date', 'material_predictions', ['restock_by_date'], unique=False)
+        op.create_index('ix_material_predictions_branch_days', 'material_predictions', ['branch_id', 'days_until_stockout'], unique=False)
+    else:
+        predictions = sa.table('material_predictions', sa.column('item_id'))
+
+    # Move the cached JSON blob into rows, then drop the blob column
+    if not inspector.has_table('ai_prediction_cache'):
+        return
+    if 'predictions_json' not in {c['name'] for c in inspector.get_columns('ai_prediction_cache')}:
+        return
+
+    blob = bind.execute(sa.text('SELECT predictions_json FROM ai_prediction_cache LIMIT 1')).scalar()
+    try:
+        rows = json.loads(blob or '[]')
+    except ValueError:
+        rows = []
+    if rows and isinstance(predictions, sa.Table):
+        op.bulk_insert(predictions, [{
+            'item_id': p['itemId'],
+            'branch_id': None,
+            'material_type': p.get('materialType', ''),
+            'color': p.get('color', ''),
+            'pattern': p.get('pattern', ''),
+            'current_stock': p.get('currentStock', 0),
+            'avg_daily_usage': p.get('avgDailyUsage', 0),
+            'usage_rate': p.get('usageRate') or p.get('avgDailyUsage', 0),
+            'days_until_stockout': p.get('daysUntilStockout', 9999),
+            'stockout_date': _to_date(p.get('stockoutDate')),
+            'restock_by_date': _to_date(p.get('restockByDate')),
+            'suggested_restock_qty': p.get('suggestedRestockQty', 0),
+            'avg_lead_time_days': p.get('avgLeadTimeDays', 7),
+            'confidence': p.get('confidence', 'low'),
+            'data_source': p.get('dataSource', 'xlsx'),
+            'data_points': p.get('dataPoints', 0),
+            'engine': p.get('engine', 'prophet'),
+            'has_current_inventory': bool(p.get('hasCurrentInventory')),
+            'fingerprint': None,  # forces a refit on the next recompute
+            'computed_at': datetime.utcnow(),
+        } for p in rows])
+
+    with op.batch_alter_table('ai_prediction_cache', schema=None) as batch_op:
+        batch_op.drop_column('predictions_json')
+
+
+def downgrade():
+    with op.batch_alter_table('ai_prediction_cache', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('predictions_json', sa.Text(), nullable=True))
+
+    op.drop_index('ix_material_predictions_branch_days', table_name='material_predictions')
+    op.drop_index('ix_material_predictions_restock_by_date', table_name='material_predictions')
+    op.drop_index('ix_material_predictions_days_until_stockout', table_name='material_predictions')
+    op.drop_table('material_predictions')
@@ -0,0 +1,45 @@
+"""Add prediction job queue
+
+Revision ID: f7a3d9e1b5c2
+Revises: e5b2c8d4f1a6
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a3d9e1b5c2'
+down_revision = 'e5b2c8d4f1a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('prediction_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('active_key', sa.String(length=20), nullable=True),
+    sa.Column('full_refit', sa.Boolean(), nullable=True),
+    sa.Column('requested_by', sa.Integer(), nullable=True),
+    sa.Column('worker_id', sa.String(length=100), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('cancel_requested', sa.Boolean(), nullable=True),
+    sa.Column('total_items', sa.Integer(), nullable=True),
+    sa.Column('processed_items', sa.Integer(), nullable=True),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['requested_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('active_key')
+    )
+    op.create_index('ix_prediction_jobs_status_created', 'prediction_jobs', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_prediction_jobs_status_created', table_name='prediction_jobs')
+    op.drop_table('prediction_jobs')
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads DATABASE_URL at import time: point it at a throwaway SQLite file
+# so the suite never touches smaeve_system.db or a configured server.
+_DB_DIR = tempfile.mkdtemp(prefix='smaeve_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DB_DIR, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as backend_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def backend():
+    """The app module with its schema created and default data seeded."""
+    with backend_app.app.app_context():
+        backend_app.init_db()
+    backend_app.db_initialized = True
+    return backend_app
+
+
+@pytest.fixture
+def ctx(backend):
+    with backend.app.app_context():
+        yield backend
+        backend.db.session.remove()
+
+
+@pytest.fixture
+def admin_client(backend):
+    """Test client plus Authorization headers for the seeded administrator."""
+    client = backend.app.test_client()
+    response = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'})
+    headers = {'Authorization': 'Bearer ' + response.get_json()['data']['token']}
+    return client, headers
@@ -0,0 +1,97 @@
+"""Regression check for the hot-path indexes: EXPLAIN QUERY PLAN (SQLite) on the
+list-query helpers the endpoints share (app.py, LIST QUERIES) must search one
+of the indexes declared for them, never scan the whole table."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import sqlite
+
+
+def query_plan(backend, query):
+    sql = str(query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+    return [row[3] for row in backend.db.session.execute(backend.db.text('EXPLAIN QUERY PLAN ' + sql)).all()]
+
+
+# (description, query builder, table, indexes the plan may use). The builders
+# call the same list-query helpers in app.py that the endpoints use.
+HOT_QUERIES = [
+    ('job orders by branch',
+     lambda A: A.job_orders_query(branch_id=2),
+     'job_orders', {'ix_job_orders_branch_created', 'ix_job_orders_branch_status_created'}),
+    ('job orders by branch and status',
+     lambda A: A.job_orders_query(branch_id=2, status='pending'),
+     'job_orders', {'ix_job_orders_branch_status_created'}),
+    ('job orders by status',
+     lambda A: A.job_orders_query(status='completed'),
+     'job_orders', {'ix_job_orders_status_created'}),
+    ('job orders in a date range',
+     lambda A: A.job_orders_created_between(datetime(2026, 1, 1), datetime(2026, 1, 31, 23, 59, 59)),
+     'job_orders', {'ix_job_orders_created_at', 'ix_job_orders_status_created'}),
+    ('worker for a user',
+     lambda A: A.worker_for_user_query(5),
+     'workers', {'ix_workers_user_id'}),
+    ('workers at a branch',
+     lambda A: A.branch_workers_query(2),
+     'workers', {'ix_workers_branch_id'}),
+    ('open tasks for a worker',
+     lambda A: A.worker_tasks_query(3, status='pending'),
+     'work_tasks', {'ix_work_tasks_worker_status'}),
+    ('tasks for a job order',
+     lambda A: A.job_order_tasks_query('JO-1'),
+     'work_tasks', {'ix_work_tasks_job_order_id'}),
+    ('appointments at a branch by date',
+     lambda A: A.branch_appointments_query(branch_id=2),
+     'appointments', {'ix_appointments_branch_date'}),
+    ("a customer's appointments",
+     lambda A: A.user_appointments_query(7),
+     'appointments', {'ix_appointments_user_created'}),
+    ('product orders at a branch',
+     lambda A: A.branch_product_orders_query(branch_id=2),
+     'product_orders', {'ix_product_orders_branch_created'}),
+    ('product orders for pickup',
+     lambda A: A.pickup_queue_query(branch_id=2),
+     'product_orders', {'ix_product_orders_pickup_branch'}),
+    ('outgoing transfers',
+     lambda A: A.outgoing_transfers_query(source_branch_id=2),
+     'product_order_transfers', {'ix_product_order_transfers_source_created'}),
+    ('branch raw materials',
+     lambda A: A.raw_materials_query([2]),
+     'inventory_materials', {'ix_inventory_materials_branch_archived_type'}),
+    ('all active raw materials',
+     lambda A: A.raw_materials_query(),
+     'inventory_materials', {'ix_inventory_materials_archived_type'}),
+    ('low stock scan',
+     lambda A: A.low_stock_query(5),
+     'inventory_materials', {'ix_inventory_materials_active_stock', 'ix_inventory_materials_archived_type'}),
+    ('materials by name, case-insensitive',
+     lambda A: A.materials_by_name_query(['foam', 'vinyl'], [2, 1]),
+     'inventory_materials', {'ix_inventory_materials_lower_type', 'ix_inventory_materials_branch_archived_type'}),
+    ('finished good by SKU at a branch',
+     lambda A: A.finished_good_by_sku_query('FG-001', 2),
+     'premade_products', {'ix_premade_products_sku_branch', 'sqlite_autoindex_premade_products_1'}),
+    ('branch finished goods',
+     lambda A: A.finished_goods_query(branch_id=2),
+     'premade_products', {'ix_premade_products_branch_archived_name'}),
+    ('usage history for a material',
+     lambda A: A.material_usage_logs_query(A.material_usage_filters(material_id=1)),
+     'material_usage_logs', {'ix_material_usage_logs_material_created'}),
+    ('usage history for a branch',
+     lambda A: A.material_usage_logs_query(A.material_usage_filters(branch_id=2)),
+     'material_usage_logs', {'ix_material_usage_logs_branch_created'}),
+    ('waste logs for a branch',
+     lambda A: A.waste_logs_query(branch_id=2),
+     'material_waste_logs', {'ix_material_waste_logs_branch_created'}),
+    ('payments for a job order',
+     lambda A: A.job_order_payments_query(1),
+     'payment_records', {'ix_payment_records_job_order_id'}),
+]
+
+
+@pytest.mark.parametrize('description, build, table, indexes', HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(ctx, description, build, table, indexes):
+    plan = query_plan(ctx, build(ctx))
+    steps = [step for step in plan if f' {table} ' in f' {step} ']
+    assert steps, plan
+    for step in steps:
+        assert not step.startswith(f'SCAN {table}') or 'INDEX' in step, f'full table scan: {plan}'
+    assert any(name in step for step in steps for name in indexes), f'expected one of {sorted(indexes)}: {plan}'
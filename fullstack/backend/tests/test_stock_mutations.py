@@ -0,0 +1,128 @@
+"""Concurrent decrements through apply_stock_deltas(): the conditional UPDATE
+must never let stock go below zero or lose an update, and every applied change
+must be in the ledger."""
+import threading
+
+import pytest
+
+from sqlalchemy.exc import OperationalError
+
+THREADS = 8
+ATTEMPTS_PER_THREAD = 50
+INITIAL_STOCK = 300  # less than THREADS * ATTEMPTS_PER_THREAD, so some must fail
+
+
+def test_concurrent_decrements_never_oversell(ctx):
+    A = ctx
+    material = A.InventoryMaterial(material_type='Stress Foam', branch_id=2, stock_quantity=INITIAL_STOCK)
+    A.db.session.add(material)
+    A.db.session.commit()
+    material_id = material.id
+    A.db.session.remove()
+
+    lock = threading.Lock()
+    applied, insufficient = [0], [0]
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        with A.app.app_context():
+            start.wait()
+            for _ in range(ATTEMPTS_PER_THREAD):
+                while True:
+                    try:
+                        A.apply_stock_deltas(A.InventoryMaterial, {material_id: -1}, 'adjustment', 'stress test')
+                        A.db.session.commit()
+                        outcome = applied
+                    except A.InsufficientStock:
+                        A.db.session.rollback()
+                        outcome = insufficient
+                    except OperationalError:
+                        A.db.session.rollback()  # SQLite busy: retry the same attempt
+                        continue
+                    break
+                with lock:
+                    outcome[0] += 1
+            A.db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stock = A.db.session.get(A.InventoryMaterial, material_id).stock_quantity
+    ledger = A.db.session.query(A.db.func.coalesce(A.db.func.sum(A.StockMovement.delta), 0)).filter(
+        A.StockMovement.item_type == 'material', A.StockMovement.item_id == material_id
+    ).scalar()
+
+    assert applied[0] + insufficient[0] == THREADS * ATTEMPTS_PER_THREAD
+    assert stock >= 0
+    assert applied[0] == INITIAL_STOCK and stock == 0
+    assert insufficient[0] == THREADS * ATTEMPTS_PER_THREAD - INITIAL_STOCK
+    assert ledger == stock - INITIAL_STOCK
+
+
+def test_insufficient_stock_leaves_row_and_ledger_untouched(ctx):
+    A = ctx
+    material = A.InventoryMaterial(material_type='Short Vinyl', branch_id=2, stock_quantity=2)
+    A.db.session.add(material)
+    A.db.session.commit()
+
+    try:
+        A.apply_stock_deltas(A.InventoryMaterial, {material.id: -3}, 'adjustment', 'too much')
+    except A.InsufficientStock as e:
+        assert (e.available, e.required) == (2, 3)
+        A.db.session.rollback()
+    else:
+        raise AssertionError('InsufficientStock not raised')
+
+    assert A.db.session.get(A.InventoryMaterial, material.id).stock_quantity == 2
+    assert A.StockMovement.query.filter_by(item_type='material', item_id=material.id).count() == 0
+
+
+@pytest.mark.parametrize('branch_id, expected_ledger', [(2, {2: 20}), (3, {2: 0, 3: 20})], ids=['same branch', 'branch move'])
+def test_manual_edit_ledger_includes_concurrent_change(ctx, admin_client, monkeypatch, branch_id, expected_ledger):
+    """A decrement committed between the edit form loading the row and writing
+    the new stock must still leave ledger sum == stock."""
+    A = ctx
+    client, headers = admin_client
+    material = A.InventoryMaterial(material_type='Edited Foam', branch_id=2, stock_quantity=0)
+    A.db.session.add(material)
+    A.db.session.flush()
+    A.record_stock_movements(A.InventoryMaterial, [(material.id, 2, 10)], 'opening')
+    material.stock_quantity = 10
+    A.db.session.commit()
+    material_id = material.id
+
+    concurrent = []
+
+    def concurrent_decrement():
+        with A.app.app_context():
+            try:
+                A.apply_stock_deltas(A.InventoryMaterial, {material_id: -3}, 'waste', 'concurrent')
+                A.db.session.commit()
+                concurrent.append('committed')
+            except Exception as e:
+                concurrent.append(repr(e))
+
+    original = A._record_manual_stock_change
+
+    def interleaved(*args, **kwargs):
+        thread = threading.Thread(target=concurrent_decrement)
+        thread.start()
+        thread.join()
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(A, '_record_manual_stock_change', interleaved)
+    response = client.put(f'/api/inventory/raw-materials/{material_id}', headers=headers,
+                          json={'stockQuantity': 20, **({'branchId': branch_id} if branch_id != 2 else {})})
+    assert response.status_code == 200, response.get_json()
+    assert concurrent == ['committed']
+
+    A.db.session.expire_all()
+    material = A.db.session.get(A.InventoryMaterial, material_id)
+    ledger = dict(A.db.session.query(A.StockMovement.branch_id, A.db.func.sum(A.StockMovement.delta)).filter(
+        A.StockMovement.item_type == 'material', A.StockMovement.item_id == material_id
+    ).group_by(A.StockMovement.branch_id).all())
+    assert (material.stock_quantity, material.branch_id) == (20, branch_id)
+    assert ledger == expected_ledger
@@ -1,7 +1,7 @@
 ﻿'use client';
 import { useState, useEffect, useMemo, useRef } from 'react';
 import { useAuth } from '@/context/AuthContext';
-import { api, RawMaterial, FinishedGood, MaterialUsageLog, Supplier, MaterialWasteLog, AIStatus } from '@/lib/api';
+import { api, RawMaterial, FinishedGood, MaterialUsageLog, Supplier, MaterialWasteLog, AIStatus, AIProgress } from '@/lib/api';
 import Link from 'next/link';
 
 type TabType = 'raw-materials' | 'finished-goods' | 'material-usage' | 'purchase-orders' | 'suppliers' | 'waste-log' | 'ai-predictions';
@@ -103,17 +103,37 @@ export default function InventoryPage() {
     if (activeTab === 'ai-predictions') fetchAIPredictions();
   }, [activeTab]);
 
+  // While computing, follow progress over the status stream and fetch the full
+  // predictions once on completion. Falls back to polling the small status endpoint.
   useEffect(() => {
     if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
-    if (aiStatus?.status === 'computing') {
+    if (aiStatus?.status !== 'computing') return;
+    const controller = new AbortController();
+    let completed = false;
+    const applyProgress = (progress: AIProgress) => {
+      if (progress.status === 'computing') {
+        setAiStatus(prev => prev ? { ...prev, totalItems: progress.totalItems, processedItems: progress.processedItems } : prev);
+      } else if (!completed) {
+        completed = true;
+        fetchAIPredictions();
+      }
+    };
+    const startPolling = () => {
+      if (controller.signal.aborted || completed) return;
       pollRef.current = setInterval(async () => {
         try {
-          const res = await api.inventory.ai.getPredictions();
-          if (res.data) setAiStatus(res.data);
+          const res = await api.inventory.ai.getStatus();
+          if (res.data) applyProgress(res.data);
         } catch { /* ignore */ }
       }, 3000);
-    }
-    return () => { if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; } };
+    };
+    // The server closes the stream after a while; keep following by polling
+    api.inventory.ai.streamStatus((_, progress) => applyProgress(progress), controller.signal)
+      .then(startPolling, startPolling);
+    return () => {
+      controller.abort();
+      if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
+    };
   }, [aiStatus?.status]);
 
   useEffect(() => {
@@ -1024,7 +1044,7 @@ export default function InventoryPage() {
                   Upload Historical Data
                 </h2>
                 <p className="text-sm text-gray-500 mt-1">
-                  Upload an Excel file (.xlsx) with columns: <span className="font-mono text-xs bg-gray-100 px-1 rounded">Item_ID, Stock_Quantity, Incoming_Date, Outgoing_Date</span>. Optional: <span className="font-mono text-xs bg-gray-100 px-1 rounded">Restock_Date, Restock_Quantity, Restock_Cycle</span>
+                  Upload an Excel (.xlsx), CSV or Parquet file with columns: <span className="font-mono text-xs bg-gray-100 px-1 rounded">Item_ID, Stock_Quantity, Incoming_Date, Outgoing_Date</span>. Optional: <span className="font-mono text-xs bg-gray-100 px-1 rounded">Restock_Date, Restock_Quantity, Restock_Cycle</span>
                 </p>
                 {aiStatus?.lastUploadedAt && (
                   <p className="text-xs text-gray-400 mt-1">
@@ -1038,7 +1058,7 @@ export default function InventoryPage() {
                     <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-8l-4-4m0 0L8 8m4-4v12" />
                   </svg>
                   {uploading ? 'Uploading...' : 'Choose File'}
-                  <input type="file" accept=".xlsx,.xls" className="hidden" disabled={uploading} onChange={handleUploadHistorical} />
+                  <input type="file" accept=".xlsx,.xls,.csv,.parquet" className="hidden" disabled={uploading} onChange={handleUploadHistorical} />
                 </label>
                 {aiStatus?.uploadRows && aiStatus.uploadRows > 0 && aiStatus.status !== 'computing' && (
                   <button onClick={handleRecompute} className="inline-flex items-center gap-2 px-3 py-2 rounded-lg border border-gray-200 text-sm text-gray-600 hover:bg-gray-50 transition-colors">
@@ -1731,6 +1751,13 @@ export default function InventoryPage() {
                               medium: 'bg-yellow-100 text-yellow-700',
                               high: 'bg-green-100 text-green-700',
                             };
+                            const engineLabels: Record<string, string> = {
+                              prophet: 'Prophet',
+                              croston: 'Croston',
+                              ses: 'Exp. smoothing',
+                              moving_average: 'Moving avg.',
+                              mean: 'Mean',
+                            };
                             return (
                               <tr key={p.itemId} className={`hover:bg-gray-50 transition-colors ${isUrgent ? 'bg-red-50/30' : ''}`}>
                                 <td className="px-4 py-3">
@@ -1765,6 +1792,9 @@ export default function InventoryPage() {
                                     <span className={`inline-block px-2 py-0.5 rounded-full text-xs font-medium ${confColors[p.confidence]}`}>
                                       {p.confidence.charAt(0).toUpperCase() + p.confidence.slice(1)} conf.
                                     </span>
+                                    {p.engine && (
+                                      <span className="text-xs text-gray-400">{engineLabels[p.engine] ?? p.engine}</span>
+                                    )}
                                   </div>
                                 </td>
                               </tr>
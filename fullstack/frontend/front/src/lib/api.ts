@@ -260,8 +260,59 @@ export interface MaterialWasteLog {
   createdAt: string;
 }
 
+export interface StockMovement {
+  id: number;
+  itemType: 'material' | 'product';
+  itemId: number;
+  branchId: number;
+  delta: number;
+  reason: string;
+  reference: string | null;
+  createdBy: number | null;
+  createdAt: string | null;
+}
+
+export interface StockLevel {
+  itemType: 'material' | 'product';
+  itemId: number;
+  name: string | null;
+  branchId: number;
+  quantity: number;
+}
+
+export interface StockTakeLine {
+  materialId?: number;
+  itemId?: string;
+  countedQuantity: number;
+}
+
+export interface StockTakeAdjustment {
+  materialId: number;
+  itemId: string | null;
+  materialType: string;
+  systemQuantity: number;
+  countedQuantity: number;
+  variance: number;
+  varianceValue: number;
+}
+
+export interface StockTakeSummary {
+  branchId: number;
+  linesCounted: number;
+  matched: number;
+  adjusted: number;
+  increased: number;
+  decreased: number;
+  netVariance: number;
+  netVarianceValue: number;
+  uncounted: number;
+  adjustments: StockTakeAdjustment[];
+  reference: string | null;
+}
+
 export interface AIPrediction {
   itemId: string;
+  branchId: number | null;
   materialType: string;
   color: string;
   pattern: string;
@@ -275,6 +326,7 @@ export interface AIPrediction {
   confidence: 'low' | 'medium' | 'high';
   dataSource: 'xlsx' | 'hybrid' | 'live';
   dataPoints: number;
+  engine: 'prophet' | 'croston' | 'ses' | 'moving_average' | 'mean';
   hasCurrentInventory: boolean;
 }
 
@@ -288,6 +340,47 @@ export interface AIStatus {
   lastUploadedAt: string | null;
   computedAt: string | null;
   error: string | null;
+  summary: { total: number; urgentCount: number; soonCount: number };
+  pagination: { page: number; pageSize: number; total: number; totalPages: number } | null;
+  job: AIPredictionJob | null;
+}
+
+export interface AIProgress {
+  status: 'idle' | 'computing' | 'done' | 'error';
+  jobId: number | null;
+  jobStatus: AIPredictionJob['status'] | null;
+  totalItems: number;
+  processedItems: number;
+  computedAt: string | null;
+  error: string | null;
+}
+
+export interface AIPredictionJob {
+  id: number;
+  kind: 'predictions' | 'demand';
+  status: 'queued' | 'running' | 'done' | 'error' | 'cancelled';
+  fullRefit: boolean;
+  requestedBy: number | null;
+  workerId: string | null;
+  attempts: number;
+  cancelRequested: boolean;
+  totalItems: number;
+  processedItems: number;
+  error: string | null;
+  createdAt: string | null;
+  startedAt: string | null;
+  finishedAt: string | null;
+}
+
+export interface AIPredictionQuery {
+  urgency?: 'all' | 'urgent' | 'soon' | 'ok';
+  period?: 'week' | 'month' | 'quarter';
+  branchId?: number;
+  search?: string;
+  sort?: 'daysUntilStockout' | 'restockByDate' | 'avgDailyUsage' | 'currentStock' | 'itemId' | 'materialType';
+  order?: 'asc' | 'desc';
+  page?: number;
+  pageSize?: number;
 }
 
 export interface InventoryForecastData {
@@ -403,6 +496,24 @@ export interface MaterialUsageLog {
   usedAt: string;
 }
 
+export interface MaterialUsageQuery {
+  branchId?: number;
+  materialId?: number;
+  startDate?: string;
+  endDate?: string;
+}
+
+/** One group of /material-usage?groupBy=...; only the grouped keys are present */
+export interface MaterialUsageTotal {
+  materialId?: number;
+  materialName?: string | null;
+  day?: string;
+  branchId?: number;
+  branchName?: string | null;
+  totalQuantity: number;
+  logCount: number;
+}
+
 export interface JobOrderItem {
   name: string;
   quantity: number;
@@ -621,6 +732,41 @@ export interface CostingData {
   variance: number;
 }
 
+export interface CostVarianceRow {
+  jobOrderId: string;
+  customerName: string;
+  branchId: number;
+  month: string;
+  estimatedCost: number;
+  actualCost: number;
+  variance: number;
+  variancePercent: number;
+  status: 'over' | 'under' | 'on_target';
+  outlier: boolean;
+}
+
+export interface CostVarianceRollup {
+  branchId: number;
+  branchName: string;
+  month: string;
+  orders: number;
+  estimatedCost: number;
+  actualCost: number;
+  variance: number;
+  avgVariancePercent: number;
+  overCount: number;
+  underCount: number;
+}
+
+export interface CostVarianceSummary {
+  orders: number;
+  percentiles: Record<string, number>;
+  outlierBounds: { low: number; high: number } | null;
+  outliers: number;
+  meanVariancePercent?: number;
+  totalVariance?: number;
+}
+
 export interface Receipt {
   receiptNumber: string;
   date: string;
@@ -651,18 +797,35 @@ export interface AnalyticsData {
 
 export interface ForecastItem {
   month: string;
+  periodStart: string;
+  granularity: 'month' | 'week';
+  branchId: number | null;
   forecastedOrders: number;
+  ordersLower: number;
+  ordersUpper: number;
   forecastedRevenue: number;
+  revenueLower: number;
+  revenueUpper: number;
   confidence: number;
+  engine: string;
+  historyPeriods: number;
 }
 
 export interface MaterialForecast {
   materialId: number;
+  itemId: string | null;
   name: string;
+  branchId: number;
   currentStock: number;
   reorderPoint: number;
   dailyUsage: number;
+  usageRates: Record<string, number>;
+  trend: 'rising' | 'falling' | 'stable';
+  trendPerDay: number;
+  wasteShare: number;
+  leadTimeDays: number;
   daysUntilReorder: number;
+  reorderDate: string | null;
   recommendedOrderQty: number;
   urgency: 'high' | 'medium' | 'low';
 }
@@ -882,6 +1045,23 @@ export const api = {
         body: JSON.stringify(material),
       }),
     
+    // Per-row validation failures come back in `errors` (row = sheet row number)
+    importRawMaterials: async (file: File, branchId?: number): Promise<ApiResponse<{ imported: number; ids: number[] }> & {
+      errors?: { row: number; errors: string[] }[];
+      errorCount?: number;
+    }> => {
+      const token = getAuthToken();
+      const formData = new FormData();
+      formData.append('file', file);
+      if (branchId) formData.append('branchId', String(branchId));
+      const response = await fetch(`${API_BASE_URL}/api/inventory/raw-materials/import`, {
+        method: 'POST',
+        headers: { ...(token && { Authorization: `Bearer ${token}` }) },
+        body: formData,
+      });
+      return response.json();
+    },
+
     updateRawMaterial: (id: number, material: Partial<RawMaterialInput>) =>
       fetchApi<RawMaterial>(`/api/inventory/raw-materials/${id}`, {
         method: 'PUT',
@@ -914,11 +1094,28 @@ export const api = {
         body: JSON.stringify(item),
       }),
 
-    getMaterialUsage: (params?: { branchId?: number; materialId?: number }) => {
+    getMaterialUsage: (params?: MaterialUsageQuery & { limit?: number; cursor?: string }) => {
       const query = new URLSearchParams();
       if (params?.branchId) query.append('branchId', params.branchId.toString());
       if (params?.materialId) query.append('materialId', params.materialId.toString());
-      return fetchApi<MaterialUsageLog[]>(`/api/inventory/material-usage?${query}`);
+      if (params?.startDate) query.append('startDate', params.startDate);
+      if (params?.endDate) query.append('endDate', params.endDate);
+      if (params?.limit) query.append('limit', params.limit.toString());
+      if (params?.cursor) query.append('cursor', params.cursor);
+      return fetchApi<MaterialUsageLog[]>(`/api/inventory/material-usage?${query}`) as Promise<
+        ApiResponse<MaterialUsageLog[]> & { nextCursor: string | null }
+      >;
+    },
+
+    getMaterialUsageTotals: (groupBy: ('material' | 'day' | 'branch')[], params?: MaterialUsageQuery) => {
+      const query = new URLSearchParams({ groupBy: groupBy.join(',') });
+      if (params?.branchId) query.append('branchId', params.branchId.toString());
+      if (params?.materialId) query.append('materialId', params.materialId.toString());
+      if (params?.startDate) query.append('startDate', params.startDate);
+      if (params?.endDate) query.append('endDate', params.endDate);
+      return fetchApi<MaterialUsageTotal[]>(`/api/inventory/material-usage?${query}`) as Promise<
+        ApiResponse<MaterialUsageTotal[]> & { truncated: boolean }
+      >;
     },
     
     // Public Products (for customer ordering)
@@ -953,10 +1150,108 @@ export const api = {
     createWasteLog: (data: { materialId: number; quantity: number; reason: string; notes?: string; branchId?: number }) =>
       fetchApi<MaterialWasteLog>('/api/inventory/waste-logs', { method: 'POST', body: JSON.stringify(data) }),
 
+    // Stock ledger
+    getStockMovements: (params?: {
+      itemType?: 'material' | 'product'; itemId?: number; branchId?: number; reason?: string;
+      startDate?: string; endDate?: string; beforeId?: number; limit?: number;
+    }) => {
+      const query = new URLSearchParams();
+      Object.entries(params ?? {}).forEach(([key, value]) => {
+        if (value !== undefined && value !== '') query.append(key, String(value));
+      });
+      return fetchApi<StockMovement[]>(`/api/inventory/stock-movements?${query}`) as Promise<
+        ApiResponse<StockMovement[]> & { nextCursor?: number | null }
+      >;
+    },
+    getStockOnDate: (date: string, params?: { branchId?: number; itemType?: 'material' | 'product' }) => {
+      const query = new URLSearchParams({ date });
+      if (params?.branchId) query.append('branchId', params.branchId.toString());
+      if (params?.itemType) query.append('itemType', params.itemType);
+      return fetchApi<StockLevel[]>(`/api/inventory/stock-on-date?${query}`);
+    },
+    takeStockSnapshot: (data?: { date?: string; branchId?: number }) =>
+      fetchApi<{ rows: number; date: string }>('/api/inventory/stock-snapshots', { method: 'POST', body: JSON.stringify(data ?? {}) }),
+    // Per-line validation failures come back in `errors`; dryRun previews without applying
+    submitStockTake: async (data: { branchId: number; lines: StockTakeLine[]; notes?: string; dryRun?: boolean }): Promise<
+      ApiResponse<StockTakeSummary> & { errors?: { line: number; errors: string[] }[]; errorCount?: number }
+    > => {
+      const token = getAuthToken();
+      const response = await fetch(`${API_BASE_URL}/api/inventory/stock-takes`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...(token && { Authorization: `Bearer ${token}` }) },
+        body: JSON.stringify(data),
+      });
+      const result = await response.json();
+      // A 400 carries the per-line validation errors; anything else is a failure
+      if (!response.ok && response.status !== 400) throw new Error(result.message || `Stock take failed: ${response.status}`);
+      return result;
+    },
+
+    // Streams a file download; resolves to the file contents
+    exportInventory: async (
+      kind: 'raw-materials' | 'finished-goods',
+      params?: { format?: 'csv' | 'xlsx'; branchId?: number; category?: string; includeArchived?: boolean | 'only' },
+    ): Promise<Blob> => {
+      const token = getAuthToken();
+      const query = new URLSearchParams({ format: params?.format ?? 'csv' });
+      if (params?.branchId) query.append('branchId', String(params.branchId));
+      if (params?.category) query.append('category', params.category);
+      if (params?.includeArchived !== undefined) query.append('includeArchived', String(params.includeArchived));
+      const response = await fetch(`${API_BASE_URL}/api/inventory/export/${kind}?${query}`, {
+        headers: { ...(token && { Authorization: `Bearer ${token}` }) },
+      });
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.message || `Export failed: ${response.status}`);
+      }
+      return response.blob();
+    },
+
     // AI Predictions
     ai: {
-      getPredictions: () => fetchApi<AIStatus>('/api/inventory/ai/predictions'),
-      recompute: () => fetchApi<{ message: string }>('/api/inventory/ai/recompute', { method: 'POST' }),
+      getPredictions: (params?: AIPredictionQuery) => {
+        const query = new URLSearchParams();
+        if (params?.urgency && params.urgency !== 'all') query.append('urgency', params.urgency);
+        if (params?.period) query.append('period', params.period);
+        if (params?.branchId) query.append('branchId', params.branchId.toString());
+        if (params?.search) query.append('search', params.search);
+        if (params?.sort) query.append('sort', params.sort);
+        if (params?.order) query.append('order', params.order);
+        if (params?.page) query.append('page', params.page.toString());
+        if (params?.pageSize) query.append('pageSize', params.pageSize.toString());
+        return fetchApi<AIStatus>(`/api/inventory/ai/predictions?${query}`);
+      },
+      recompute: (full?: boolean) => fetchApi<AIPredictionJob>(`/api/inventory/ai/recompute${full ? '?full=true' : ''}`, { method: 'POST' }),
+      getStatus: () => fetchApi<AIProgress>('/api/inventory/ai/status'),
+      // Server-sent progress events; resolves when the stream ends. Uses fetch
+      // rather than EventSource so the auth header can be sent.
+      streamStatus: async (onEvent: (event: 'progress' | 'complete', progress: AIProgress) => void, signal?: AbortSignal): Promise<void> => {
+        const token = getAuthToken();
+        const response = await fetch(`${API_BASE_URL}/api/inventory/ai/status/stream`, {
+          headers: { ...(token && { Authorization: `Bearer ${token}` }) },
+          signal,
+        });
+        if (!response.ok || !response.body) throw new Error(`Status stream failed: ${response.status}`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+          const { done, value } = await reader.read();
+          if (done) return;
+          buffer += decoder.decode(value, { stream: true });
+          let boundary;
+          while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const event = message.match(/^event: (.*)$/m)?.[1];
+            const data = message.match(/^data: (.*)$/m)?.[1];
+            if ((event === 'progress' || event === 'complete') && data) onEvent(event, JSON.parse(data));
+          }
+        }
+      },
+      getJobs: () => fetchApi<AIPredictionJob[]>('/api/inventory/ai/jobs'),
+      getJob: (jobId: number) => fetchApi<AIPredictionJob>(`/api/inventory/ai/jobs/${jobId}`),
+      cancelJob: (jobId: number) => fetchApi<AIPredictionJob>(`/api/inventory/ai/jobs/${jobId}/cancel`, { method: 'POST' }),
       uploadHistorical: async (file: File): Promise<ApiResponse<{ rowsSaved: number; uniqueItems: number; message: string }>> => {
         const token = getAuthToken();
         const formData = new FormData();
@@ -1070,15 +1365,15 @@ export const api = {
         body: JSON.stringify(data),
       }),
     
-    getVarianceReport: () => fetchApi<Array<{
-      jobOrderId: string;
-      customerName: string;
-      estimatedCost: number;
-      actualCost: number;
-      variance: number;
-      variancePercent: number;
-      status: string;
-    }>>('/api/costing/variance-report'),
+    getVarianceReport: (params?: { startDate?: string; endDate?: string; branchId?: number }) => {
+      const query = new URLSearchParams();
+      if (params?.startDate) query.append('startDate', params.startDate);
+      if (params?.endDate) query.append('endDate', params.endDate);
+      if (params?.branchId) query.append('branchId', params.branchId.toString());
+      return fetchApi<CostVarianceRow[]>(`/api/costing/variance-report?${query}`) as Promise<
+        ApiResponse<CostVarianceRow[]> & { rollups?: CostVarianceRollup[]; summary?: CostVarianceSummary }
+      >;
+    },
     
     generateReceipt: (orderId: number) => fetchApi<Receipt>(`/api/costing/receipt/${orderId}`),
   },
@@ -1340,8 +1635,18 @@ export const api = {
   // FORECASTING
   // ==================
   forecasting: {
-    getDemandForecast: () => fetchApi<ForecastItem[]>('/api/forecasting/demand'),
-    getMaterialForecast: () => fetchApi<MaterialForecast[]>('/api/forecasting/materials'),
+    getDemandForecast: (params?: { granularity?: 'month' | 'week'; branchId?: number }) => {
+      const query = new URLSearchParams();
+      if (params?.granularity) query.append('granularity', params.granularity);
+      if (params?.branchId) query.append('branchId', params.branchId.toString());
+      return fetchApi<ForecastItem[]>(`/api/forecasting/demand?${query}`);
+    },
+    recomputeDemandForecast: () =>
+      fetchApi<AIPredictionJob>('/api/forecasting/demand/recompute', { method: 'POST' }),
+    getMaterialForecast: (branchId?: number) => {
+      const query = branchId ? `?branchId=${branchId}` : '';
+      return fetchApi<MaterialForecast[]>(`/api/forecasting/materials${query}`);
+    },
     getInventoryForecast: (params?: { period?: string }) => {
       const q = params?.period ? `?period=${params.period}` : '';
       return fetchApi<InventoryForecastData>(`/api/forecasting/inventory${q}`);